@@ -0,0 +1,190 @@
+from util.thread import AtomicInteger, batch_producer, batch_consumer
+from util.kinesis import list_shard_ranges, PutStats
+from util.codec import get_codec, DEFAULT_STRUCT_LAYOUT
+from util.emulator import Emulator
+from util.results import save_run
+
+import argparse
+import itertools
+import json
+import os
+import threading
+import time
+from queue import Queue
+
+# Self-benchmark of the producer path: batch_producer and batch_consumer
+# drive a sink that accepts everything, so the harness is the only
+# bottleneck. Reports the delivered records/s, the harness CPU time per
+# record and the schedule lag of the open-loop producer (jitter).
+#   python bench.py                  run the matrix, compare with the baseline
+#   python bench.py --save-baseline  run the matrix and make it the baseline
+SINKS = ['null', 'memory', 'emulated']
+BATCH_SIZES = [100, 500]
+THREAD_COUNTS = [1, 4, 10]
+PAYLOAD_SIZES = [0, 100, 1000]
+CODECS = ['json', 'orjson', 'msgpack', 'struct']
+# Target rate (records/s), far above what the harness can deliver
+BENCH_RATE = 200000
+DURATION = 2
+QUICK = {'batch_size': [500], 'num_threads': [4], 'payload_size': [100], 'codec': ['json']}
+
+BASELINE_FILE = 'bench/baseline.json'
+# Relative change that counts as a regression
+TOLERANCE = 0.15
+STREAM_NAME = 'bench'
+NULL_RESULT = {'SequenceNumber': '0', 'ShardId': 'shardId-000000000000'}
+
+class NullKinesisClient:
+    def put_records(self, StreamName, Records):
+        return {'FailedRecordCount': 0, 'Records': [NULL_RESULT] * len(Records)}
+
+class MemoryKinesisClient:
+    # Keeps every record, like a stream without limits or consumers
+    def __init__(self):
+        self.records = []
+        self._lock = threading.Lock()
+
+    def put_records(self, StreamName, Records):
+        with self._lock:
+            self.records.extend(Records)
+        return {'FailedRecordCount': 0, 'Records': [NULL_RESULT] * len(Records)}
+
+def make_sink(sink):
+    # Returns (kinesis_client, shard_ranges)
+    if sink == 'null':
+        return NullKinesisClient(), None
+    if sink == 'memory':
+        return MemoryKinesisClient(), None
+    if sink == 'emulated':
+        # Shard limits high enough to never throttle, and no consuming function
+        emulator = Emulator()
+        emulator.create_stream(STREAM_NAME, shard_count=4, records_per_second=1e9, bytes_per_second=1e12)
+        client = emulator.clients()['kinesis']
+        return client, list_shard_ranges(client, STREAM_NAME)
+    raise ValueError(f"Unknown sink {sink}, choose from {SINKS}")
+
+def make_codec(codec, payload_size):
+    if codec == 'struct':
+        layout = DEFAULT_STRUCT_LAYOUT + ([('payload', 's')] if payload_size else [])
+        return get_codec(codec, layout=layout)
+    return get_codec(codec)
+
+def run_case(sink, batch_size, num_threads, payload_size, codec, rate=BENCH_RATE, duration=DURATION):
+    kinesis_client, shard_ranges = make_sink(sink)
+    codec = make_codec(codec, payload_size)
+    if payload_size:
+        # One shared row; every message copies its payload field
+        records = [['x' * payload_size]] * (int(rate * duration) + 2 * batch_size)
+        input_map = {'payload': 0}
+    else:
+        records = None
+        input_map = None
+    put_stats = PutStats()
+    batch_queue = Queue()
+    producer_stats = {}
+
+    start_perf = time.perf_counter()
+    start_cpu = time.process_time()
+    input_threads = []
+    for _ in range(num_threads):
+        thread = threading.Thread(
+            target=batch_consumer,
+            args=(kinesis_client, batch_queue, STREAM_NAME, None, shard_ranges, False, None, put_stats, codec),
+            # A line per request would cost more than some sinks
+            kwargs={'verbose': False}
+        )
+        input_threads.append(thread)
+        thread.start()
+    batch_producer(records, AtomicInteger(1), batch_size, input_map, batch_queue,
+                   time.time() + duration, rate, num_threads, producer_stats)
+    for thread in input_threads:
+        thread.join()
+    elapsed = time.perf_counter() - start_perf
+    cpu = time.process_time() - start_cpu
+
+    sent = put_stats.summary()['sent']
+    return {
+        'records': sent,
+        'records_per_second': sent / elapsed if elapsed > 0 else 0,
+        'cpu_us_per_record': cpu / sent * 1e6 if sent else 0,
+        'producer_rate': producer_stats['achieved_rate'],
+        'max_lag_ms': producer_stats['max_lag'] * 1000,
+        'mean_lag_ms': producer_stats['mean_lag'] * 1000,
+    }
+
+def case_key(case):
+    return f"{case['sink']}-b{case['batch_size']}-t{case['num_threads']}-p{case['payload_size']}-{case['codec']}"
+
+def expand_cases(matrix):
+    axes = ['sink', 'batch_size', 'num_threads', 'payload_size', 'codec']
+    return [dict(zip(axes, values)) for values in itertools.product(*(matrix[axis] for axis in axes))]
+
+def load_baseline(file_path=BASELINE_FILE):
+    if not os.path.exists(file_path):
+        return {}
+    with open(file_path, 'r') as file:
+        return json.load(file)
+
+def save_baseline(results, file_path=BASELINE_FILE):
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    with open(file_path, 'w') as file:
+        json.dump(results, file, indent=2, sort_keys=True)
+    print(f"Saved baseline of {len(results)} cases to {file_path}")
+
+def compare(result, baseline, tolerance=TOLERANCE):
+    # Returns the regressed metrics of one case
+    regressions = []
+    if result['records_per_second'] < baseline['records_per_second'] * (1 - tolerance):
+        regressions.append('records_per_second')
+    if result['cpu_us_per_record'] > baseline['cpu_us_per_record'] * (1 + tolerance):
+        regressions.append('cpu_us_per_record')
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the producer path against local sinks")
+    parser.add_argument('--quick', action='store_true', help="one case per sink")
+    parser.add_argument('--sink', action='append', choices=SINKS, help="only these sinks")
+    parser.add_argument('--save-baseline', action='store_true', help="store the results as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    args = parser.parse_args()
+
+    matrix = {
+        'sink': args.sink or SINKS,
+        'batch_size': BATCH_SIZES,
+        'num_threads': THREAD_COUNTS,
+        'payload_size': PAYLOAD_SIZES,
+        'codec': CODECS,
+    }
+    if args.quick:
+        matrix.update(QUICK)
+    baseline = load_baseline()
+    results = {}
+    regressed = []
+    for case in expand_cases(matrix):
+        key = case_key(case)
+        try:
+            result = run_case(**case)
+        except ImportError as e:
+            print(f"Skipping {key}: {e}")
+            continue
+        results[key] = result
+        line = (f"{key}: {result['records_per_second']:.0f} records/s, "
+                f"{result['cpu_us_per_record']:.2f} us CPU/record, "
+                f"schedule lag max {result['max_lag_ms']:.2f} ms mean {result['mean_lag_ms']:.2f} ms")
+        if key in baseline:
+            regressions = compare(result, baseline[key], args.tolerance)
+            if regressions:
+                regressed.append(key)
+                line += f"  REGRESSION in {', '.join(regressions)} (baseline {baseline[key]['records_per_second']:.0f} records/s, {baseline[key]['cpu_us_per_record']:.2f} us CPU/record)"
+        print(line)
+        save_run('harness_bench', {}, case, result)
+
+    if args.save_baseline:
+        save_baseline({**baseline, **results})
+    if regressed:
+        print(f"{len(regressed)} of {len(results)} cases regressed")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,74 +1,44 @@
-import boto3
-import json
-import time
-import csv
-
-# Initialize a session using Amazon Kinesis
-kinesis_client = boto3.client('kinesis', region_name='ap-southeast-2')
-stream_name = 'mo_score'
-
-# Function to put records to the Kinesis stream
-def put_to_stream_batch(stream_name, records):
-    try:
-        response = kinesis_client.put_records(
-            StreamName=stream_name,
-            Records=records
-        )
-        print(response)
-        return response
-    except Exception as e:
-        print(f"Error putting records to stream: {e}")
-        return None
-    
-def read_data_from_file(file_path):
-    records = []
-    with open(file_path, 'r') as file:  # Open the file
-        reader = csv.reader(file)
-        for data in reader:
-            records.append(data)
-    return records
+from util.harness import make_clients, load_dataset, produce, SPEC_DEFAULTS
+from util.kinesis import list_shard_ranges
+
+import argparse
+
+# Sends the machine usage trace (machine_id, timestamp, cpu, mem) to the
+# outlier score stream through the threaded producer. The trace is parsed
+# once into a memory-mapped cache (util.trace), so startup does not depend
+# on its size.
+# With --speedup the records follow the trace's own event-time gaps instead
+# of a constant input_rate.
+SETTINGS = {
+    **SPEC_DEFAULTS,
+    'stream': 'mo_score',
+    'dataset': {'type': 'machine', 'path': 'data/machine_usage.csv'},
+    'input_map': {'machine_id': 0, 'timestamp': 1, 'cpu': 2, 'mem': 3},
+    # 100 records
+    'input_rate': 20,
+    'duration': 5,
+    'batch_size': 10,
+    'num_threads': 1,
+}
 
 # Main function to write data
 def main():
-    file_path = 'data/machine_usage.csv'
-    # total_count = int(input("Enter the total count of requests to Kinesis: "))
-
-    records = read_data_from_file(file_path)
-    
+    parser = argparse.ArgumentParser(description=f"Send the machine usage trace to {SETTINGS['stream']}")
+    parser.add_argument('--speedup', type=float,
+                        help="replay at the trace's event-time gaps, this many times faster (e.g. 1, 10, 100)")
+    parser.add_argument('--duration', type=float, default=SETTINGS['duration'], help="seconds to send for")
+    args = parser.parse_args()
+    settings = {**SETTINGS, 'replay_speedup': args.speedup, 'duration': args.duration}
+
+    records = load_dataset(settings)
     if len(records) == 0:
-        print("No records containing only alphabetic characters were found.")
+        print("No machine usage records were found.")
         return
 
-    end = 100
-    inputs = []
-    for msg_id, record in enumerate(records, start=1):
-        data = {
-            "machine_id": record[0].split('_')[1], 
-            "cpu": record[2], 
-            "mem": record[3], 
-            "timestamp": record[1],
-            "msg_id": msg_id
-        }
-        
-        # Use msg_id as partition key
-        partition_key = str(msg_id)
-
-        # Prepare record
-        input = {
-            'Data': json.dumps(data),
-            'PartitionKey': partition_key
-        }
-        inputs.append(input)
-
-        # Send in batches of 10
-        if len(inputs) == 10:
-            response = put_to_stream_batch(stream_name, inputs)
-            if response:
-                print(response)
-            inputs = []
-        
-        if msg_id >= end:
-            break
+    clients = make_clients(settings['region'])
+    shard_ranges = list_shard_ranges(clients['kinesis'], settings['stream'])
+    total_records, _, put_summary, _ = produce(clients, settings, records, shard_ranges)
+    print(f"Sent {total_records} records to {settings['stream']}, lost {put_summary['lost']}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
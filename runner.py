@@ -0,0 +1,25 @@
+from util.matrix import load_spec, expand_matrix, run_matrix
+
+import argparse
+
+# Runs experiment specs, e.g.
+#   python runner.py experiments/wc.json
+#   python runner.py experiments/wc.json --dry-run
+def main():
+    parser = argparse.ArgumentParser(description="Run every cell of one or more experiment specs")
+    parser.add_argument('specs', nargs='+', help="experiment spec JSON files")
+    parser.add_argument('--dry-run', action='store_true', help="only print the cells")
+    args = parser.parse_args()
+
+    for spec_path in args.specs:
+        spec = load_spec(spec_path)
+        if args.dry_run:
+            for cell in expand_matrix(spec):
+                note = " (searching input_rate)" if 'search' in spec else " (tuning replica)" if 'autotune' in spec else ""
+                print(f"{spec['name']}: {cell}{note}")
+            continue
+        run_matrix(spec)
+
+
+if __name__ == "__main__":
+    main()
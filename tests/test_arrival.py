@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from util.arrival import MAX_ARRIVAL_GRID_POINTS, arrival_times, describe_arrival, rate_curve
+
+@pytest.mark.parametrize('schedule, rate, duration, count', [
+    ({'type': 'constant'}, 500, 3, 1500),
+    ({'type': 'constant'}, 333, 7, 2331),
+    ({'type': 'ramp', 'start_rate': 0, 'end_rate': 1000}, 0, 10, 5000),
+    ({'type': 'step', 'rates': [300, 900, 300], 'step_time': 1}, 0, 3, 1500),
+    ({'type': 'on_off', 'on_time': 2, 'off_time': 8}, 100, 60, 1200),
+    ({'type': 'sinusoid', 'amplitude': 50, 'period': 10}, 100, 20, 2000),
+])
+def test_deterministic_counts(schedule, rate, duration, count):
+    times = arrival_times(schedule, rate, duration)
+    assert len(times) == count
+    assert (np.diff(times) >= 0).all()
+    assert times[0] == 0.0 and times[-1] < duration
+
+def test_constant_gaps_are_even():
+    times = arrival_times({'type': 'constant'}, 500, 3)
+    assert np.allclose(np.diff(times), 1 / 500)
+
+def test_on_off_sends_nothing_while_off():
+    times = arrival_times({'type': 'on_off', 'on_time': 2, 'off_time': 8}, 100, 60)
+    # Offset into the 10 s cycle; arrivals due at the start of an on period
+    # can land a rounding error before it
+    phase = (times + 1e-6) % 10
+    assert (phase <= 2 + 2e-6).all()
+
+def test_poisson_is_seeded_and_near_the_expected_count():
+    schedule = {'type': 'poisson', 'seed': 3}
+    times = arrival_times(schedule, 1000, 10)
+    assert abs(len(times) - 10000) < 5 * np.sqrt(10000)
+    assert np.array_equal(times, arrival_times(schedule, 1000, 10))
+    assert (np.diff(times) >= 0).all() and times[-1] < 10
+
+def test_poisson_keeps_the_rate_curve():
+    times = arrival_times({'type': 'ramp', 'start_rate': 0, 'end_rate': 2000, 'poisson': True, 'seed': 4}, 0, 10)
+    first_half = (times < 5).sum()
+    # A quarter of the 10000 expected arrivals fall in the first half
+    assert abs(first_half - 2500) < 5 * np.sqrt(2500)
+
+def test_day_long_schedule_has_a_capped_grid():
+    t, rates = rate_curve({'type': 'sinusoid', 'period': 86400}, 2, 86400)
+    assert len(t) == MAX_ARRIVAL_GRID_POINTS + 1 and t[-1] == 86400
+    times = arrival_times({'type': 'constant'}, 2, 86400)
+    assert len(times) == 172800
+    assert np.allclose(np.diff(times), 0.5)
+
+def test_unknown_type():
+    with pytest.raises(ValueError):
+        arrival_times({'type': 'burst'}, 100, 1)
+
+def test_describe_arrival():
+    assert describe_arrival(None) == 'constant'
+    assert describe_arrival({'type': 'ramp', 'start_rate': 0, 'end_rate': 1000}) == 'ramp(end_rate=1000, start_rate=0)'
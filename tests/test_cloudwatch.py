@@ -0,0 +1,248 @@
+import json
+import random
+import time
+
+import numpy as np
+import pytest
+
+import util.cloudwatch
+from util.cloudwatch import (LOG_FIELD_PATTERN, METRIC_DTYPE, REPORT_DTYPE, LogFetcher, MessageStats, parse_log_arrays,
+                             parse_log_file_arrays, parse_log_lines)
+from util.sketch import LatencyHistogram
+
+def metric_line(msg_id, start, end, exec_time, memory_size=128):
+    return (f"custom metrics Message ID: {msg_id} Start Time: {start} End Time: {end} "
+            f"Execution time: {exec_time} microseconds Memory Size: {memory_size}")
+
+REPORT_LINE = ("REPORT RequestId: 8f5c Duration: 12.34 ms Billed Duration: 13 ms Memory Size: 128 MB "
+               "Max Memory Used: 70 MB Init Duration: 150.5 ms")
+
+def test_field_pattern_reads_the_labelled_numbers():
+    fields = dict(LOG_FIELD_PATTERN.findall(metric_line(7, 1.5, 2.25, 30.5).encode()))
+    assert fields == {b'Message ID': b'7', b'Start Time': b'1.5', b'End Time': b'2.25',
+                      b'Execution time': b'30.5', b'Memory Size': b'128'}
+
+def test_field_pattern_skips_billed_and_init_duration():
+    fields = LOG_FIELD_PATTERN.findall(REPORT_LINE.encode())
+    assert [value for name, value in fields if name == b'Duration'] == [b'12.34']
+
+def test_parse_log_arrays():
+    lines = [
+        metric_line(3, 10.0, 10.5, 40.0),
+        # str and bytes lines mix
+        metric_line(1, 11.0, 11.25, 20.0, 256).encode(),
+        # Optional fields missing
+        "custom metrics Message ID: 2 Start Time: 12.0 Execution time: 5",
+        # Required field missing
+        "custom metrics Message ID: 4 End Time: 13.0 Execution time: 5",
+        # Other functions' metrics
+        metric_line(5, 14.0, 14.5, 1.0).replace('custom metrics', 'other metrics'),
+        REPORT_LINE,
+        "START RequestId: 8f5c Version: $LATEST",
+    ]
+    metrics, reports = parse_log_arrays(lines)
+    assert metrics['msg_id'].tolist() == [3, 1, 2]
+    assert metrics['start'].tolist() == [10.0, 11.0, 12.0]
+    assert metrics['end'][:2].tolist() == [10.5, 11.25] and np.isnan(metrics['end'][2])
+    assert metrics['exec_time'].tolist() == [40.0, 20.0, 5.0]
+    assert metrics['memory_size'].tolist() == [128, 256, 0]
+    assert reports['duration'].tolist() == [12.34]
+    assert reports['memory_size'].tolist() == [128]
+
+def test_parse_log_arrays_custom_marker_and_no_lines():
+    metrics, reports = parse_log_arrays([metric_line(1, 1.0, 2.0, 3.0).replace('custom metrics', 'wc metrics')],
+                                        marker=b'wc metrics')
+    assert metrics['msg_id'].tolist() == [1]
+    metrics, reports = parse_log_arrays([])
+    assert len(metrics) == 0 and len(reports) == 0
+
+def reference_parse(lines, marker=b'custom metrics'):
+    # The line-by-line parser the block parser replaced
+    metrics, reports = [], []
+    for line in lines:
+        line = line.encode() if isinstance(line, str) else line
+        fields = dict(LOG_FIELD_PATTERN.findall(line))
+        if marker in line:
+            if all(key in fields for key in (b'Message ID', b'Start Time', b'Execution time')):
+                metrics.append((int(fields[b'Message ID']), float(fields[b'Start Time']),
+                                float(fields.get(b'End Time', 'nan')), float(fields[b'Execution time']),
+                                int(fields.get(b'Memory Size', 0))))
+        elif b'REPORT RequestId' in line and b'Duration' in fields and b'Memory Size' in fields:
+            reports.append((float(fields[b'Duration']), int(fields[b'Memory Size'])))
+    return np.array(metrics, dtype=METRIC_DTYPE), np.array(reports, dtype=REPORT_DTYPE)
+
+def assert_same_rows(actual, expected):
+    assert actual.dtype == expected.dtype and len(actual) == len(expected)
+    for name in expected.dtype.names:
+        assert np.array_equal(actual[name], expected[name], equal_nan=expected[name].dtype.kind == 'f')
+
+def random_log_lines(rng, count):
+    # Mostly lines of one layout, with the variations real logs have
+    lines = []
+    for msg_id in range(count):
+        start = 1700000000 + rng.random() * 1000
+        line = (f"2024-01-01T00:00:{msg_id % 60:02d}.000Z\t{rng.getrandbits(32):08x}\tINFO\tcustom metrics "
+                f"Message ID: {msg_id} Start Time: {start:.6f} End Time: {start + rng.random():.6f} "
+                f"Execution time: {rng.random() * 1e4:.2f} microseconds Memory Size: {rng.choice([128, 1769])}")
+        kind = rng.random()
+        if kind < 0.02:
+            line = line.replace(' End Time', ' Stop Time')
+        elif kind < 0.04:
+            line = line.replace('Message ID: ', 'Message ID: x')
+        elif kind < 0.05:
+            line = line.replace('INFO\t', 'INFO\tnote: ')
+        elif kind < 0.06:
+            line = line + f" Start Time: {start + 1:.3f}"
+        elif kind < 0.07:
+            # A multi-line event
+            line = line.replace(' Memory Size', '\n Memory Size')
+        elif kind < 0.08:
+            line = line.replace('Execution time: ', 'Execution time: ' + '1' * 40)
+        lines.append(line)
+        if msg_id % 50 == 0:
+            init = f"\tInit Duration: {rng.random() * 300:.2f} ms" if rng.random() < 0.3 else ""
+            lines.append(f"REPORT RequestId: {rng.getrandbits(32):08x}\tDuration: {rng.random() * 100:.2f} ms\t"
+                         f"Billed Duration: 13 ms\tMemory Size: 128 MB\tMax Memory Used: 70 MB{init}")
+            lines.append(f"START RequestId: {rng.getrandbits(32):08x} Version: $LATEST")
+    return lines
+
+def test_block_parser_matches_line_parser():
+    rng = random.Random(7)
+    for count in (1, 2, 40, 3000):
+        lines = random_log_lines(rng, count)
+        metrics, reports = parse_log_arrays(lines)
+        expected_metrics, expected_reports = reference_parse(lines)
+        assert_same_rows(metrics, expected_metrics)
+        assert_same_rows(reports, expected_reports)
+    # Lines of one layout take the column-wise path
+    uniform = [metric_line(msg_id, 1.5, 2.5, 30.25) for msg_id in range(100)]
+    assert_same_rows(parse_log_arrays(uniform)[0], reference_parse(uniform)[0])
+
+def test_parse_log_file_arrays_across_reads(tmp_path, monkeypatch):
+    lines = random_log_lines(random.Random(3), 500)
+    path = tmp_path / 'log.txt'
+    # No newline after the last line
+    path.write_bytes('\n'.join(lines).encode())
+    monkeypatch.setattr(util.cloudwatch, 'LOG_READ_BYTES', 4096)
+    monkeypatch.setattr(util.cloudwatch, 'LOG_BLOCK_LINES', 64)
+    metrics, reports = parse_log_file_arrays(str(path))
+    expected_metrics, expected_reports = reference_parse(path.read_bytes().split(b'\n'))
+    assert_same_rows(metrics, expected_metrics)
+    assert_same_rows(reports, expected_reports)
+
+def test_block_parser_throughput():
+    # Throughput check: the block parser must stay well ahead of parsing
+    # line by line
+    lines = [metric_line(msg_id, 1700000000.123456, 1700000000.5, 123.45).encode() for msg_id in range(20000)]
+    size = sum(len(line) for line in lines) / 1e6
+    timings = {}
+    for name, parse in (('block', parse_log_arrays), ('line', reference_parse)):
+        # Best of three, against scheduling noise
+        runs = []
+        for _ in range(3):
+            started = time.perf_counter()
+            parse(lines)
+            runs.append(time.perf_counter() - started)
+        timings[name] = min(runs)
+    print(f"block parser {size / timings['block']:.0f} MB/s, line parser {size / timings['line']:.0f} MB/s")
+    assert timings['block'] * 2 < timings['line']
+
+def metrics_of(*rows):
+    # rows of (msg_id, start, end, exec_time)
+    metrics = np.zeros(len(rows), dtype=METRIC_DTYPE)
+    for i, row in enumerate(rows):
+        metrics[i]['msg_id'], metrics[i]['start'], metrics[i]['end'], metrics[i]['exec_time'] = row
+    return metrics
+
+def test_message_stats_merge_duplicates():
+    stats = MessageStats(capacity=2)
+    previous, merged = stats.update(metrics_of((5, 1.0, 2.0, 50.0), (2, 1.5, 3.0, 70.0), (5, 0.5, 4.0, 10.0)))
+    assert merged['msg_id'].tolist() == [2, 5]
+    assert np.isnan(previous['start']).all()
+    assert merged['start'].tolist() == [1.5, 0.5]
+    assert merged['end'].tolist() == [3.0, 4.0]
+    assert merged['exec_time'].tolist() == [70.0, 10.0]
+    # A later line of msg_id 2 widens its span; one of msg_id 5 inside the
+    # stored span changes nothing
+    previous, merged = stats.update(metrics_of((2, 0.1, 9.0, 5.0), (5, 0.7, 3.0, 20.0), (9, 2.0, 2.5, 30.0),
+                                               (-1, 0.0, 0.0, 0.0)))
+    assert merged['msg_id'].tolist() == [2, 9]
+    assert previous[0]['end'] == 3.0 and merged[0]['end'] == 9.0
+    arrays = stats.to_arrays()
+    assert arrays['msg_id'].tolist() == [2, 5, 9]
+    assert arrays['start'].tolist() == [0.1, 0.5, 2.0]
+    assert arrays['end'].tolist() == [9.0, 4.0, 2.5]
+    assert arrays['exec_time'].tolist() == [5.0, 10.0, 30.0]
+    assert len(stats) == 3
+    assert 5 in stats and 3 not in stats
+    assert stats.min_start_time == 0.1 and stats.max_end_time == 9.0
+
+def test_merge_does_not_depend_on_log_order():
+    rows = [(1, 1.0, 2.0, 40.0), (1, 1.2, 5.0, 30.0), (2, 2.0, 2.5, 10.0), (1, 0.9, 3.0, 50.0)]
+    forward, backward = MessageStats(), MessageStats()
+    for row in rows:
+        forward.update(metrics_of(row))
+    backward.update(metrics_of(*rows[::-1]))
+    for name, values in forward.to_arrays().items():
+        assert np.array_equal(values, backward.to_arrays()[name])
+
+def test_parse_log_lines_histogram_matches_message_stats():
+    histogram = LatencyHistogram()
+    stats = parse_log_lines([metric_line(1, 1.0, 2.0, 40.0), metric_line(1, 0.5, 3.0, 80.0)], histogram=histogram)
+    parse_log_lines([metric_line(1, 0.2, 4.0, 5.0), metric_line(2, 1.0, 2.0, 20.0)], stats, histogram)
+    exec_times = stats.to_arrays()['exec_time']
+    assert exec_times.tolist() == [5.0, 20.0]
+    expected = LatencyHistogram()
+    expected.record(exec_times)
+    assert np.array_equal(histogram.counts, expected.counts)
+    assert histogram.count == 2 and histogram.total == 25.0
+    assert histogram.summary() == pytest.approx(expected.summary(), rel=0.01)
+
+class StubLogsClient:
+    # filter_log_events over the events visible so far, two events per page
+    class exceptions:
+        class ResourceNotFoundException(Exception):
+            pass
+
+    def __init__(self):
+        self.events = None
+        self.start_times = []
+
+    def get_paginator(self, operation_name):
+        assert operation_name == 'filter_log_events'
+        return self
+
+    def paginate(self, logGroupName, startTime, filterPattern=None):
+        self.start_times.append(startTime)
+        if self.events is None:
+            raise self.exceptions.ResourceNotFoundException()
+        visible = [event for event in sorted(self.events, key=lambda event: event['timestamp'])
+                   if event['timestamp'] >= startTime]
+        for start in range(0, len(visible), 2):
+            yield {'events': visible[start:start + 2]}
+
+    def add(self, timestamp, event_id):
+        self.events.append({'timestamp': timestamp, 'eventId': event_id, 'message': f"line {event_id}"})
+
+def test_log_fetcher_returns_each_event_once(tmp_path):
+    client = StubLogsClient()
+    segment_path = str(tmp_path / 'logs' / 'segment.jsonl')
+    fetcher = LogFetcher(client, '/aws/lambda/f', 1000, segment_path, overlap_ms=1500)
+    # The log group does not exist before the first invocation
+    assert fetcher.poll() == []
+    client.events = []
+    for timestamp, event_id in [(1000, 'a'), (2000, 'b'), (3000, 'c')]:
+        client.add(timestamp, event_id)
+    assert [event['eventId'] for event in fetcher.poll()] == ['a', 'b', 'c']
+    # d is ingested late, behind c, and polls overlap from the cursor on
+    client.add(1800, 'd')
+    client.add(4000, 'e')
+    assert [event['eventId'] for event in fetcher.poll()] == ['d', 'e']
+    assert fetcher.poll() == []
+    # The cursor trails the newest event by overlap_ms, and only the IDs
+    # inside that window are kept
+    assert client.start_times == [1000, 1000, 1500, 2500]
+    assert sorted(fetcher.seen_ids) == ['c', 'e']
+    assert fetcher.total_events == 5
+    with open(segment_path) as file:
+        assert [json.loads(line)['eventId'] for line in file] == ['a', 'b', 'c', 'd', 'e']
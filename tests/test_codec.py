@@ -0,0 +1,47 @@
+import struct
+
+import pytest
+
+from util.codec import get_codec, StructCodec
+from util.harness import check_codec
+
+MESSAGE = {'msg_id': 42, 'word': 'naïve café', 'count': 3, 'intended_time': 1700000000.25, 'send_time': 1700000000.5}
+
+@pytest.mark.parametrize('name', ['json', 'orjson', 'msgpack'])
+def test_self_describing_codecs_round_trip(name):
+    if name in ('orjson', 'msgpack'):
+        pytest.importorskip(name)
+    codec = get_codec(name)
+    data = codec.encode(MESSAGE)
+    assert isinstance(data, bytes)
+    assert codec.decode(data) == MESSAGE
+
+def test_struct_codec_round_trips_its_layout():
+    codec = StructCodec([('msg_id', 'q'), ('word', 's'), ('count', 'i'), ('intended_time', 'd'), ('send_time', 'd')])
+    data = codec.encode(MESSAGE)
+    # Numeric fields are packed, the string is length-prefixed UTF-8
+    assert len(data) == 8 + 2 + len('naïve café'.encode('utf-8')) + 4 + 8 + 8
+    assert codec.decode(data) == MESSAGE
+    # Missing numeric fields encode as 0
+    assert codec.decode(codec.encode({'msg_id': 7})) == {'msg_id': 7, 'word': '', 'count': 0, 'intended_time': 0.0,
+                                                         'send_time': 0.0}
+
+def test_default_struct_layout_carries_the_producer_fields():
+    codec = get_codec('struct')
+    message = {'msg_id': 1, 'intended_time': 2.5, 'send_time': 3.5}
+    assert codec.decode(codec.encode(message)) == message
+    with pytest.raises(struct.error):
+        codec.decode(codec.encode(message)[:-1])
+
+def test_struct_layout_mismatch_fails_the_cell_up_front():
+    codec = get_codec('struct')
+    with pytest.raises(ValueError, match="not in the struct layout"):
+        codec.encode({'msg_id': 1, 'word': 'x'})
+    # check_codec rejects the layout before any producer or consumer starts
+    records = [('word', 'count')]
+    with pytest.raises(ValueError, match="payload_codec struct cannot encode"):
+        check_codec(codec, records, {'word': 0}, {'memory_size': 128})
+    check_codec(get_codec('struct', layout=[('msg_id', 'q'), ('word', 's'), ('intended_time', 'd'),
+                                            ('memory_size', 'i'), ('send_time', 'd')]),
+                records, {'word': 0}, {'memory_size': 128})
+    check_codec(get_codec('json'), records, {'word': 0}, {'memory_size': 128})
@@ -0,0 +1,43 @@
+import numpy as np
+
+from util.completion import CompletionTracker, MAX_DELIVERY_COUNT
+
+def test_missing_ranges_shrink_as_messages_arrive():
+    tracker = CompletionTracker(np.arange(1, 101), capacity=8)
+    assert tracker.missing_ranges() == [(1, 100)]
+    assert tracker.add([1, 2, 3, 50]) == 4
+    assert tracker.missing_ranges() == [(4, 49), (51, 100)]
+    assert tracker.missing_ranges(limit=1) == [(4, 49)]
+    assert not tracker.complete()
+    tracker.add(np.r_[4:50, 51:100])
+    assert tracker.missing_ranges() == [(100, 100)]
+    tracker.add([100])
+    assert tracker.missing_ranges() == []
+    assert tracker.complete()
+
+def test_duplicates_and_unexpected_ids():
+    tracker = CompletionTracker([0, 1, 2, 3])
+    assert tracker.add([1, 1, 1, 2, 500, -1]) == 3
+    # Seen again in a later poll
+    assert tracker.add([2]) == 0
+    summary = tracker.summary()
+    assert summary['received'] == 2
+    assert summary['missing'] == 2
+    assert summary['unexpected'] == 1
+    assert summary['duplicated_ids'] == 2
+    assert summary['duplicate_deliveries'] == 3
+    assert tracker.missing_ranges() == [(0, 0), (3, 3)]
+
+def test_ids_seen_before_they_are_expected():
+    tracker = CompletionTracker()
+    tracker.add([5, 6])
+    assert tracker.summary()['unexpected'] == 2
+    tracker.expect(range(5, 10))
+    assert tracker.summary()['unexpected'] == 0
+    assert tracker.num_received == 2
+    assert tracker.missing_ranges() == [(7, 9)]
+
+def test_delivery_count_saturates():
+    tracker = CompletionTracker([0])
+    tracker.add(np.zeros(MAX_DELIVERY_COUNT + 10, dtype=np.int64))
+    assert tracker.summary()['duplicate_deliveries'] == MAX_DELIVERY_COUNT - 1
@@ -0,0 +1,47 @@
+import json
+import pickle
+
+import pytest
+
+from util.corpus import build_corpus, open_or_build_corpus, Corpus
+
+def payloads(corpus):
+    return [json.loads(bytes(corpus.payload(index))) for index in range(len(corpus))]
+
+def test_corpus_is_rebuilt_when_its_inputs_change(tmp_path):
+    file_path = str(tmp_path / 'cache' / 'records.corpus')
+    loads = []
+
+    def load(records):
+        def load_records():
+            loads.append(records)
+            return records
+        return load_records
+
+    first = open_or_build_corpus(file_path, load([('a', '1'), ('b', '2')]), {'name': 0}, None, {'file_hash': 'one'})
+    assert payloads(first) == [{'msg_id': 0, 'name': 'a'}, {'msg_id': 1, 'name': 'b'}]
+    # The same inputs reuse the file
+    again = open_or_build_corpus(file_path, load([]), {'name': 0}, None, {'file_hash': 'one'})
+    assert again.file_path == first.file_path and len(loads) == 1
+    # New dataset content, input map or partition key each build a new file
+    content = open_or_build_corpus(file_path, load([('c', '3')]), {'name': 0}, None, {'file_hash': 'two'})
+    assert payloads(content) == [{'msg_id': 0, 'name': 'c'}]
+    mapped = open_or_build_corpus(file_path, load([('a', '1')]), {'value': 1}, None, {'file_hash': 'one'})
+    assert payloads(mapped) == [{'msg_id': 0, 'value': '1'}]
+    keyed = open_or_build_corpus(file_path, load([('a', '1')]), {'name': 0}, 'name', {'file_hash': 'one'})
+    assert keyed.partition_key(0) == 'a'
+    assert len({first.file_path, content.file_path, mapped.file_path, keyed.file_path}) == 4
+
+def test_corpus_pickles_as_its_path(tmp_path):
+    file_path = str(tmp_path / 'records.corpus')
+    build_corpus([('a',), ('b',)], {'name': 0}, file_path)
+    corpus = Corpus(file_path)
+    data = pickle.dumps(corpus)
+    assert len(data) < 200
+    copy = pickle.loads(data)
+    assert payloads(copy) == payloads(corpus) and copy.partition_key(1) == '1'
+    copy.close()
+    corpus.close()
+    (tmp_path / 'other').write_bytes(b'\0' * 64)
+    with pytest.raises(ValueError, match="is not a corpus file"):
+        Corpus(str(tmp_path / 'other'))
@@ -0,0 +1,84 @@
+import json
+import struct
+
+import pytest
+from botocore.exceptions import ClientError
+
+from util.cloudwatch import parse_log_arrays
+from util.emulator import Emulator, constant_time
+from util.kinesis import MAX_RECORD_SIZE, THROTTLED_ERROR_CODE
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+def json_records(msg_ids):
+    return [{'Data': json.dumps({'msg_id': msg_id}).encode('utf-8'), 'PartitionKey': str(msg_id)} for msg_id in msg_ids]
+
+def stored(emulator, stream='s'):
+    return [json.loads(data)['msg_id'] for shard in emulator.streams[stream].records for _, _, data in shard]
+
+def test_shards_throttle_records_over_their_rate():
+    clock = Clock()
+    emulator = Emulator(clock)
+    emulator.create_stream('s', records_per_second=5)
+    kinesis = emulator.clients()['kinesis']
+    response = kinesis.put_records(StreamName='s', Records=json_records(range(8)))
+    assert response['FailedRecordCount'] == 3
+    assert [result.get('ErrorCode') for result in response['Records']] == [None] * 5 + [THROTTLED_ERROR_CODE] * 3
+    # The bucket refills at the shard's rate
+    clock.now += 0.5
+    assert kinesis.put_records(StreamName='s', Records=json_records(range(8, 11)))['FailedRecordCount'] == 1
+    assert stored(emulator) == [0, 1, 2, 3, 4, 8, 9]
+
+def test_oversized_record_rejects_the_whole_request():
+    emulator = Emulator(Clock())
+    emulator.create_stream('s', records_per_second=5)
+    kinesis = emulator.clients()['kinesis']
+    records = json_records(range(3)) + [{'Data': b'x' * MAX_RECORD_SIZE, 'PartitionKey': 'big'}]
+    with pytest.raises(ClientError) as error:
+        kinesis.put_records(StreamName='s', Records=records)
+    assert error.value.response['Error']['Code'] == 'InvalidArgumentException'
+    # No shard took a record or spent any of its rate on the request
+    assert stored(emulator) == []
+    assert kinesis.put_records(StreamName='s', Records=json_records(range(5)))['FailedRecordCount'] == 0
+
+def test_functions_log_the_messages_they_process():
+    clock = Clock()
+    emulator = Emulator(clock)
+    emulator.create_stream('s', shard_count=2)
+    emulator.create_function('f', 's', execution_time=constant_time(0.01), batch_size=4, memory_size=1769,
+                             metrics_marker='Test metrics')
+    clients = emulator.clients()
+    # Payloads that are not harness messages are processed but not logged
+    records = json_records(range(10)) + [{'Data': b'not json', 'PartitionKey': 'a'},
+                                         {'Data': b'5', 'PartitionKey': 'b'}]
+    assert clients['kinesis'].put_records(StreamName='s', Records=records)['FailedRecordCount'] == 0
+    clock.now += 10
+    pages = clients['logs'].get_paginator('filter_log_events').paginate(logGroupName='/aws/lambda/f')
+    lines = [event['message'] for page in pages for event in page['events']]
+    metrics, reports = parse_log_arrays(lines, b'Test metrics')
+    assert sorted(metrics['msg_id'].tolist()) == list(range(10))
+    assert (metrics['exec_time'] == 10000).all() and (metrics['memory_size'] == 1769).all()
+    # Start and end times are 10 ms apart, after the records were put
+    assert metrics['end'] - metrics['start'] == pytest.approx(0.01)
+    assert (metrics['start'] >= 1000.0).all()
+    assert len(reports) == emulator.functions['f'].invocations
+    assert emulator.functions['f'].invocations >= 3
+
+def test_undecodable_struct_payloads_are_not_logged():
+    clock = Clock()
+    emulator = Emulator(clock)
+    emulator.create_stream('s')
+    emulator.create_function('f', 's', codec='struct', metrics_marker='Test metrics')
+    records = [{'Data': struct.pack('<qdd', 7, 0.0, 0.0), 'PartitionKey': '7'},
+               {'Data': b'\x01\x02', 'PartitionKey': 'short'}]
+    emulator.clients()['kinesis'].put_records(StreamName='s', Records=records)
+    clock.now += 10
+    events = emulator.filter_log_events('/aws/lambda/f')['events']
+    metrics, reports = parse_log_arrays([event['message'] for event in events], b'Test metrics')
+    assert metrics['msg_id'].tolist() == [7]
+    assert len(reports) == 1
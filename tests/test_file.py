@@ -0,0 +1,44 @@
+import pickle
+import re
+
+from util.file import clean_words, iter_word_chunks, load_sentences, read_word_ids
+
+# Letters, ASCII and Unicode whitespace (NBSP, em and ideographic space, NEL,
+# line and file separators), accents, digits, punctuation and CRLF line ends
+TEXT = ("The quick brown fox jumps, over 3 lazy dogs.\r\n"
+        "Café naïve\u0085coöperate end\x1cword Été \t tab\u2003em\u3000wide\u00a0nbsp\u2028line\n") * 50
+
+def baseline_words(text):
+    # The tokenizer util.file replaced
+    return re.sub(r'[^a-zA-Z\s]', '', text).lower().split()
+
+def test_clean_words_matches_the_baseline_tokenizer():
+    for text in (TEXT, TEXT.encode('ascii', 'ignore').decode(), "word\x1dsplit\x1fhere"):
+        assert [word.decode() for word in clean_words(text.encode('utf-8'))] == baseline_words(text)
+
+def test_chunks_match_the_baseline_tokenizer(tmp_path):
+    path = tmp_path / 'books.txt'
+    path.write_bytes(TEXT.encode('utf-8'))
+    expected = baseline_words(TEXT)
+    for chunk_size in (7, 64, 1000, 1 << 20):
+        words = [word.decode() for chunk in iter_word_chunks(str(path), chunk_size) for word in chunk]
+        assert words == expected
+    word_ids, vocabulary = read_word_ids(str(path), 64)
+    assert [vocabulary[word_id] for word_id in word_ids.tolist()] == expected
+
+def test_sentences_match_the_baseline_tokenizer(tmp_path):
+    path = tmp_path / 'books.txt'
+    path.write_bytes(TEXT.encode('utf-8'))
+    words = baseline_words(TEXT)
+    sentences = load_sentences(str(path), 10, str(tmp_path / 'cache'))
+    assert sentences.sentences() == [' '.join(words[i:i + 10]) for i in range(0, len(words), 10)]
+
+def test_sentence_index_pickles_as_its_path(tmp_path):
+    path = tmp_path / 'books.txt'
+    path.write_bytes(TEXT.encode('utf-8'))
+    sentences = load_sentences(str(path), 10, str(tmp_path / 'cache'))
+    data = pickle.dumps(sentences)
+    assert len(data) < 300
+    copy = pickle.loads(data)
+    assert copy.sentences() == sentences.sentences() and copy.word_count == sentences.word_count
+    copy.close()
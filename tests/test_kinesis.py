@@ -0,0 +1,125 @@
+import pytest
+
+import util.kinesis
+from util.kinesis import (build_batches, partition_key_hash, put_to_stream_batch, record_size, PutStats, TokenBucket,
+                          MAX_BYTES_PER_REQUEST, MAX_RECORD_SIZE, MAX_RECORDS_PER_REQUEST, THROTTLED_ERROR_CODE)
+
+def records_of(count, size=10, prefix='key'):
+    return [{'Data': b'x' * size, 'PartitionKey': f'{prefix}{i}'} for i in range(count)]
+
+def test_batches_hold_at_most_500_records():
+    records = records_of(1200)
+    batches, oversized = build_batches(records)
+    assert [len(batch) for _, batch in batches] == [MAX_RECORDS_PER_REQUEST, MAX_RECORDS_PER_REQUEST, 200]
+    assert [shard_id for shard_id, _ in batches] == [None] * 3
+    assert [record for _, batch in batches for record in batch] == records
+    assert oversized == []
+
+def test_batches_hold_at_most_5_mb():
+    # 900 KB records: a sixth one would take a request past 5 MB
+    records = records_of(12, 900 * 1024)
+    batches, _ = build_batches(records)
+    assert [len(batch) for _, batch in batches] == [5, 5, 2]
+    assert all(sum(record_size(record) for record in batch) <= MAX_BYTES_PER_REQUEST for _, batch in batches)
+    assert [record for _, batch in batches for record in batch] == records
+
+def test_oversized_records_are_set_aside():
+    records = records_of(3)
+    too_big = {'Data': b'x' * MAX_RECORD_SIZE, 'PartitionKey': 'big'}
+    batches, oversized = build_batches(records[:2] + [too_big] + records[2:])
+    assert oversized == [too_big]
+    assert batches == [(None, records)]
+
+def test_records_are_routed_by_hash_key_range():
+    # Four shards splitting the 128-bit hash key space unevenly
+    bounds = [0, 1 << 120, 1 << 126, 3 << 126, 1 << 128]
+    shard_ranges = [(start, end - 1, f'shard-{index}') for index, (start, end) in enumerate(zip(bounds, bounds[1:]))]
+    records = records_of(2000)
+    batches, _ = build_batches(records, shard_ranges)
+    routed = {}
+    for shard_id, batch in batches:
+        assert len(batch) <= MAX_RECORDS_PER_REQUEST
+        routed.setdefault(shard_id, []).extend(batch)
+    for start, end, shard_id in shard_ranges:
+        assert all(start <= partition_key_hash(record['PartitionKey']) <= end for record in routed.get(shard_id, []))
+    assert sorted(routed) == [shard_id for _, _, shard_id in shard_ranges]
+    # Every record is sent once, in its original order within its shard
+    position = {id(record): index for index, record in enumerate(records)}
+    assert sum(len(batch) for batch in routed.values()) == len(records)
+    for batch in routed.values():
+        indices = [position[id(record)] for record in batch]
+        assert indices == sorted(set(indices))
+
+class FakeTime:
+    # Stands in for util.kinesis.time: sleeping advances the monotonic clock
+    def __init__(self):
+        self.now = 100.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+@pytest.fixture
+def fake_time(monkeypatch):
+    fake = FakeTime()
+    monkeypatch.setattr(util.kinesis, 'time', fake)
+    return fake
+
+def test_token_bucket_sleeps_off_its_debt(fake_time):
+    bucket = TokenBucket(10)
+    # Within the capacity: no wait
+    assert bucket.acquire(4) == 0
+    # More than what is left: admitted at once, the debt is slept off at the rate
+    assert bucket.acquire(21) == pytest.approx(1.5)
+    assert fake_time.sleeps == [pytest.approx(1.5)]
+    # The debt is paid, so the next request waits only for itself
+    assert bucket.acquire(1) == pytest.approx(0.1)
+    fake_time.now += 10
+    # Idle time refills up to the capacity, not beyond
+    assert bucket.acquire(10) == 0
+    assert bucket.acquire(1) == pytest.approx(0.1)
+
+class PartialFailureClient:
+    # Fails the records whose partition key is in failures[attempt] with the
+    # given error code; later attempts succeed
+    def __init__(self, failures):
+        self.failures = failures
+        self.calls = []
+
+    def put_records(self, StreamName, Records):
+        self.calls.append(list(Records))
+        failures = self.failures[len(self.calls) - 1] if len(self.calls) <= len(self.failures) else {}
+        if failures is None:
+            raise RuntimeError("connection reset")
+        results = [{'ErrorCode': failures[record['PartitionKey']], 'ErrorMessage': 'failed'}
+                   if record['PartitionKey'] in failures else {'SequenceNumber': '1', 'ShardId': 'shard-0'}
+                   for record in Records]
+        return {'FailedRecordCount': sum('ErrorCode' in result for result in results), 'Records': results}
+
+def test_retries_resend_only_the_failed_records(fake_time):
+    records = records_of(5)
+    client = PartialFailureClient([{'key1': THROTTLED_ERROR_CODE, 'key3': 'InternalFailure'},
+                                   {'key3': THROTTLED_ERROR_CODE}])
+    stats = PutStats()
+    assert put_to_stream_batch(client, 's', records, shard_id='shard-0', stats=stats, verbose=False) is not None
+    assert client.calls == [records, [records[1], records[3]], [records[3]]]
+    # The retries send the same record objects, not rebuilt payloads
+    assert client.calls[2][0] is records[3]
+    assert stats.summary() == {'sent': 5, 'retried': 3, 'throttled': 2, 'errors': 0, 'lost': 0, 'lost_by_shard': {}}
+
+def test_put_stats_count_errors_and_lost_records(fake_time):
+    records = records_of(3)
+    # An exception, then key0 fails on every remaining attempt
+    client = PartialFailureClient([None] + [{'key0': THROTTLED_ERROR_CODE}] * 4)
+    stats = PutStats()
+    assert put_to_stream_batch(client, 's', records, max_retries=4, shard_id='shard-0', stats=stats,
+                               verbose=False) is None
+    assert [len(call) for call in client.calls] == [3, 3, 1, 1]
+    assert stats.summary() == {'sent': 2, 'retried': 3, 'throttled': 3, 'errors': 1, 'lost': 1,
+                               'lost_by_shard': {'shard-0': 1}}
+    # Every attempt after a failure backs off
+    assert len(fake_time.sleeps) == 4
@@ -0,0 +1,54 @@
+from util.kinesis import MAX_RECORD_SIZE, partition_key_hash
+from util.kpl import aggregate_records, deaggregate_record, is_aggregated, KPL_MAGIC
+
+# Two shards splitting the 128-bit hash key space in half
+SHARD_RANGES = [(0, 2 ** 127 - 1, 'shard-0'), (2 ** 127, 2 ** 128 - 1, 'shard-1')]
+
+def make_records(count, size=20):
+    return [{'Data': f'{{"msg_id": {i}, "text": "{"x" * size}"}}', 'PartitionKey': str(i % 7)} for i in range(count)]
+
+def deaggregate_all(aggregated):
+    return [user_record for record in aggregated
+            for user_record in deaggregate_record(record['Data'], record['PartitionKey'])]
+
+def shard_of(partition_key):
+    hash_key = partition_key_hash(partition_key)
+    return next(shard_id for start, end, shard_id in SHARD_RANGES if start <= hash_key <= end)
+
+def test_round_trip_keeps_keys_data_and_order():
+    records = make_records(100)
+    aggregated = aggregate_records(records)
+    assert len(aggregated) == 1
+    assert is_aggregated(aggregated[0]['Data'])
+    assert deaggregate_all(aggregated) == [(record['PartitionKey'], record['Data'].encode('utf-8')) for record in records]
+
+def test_aggregates_stay_under_max_size():
+    records = make_records(500, size=200)
+    aggregated = aggregate_records(records, max_size=4096)
+    assert len(aggregated) > 1
+    for record in aggregated:
+        assert len(record['Data']) + len(record['PartitionKey'].encode('utf-8')) <= 4096
+    assert [data for _, data in deaggregate_all(aggregated)] == [record['Data'].encode('utf-8') for record in records]
+
+def test_max_size_is_capped_at_the_record_limit():
+    records = make_records(3, size=MAX_RECORD_SIZE // 2)
+    aggregated = aggregate_records(records, max_size=10 * MAX_RECORD_SIZE)
+    assert len(aggregated) == 3
+    assert len(deaggregate_all(aggregated)) == 3
+
+def test_user_records_hash_to_the_shard_of_their_aggregate():
+    records = make_records(200)
+    aggregated = aggregate_records(records, SHARD_RANGES)
+    assert len(aggregated) == 2
+    for record in aggregated:
+        shard_id = shard_of(record['PartitionKey'])
+        assert all(shard_of(key) == shard_id for key, _ in deaggregate_record(record['Data']))
+    assert sorted(data for _, data in deaggregate_all(aggregated)) == sorted(
+        record['Data'].encode('utf-8') for record in records)
+
+def test_plain_records_pass_through():
+    assert deaggregate_record('{"msg_id": 1}', '1') == [('1', b'{"msg_id": 1}')]
+    # The magic prefix alone does not make an aggregate; the digest must match
+    data = KPL_MAGIC + b'not an aggregate' + b'0' * 16
+    assert not is_aggregated(data)
+    assert deaggregate_record(data, 'k') == [('k', data)]
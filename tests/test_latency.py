@@ -0,0 +1,19 @@
+import numpy as np
+
+from util.latency import SendLog, latency_breakdown
+
+def test_breakdown_splits_at_the_admitted_time():
+    send_log = SendLog(capacity=2)
+    # Intended at 10, stamped at 11, admitted by the rate limiter at 13
+    send_log.record(1, 3, 10.0, 11.0, 13.0)
+    send_log.record(4, 1, None, 20.0)
+    merged = SendLog().merge_arrays(send_log.to_arrays())
+    for log in (send_log, merged):
+        latencies = latency_breakdown([1, 3, 4, 9], [15.0, 16.0, 21.0, 1.0], [17.0, 18.0, 22.0, 2.0], log)
+        assert latencies['send_time'][:3].tolist() == [11.0, 11.0, 20.0]
+        assert latencies['admitted_time'][:3].tolist() == [13.0, 13.0, 20.0]
+        assert latencies['queueing'][:3].tolist() == [2.0, 3.0, 1.0]
+        assert latencies['harness'][:2].tolist() == [3.0, 3.0]
+        # Without an intended time, end-to-end starts at the send time
+        assert latencies['end_to_end'][:3].tolist() == [7.0, 8.0, 2.0]
+        assert np.isnan(latencies['harness'][2]) and np.isnan(latencies['end_to_end'][3])
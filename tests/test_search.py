@@ -0,0 +1,9 @@
+from util.search import SEARCH_DEFAULTS, check_probe
+
+def test_rate_shortfall_uses_the_rate_tolerance():
+    summary = {'achieved_rate': 960, 'p99_end_to_end_ms': 100, 'missing_records': 0, 'latency_growth': 0}
+    assert check_probe(summary, 1000, SEARCH_DEFAULTS) == []
+    # The search resolution has no say in it
+    assert check_probe(summary, 1000, {**SEARCH_DEFAULTS, 'resolution': 0.01}) == []
+    assert check_probe(summary, 1000, {**SEARCH_DEFAULTS, 'rate_tolerance': 0.01}) == [
+        "the harness only produced 960 records/s"]
@@ -0,0 +1,66 @@
+import math
+
+import numpy as np
+import pytest
+
+from util.sketch import LatencyHistogram, REPORT_QUANTILES
+
+def lognormal_samples(count, seed=0):
+    return np.random.default_rng(seed).lognormal(mean=3.0, sigma=1.0, size=count)
+
+def test_quantiles_within_relative_accuracy():
+    values = lognormal_samples(100000)
+    histogram = LatencyHistogram(accuracy=0.01)
+    histogram.record(values)
+    for _, q in REPORT_QUANTILES:
+        exact = np.quantile(values, q)
+        assert abs(histogram.quantile(q) - exact) <= 0.02 * exact
+    assert histogram.count == len(values)
+    assert histogram.quantile(0.0) == pytest.approx(values.min(), rel=0.01)
+    assert histogram.quantile(1.0) == pytest.approx(values.max(), rel=0.01)
+    assert histogram.mean() == pytest.approx(values.mean())
+
+def test_merge_equals_recording_everything_at_once():
+    values = lognormal_samples(20000, seed=1)
+    whole = LatencyHistogram()
+    whole.record(values)
+    left, right = LatencyHistogram(), LatencyHistogram()
+    left.record(values[:7000])
+    right.record(values[7000:])
+    merged = left.merge(right)
+    assert np.array_equal(merged.counts, whole.counts)
+    assert merged.summary() == pytest.approx(whole.summary())
+
+def test_merge_rejects_other_settings():
+    with pytest.raises(ValueError):
+        LatencyHistogram(accuracy=0.01).merge(LatencyHistogram(accuracy=0.02))
+
+def test_nan_zero_and_empty():
+    histogram = LatencyHistogram()
+    assert math.isnan(histogram.quantile(0.5))
+    histogram.record([np.nan, 0.0, 0.0, 0.0, 10.0])
+    assert histogram.count == 4
+    assert histogram.quantile(0.5) == 0.0
+    assert histogram.quantile(1.0) == pytest.approx(10.0)
+
+def test_array_round_trip():
+    histogram = LatencyHistogram()
+    histogram.record(lognormal_samples(1000, seed=2))
+    restored = LatencyHistogram.from_arrays(histogram.to_arrays('exec_time_hist'), 'exec_time_hist')
+    assert np.array_equal(restored.counts, histogram.counts)
+    assert restored.summary() == histogram.summary()
+
+def test_remove_takes_values_back():
+    values = lognormal_samples(5000, seed=3)
+    histogram = LatencyHistogram()
+    histogram.record(values)
+    histogram.remove(values[4000:])
+    expected = LatencyHistogram()
+    expected.record(values[:4000])
+    assert np.array_equal(histogram.counts, expected.counts)
+    assert histogram.count == expected.count
+    assert histogram.total == pytest.approx(expected.total)
+    assert histogram.max == pytest.approx(expected.max, rel=0.03)
+    assert histogram.min == pytest.approx(expected.min, rel=0.03)
+    histogram.remove(values[:4000])
+    assert histogram.count == 0 and math.isnan(histogram.quantile(0.5))
@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+from text import calculate_average_common_rate, previous_occurrences, repeated_words
+
+def baseline_previous(word_ids):
+    # Position of each word's previous occurrence, one word at a time
+    last_seen = {}
+    previous = []
+    for position, word_id in enumerate(word_ids.tolist()):
+        previous.append(last_seen.get(word_id, -1))
+        last_seen[word_id] = position
+    return previous
+
+def baseline_common_rate(word_ids, length):
+    # The original computation: sets of every pair of consecutive sentences
+    sentences = [set(word_ids[i:i + length].tolist()) for i in range(0, len(word_ids), length)]
+    if len(sentences) < 2:
+        return 0, 0
+    total_common = total_overlap = 0
+    for current, before in zip(sentences[1:], sentences[:-1]):
+        common = current & before
+        total_common += len(common)
+        total_overlap += bool(common)
+    return total_common / (len(sentences) - 1), total_overlap / (len(sentences) - 1)
+
+@pytest.mark.parametrize('num_words', [0, 1, 2, 7, 100, 1001])
+@pytest.mark.parametrize('vocabulary', [1, 3, 40])
+def test_previous_occurrences_matches_the_baseline(num_words, vocabulary):
+    word_ids = np.random.default_rng(num_words * vocabulary).integers(0, vocabulary, num_words).astype(np.int32)
+    assert previous_occurrences(word_ids).tolist() == baseline_previous(word_ids)
+
+@pytest.mark.parametrize('num_words', [1, 2, 9, 100, 1001])
+def test_common_rate_matches_the_per_pair_sets(num_words):
+    rng = np.random.default_rng(num_words)
+    for vocabulary in (2, 15, 300):
+        word_ids = rng.integers(0, vocabulary, num_words).astype(np.int32)
+        max_length = 12
+        positions, previous = repeated_words(word_ids, 2 * max_length)
+        for length in range(1, max_length + 1):
+            assert calculate_average_common_rate(num_words, positions, previous, length) == pytest.approx(
+                baseline_common_rate(word_ids, length), abs=1e-12)
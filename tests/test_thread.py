@@ -0,0 +1,33 @@
+from queue import Queue
+
+import numpy as np
+
+from util.thread import arrival_producer, replay_producer
+
+def queued_msg_ids(batch_queue):
+    msg_ids = []
+    while True:
+        batch = batch_queue.get()
+        if batch is None:
+            return msg_ids
+        input_index, input_data_list = batch
+        assert [msg['msg_id'] for msg in input_data_list] == list(range(input_index, input_index + len(input_data_list)))
+        msg_ids += [(msg['msg_id'], msg['value']) for msg in input_data_list]
+
+def test_scheduled_producers_start_at_msg_id_1():
+    # msg_ids start at 1 as with the batch producer, and each message carries
+    # the record of its msg_id
+    records = [(f'record {i}',) for i in range(50)]
+    expected = [(i, f'record {i}') for i in range(1, 50)]
+
+    batch_queue, stats = Queue(), {}
+    arrival_producer(records, {'type': 'constant'}, 1000, 8, {'value': 0}, batch_queue, 1, 1, stats)
+    assert queued_msg_ids(batch_queue) == expected
+    assert stats['msg_id_ranges'] == [[1, 50]]
+
+    # Replay follows the event times of the sent records, from msg_id 1 on
+    event_times = np.arange(50, dtype=np.float64) * 0.01
+    batch_queue, stats = Queue(), {}
+    replay_producer(records, event_times, 10, 8, {'value': 0}, batch_queue, 1, 1, stats)
+    assert queued_msg_ids(batch_queue) == expected
+    assert stats['msg_id_ranges'] == [[1, 50]]
@@ -0,0 +1,80 @@
+import pickle
+
+import numpy as np
+
+import util.trace
+from util.trace import load_trace, replay_order, write_replay_order, ReplayRecords, TraceRecords
+
+def write_machine_trace(path, timestamps):
+    lines = [f"m_{i},{timestamp},{i % 100},{'' if i % 5 == 0 else i % 50}" for i, timestamp in enumerate(timestamps)]
+    path.write_text('\n'.join(lines) + '\n')
+    return str(path)
+
+def test_records_are_the_trace_strings(tmp_path):
+    records = load_trace(write_machine_trace(tmp_path / 'machine.csv', [100, 200]), 'machine', str(tmp_path))
+    # An empty utilisation stays ""
+    assert records[:] == [('0', '100', '0', ''), ('1', '200', '1', '1')]
+
+def test_float_fields_keep_their_text(tmp_path):
+    # Each utilisation comes back exactly as written, "20" and "20.0" included
+    values = ['20', '20.0', '7.50', '-0.25', '0.1', '33.333333333333336', '', '1e3', '+5', '007']
+    path = tmp_path / 'machine.csv'
+    path.write_text(''.join(f"m_{i},{i},{value},{value}\n" for i, value in enumerate(values)))
+    records = load_trace(str(path), 'machine', str(tmp_path))
+    # Text a float cannot be formatted back to is sent as repr
+    expected = values[:7] + ['1000.0', '5.0', '7.0']
+    assert [record[2] for record in records] == expected
+    assert [record[3] for record in records] == expected
+
+def test_numeric_records(tmp_path):
+    records = load_trace(write_machine_trace(tmp_path / 'machine.csv', [100, 200]), 'machine', str(tmp_path),
+                         numeric=True)
+    # An empty utilisation is sent as null
+    assert records[:] == [(0, 100, 0.0, None), (1, 200, 1.0, 1.0)]
+
+def test_sensor_fields(tmp_path):
+    path = tmp_path / 'data_sensor.txt'
+    path.write_text("2004-03-31 03:38:15.757551 2 1 122.153 -3.91901 11.04 2.03397\n"
+                    "2004-02-28 00:59:16.02785 3 7 19.9884 37.0933 45.08 2.69964\n"
+                    "short line\n")
+    records = load_trace(str(path), 'sensor', str(tmp_path))
+    assert [record[:2] for record in records] == [('1', '122.153'), ('7', '19.9884')]
+
+def test_sorted_trace_is_replayed_from_the_cache(tmp_path):
+    records = load_trace(write_machine_trace(tmp_path / 'sorted.csv', [100, 100, 200, 300]), 'machine', str(tmp_path))
+    replay, times = replay_order(records)
+    assert isinstance(replay, TraceRecords)
+    assert times.tolist() == [100, 100, 200, 300]
+    assert not list(tmp_path.glob('*.order.npy'))
+
+def test_unsorted_trace_is_replayed_in_stable_time_order(tmp_path):
+    timestamps = [300, 100, 200, 100]
+    records = load_trace(write_machine_trace(tmp_path / 'unsorted.csv', timestamps), 'machine', str(tmp_path))
+    replay, times = replay_order(records)
+    assert isinstance(replay, ReplayRecords)
+    assert times.tolist() == [100, 100, 200, 300]
+    assert [record[0] for record in replay[:]] == ['1', '3', '2', '0']
+    # Strings as in the trace file, an empty utilisation as ""
+    assert replay[0] == ('1', '100', '1', '1')
+    assert records[0] == ('0', '300', '0', '')
+
+def test_chunked_sort_matches_a_stable_argsort(tmp_path, monkeypatch):
+    # Small chunks so the sort goes through many buckets
+    monkeypatch.setattr(util.trace, 'ROWS_PER_CHUNK', 1000)
+    rng = np.random.default_rng(0)
+    for name, times in [('ties', rng.integers(0, 500, 20000).astype(np.float64)),
+                        ('skewed', np.concatenate((np.full(3000, 7.0), rng.exponential(1.0, 17000)))),
+                        ('equal', np.full(5000, 3.0))]:
+        order_path = str(tmp_path / f'{name}.order.npy')
+        write_replay_order(times, order_path)
+        replay = np.load(order_path)
+        expected = np.argsort(times, kind='stable')
+        assert np.array_equal(replay['index'], expected)
+        assert np.array_equal(replay['time'], times[expected])
+
+def test_trace_records_pickle_as_their_cache(tmp_path):
+    records = load_trace(write_machine_trace(tmp_path / 'machine.csv', [100, 200]), 'machine', str(tmp_path),
+                         numeric=True)
+    copy = pickle.loads(pickle.dumps(records))
+    assert copy.numeric and copy[:] == records[:]
+    copy.close()
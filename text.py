@@ -1,68 +1,70 @@
-import re
+from util.file import read_word_ids
+
+import numpy as np
 
 """
 This is the function to calculate the overlap rate in the sentences.
 """
 
-# Function to read sentences from the file
-def read_sentences_from_file(file_path, length):
-    try:
-        with open(file_path, 'r') as file:
-            text = file.read()
-    except FileNotFoundError:
-        print(f"File {file_path} not found.")
-        return []
-
-    # Remove all non-alphabetic characters and convert to lowercase
-    cleaned_text = re.sub(r'[^a-zA-Z\s]', '', text).lower()
-    
-    # Split text into words
-    words = cleaned_text.split()
-    print(f"Total words extracted: {len(words)}")
+MAX_SENTENCE_LENGTH = 50
 
-    # Group words into sentences of length words each
-    sentences = [' '.join(words[i:i+length]) for i in range(0, len(words), length)]
-    print(f"Total sentences created: {len(sentences)}")
+# Function to find, for every word, the position of the previous occurrence of the same word
+def previous_occurrences(word_ids):
+    # Sorting the unique keys id * n + position orders by word, then position,
+    # and is much faster than a stable argsort of the ids
+    n = len(word_ids)
+    keys = word_ids.astype(np.int64) * n + np.arange(n)
+    keys.sort()
+    sorted_ids = keys // n
+    order = keys - sorted_ids * n
+    previous = np.full(n, -1, dtype=np.int64)
+    same_word = np.flatnonzero(sorted_ids[1:] == sorted_ids[:-1]) + 1
+    previous[order[same_word]] = order[same_word - 1]
+    return previous
 
-    return sentences
+# Function to keep the words repeated within max_distance words: (positions, previous positions)
+def repeated_words(word_ids, max_distance):
+    previous = previous_occurrences(word_ids)
+    positions = np.flatnonzero((previous >= 0) & (np.arange(len(word_ids)) - previous < max_distance))
+    return positions, previous[positions]
 
-# Function to calculate the average rate of common words between consecutive sentences
-def calculate_average_common_rate(sentences):
-    if len(sentences) < 2:
-        return 0
+# Function to calculate the average number of common words between consecutive sentences
+def calculate_average_common_rate(num_words, positions, previous, length):
+    # Sentences are consecutive runs of length words (the last one may be
+    # shorter), and each word counts once per sentence. A word is common with
+    # the previous sentence exactly when its previous occurrence lies in that
+    # sentence: it is then also its first occurrence in its own sentence. So
+    # only words repeated within 2 * length words can be common.
+    num_sentences = -(-num_words // length)
+    if num_sentences < 2:
+        return 0, 0
 
-    total_common_rate = 0
-    total_overlap = 0
-    for i in range(1, len(sentences)):
-        words_set_current = set(sentences[i].split())
-        words_set_previous = set(sentences[i-1].split())
-        common_words = words_set_current.intersection(words_set_previous)
-        # print("new sentence comparison:")
-        # print(words_set_current)
-        # print(words_set_previous)
-        # print(common_words)
-        # total_common_rate += len(common_words) / len(words_set_previous)
-        total_common_rate += len(common_words)
-        if len(common_words) > 0:
-            total_overlap += 1
+    sentence = positions // length
+    common_sentences = sentence[previous // length == sentence - 1]
+    total_common_rate = len(common_sentences)
+    # Distinct sentences with a common word (common_sentences is sorted)
+    total_overlap = 1 + int(np.count_nonzero(common_sentences[1:] != common_sentences[:-1])) if total_common_rate else 0
 
-    average_common_rate = total_common_rate / (len(sentences) - 1)
-    proportion_of_overlapping_sentences = total_overlap / (len(sentences) - 1)
+    average_common_rate = total_common_rate / (num_sentences - 1)
+    proportion_of_overlapping_sentences = total_overlap / (num_sentences - 1)
     return average_common_rate, proportion_of_overlapping_sentences
 
 def main():
     file_path = 'collection.txt'
     results = []
 
-    for sentence_length in range(1, 51):
-        print(f"\nAnalyzing sentence length: {sentence_length}")
-        sentences = read_sentences_from_file(file_path, sentence_length)
-        
-        if len(sentences) == 0:
-            print("No sentences containing only alphabetic characters were found.")
-            continue
+    # Tokenize once; every sentence length reuses the word ids
+    word_ids, vocabulary = read_word_ids(file_path)
+    print(f"Total words extracted: {len(word_ids)}, distinct words: {len(vocabulary)}")
+    if len(word_ids) == 0:
+        print("No sentences containing only alphabetic characters were found.")
+        return
+    positions, previous = repeated_words(word_ids, 2 * MAX_SENTENCE_LENGTH)
 
-        average_common_rate, proportion_of_overlapping_sentences = calculate_average_common_rate(sentences)
+    for sentence_length in range(1, MAX_SENTENCE_LENGTH + 1):
+        print(f"\nAnalyzing sentence length: {sentence_length}")
+        average_common_rate, proportion_of_overlapping_sentences = calculate_average_common_rate(
+            len(word_ids), positions, previous, sentence_length)
         results.append((sentence_length, average_common_rate, proportion_of_overlapping_sentences))
 
     # Print the results
@@ -0,0 +1,94 @@
+import numpy as np
+
+# Arrival schedules: when each message is due, as an array of send-time
+# offsets (seconds from the start) computed up front, so the producer only
+# sleeps until each batch is due. A schedule is a dict with a 'type' and a
+# few parameters; rates are records/s and default to the input_rate:
+#   {"type": "constant"}                                   input_rate throughout
+#   {"type": "poisson", "seed": 1}                         exponential gaps at input_rate
+#   {"type": "ramp", "start_rate": 0, "end_rate": 1000}    linear over the duration
+#   {"type": "step", "rates": [300, 900, 300], "step_time": 10}
+#   {"type": "sinusoid", "amplitude": 150, "period": 60}   around input_rate (diurnal)
+#   {"type": "on_off", "on_time": 2, "off_time": 8}        input_rate bursts, then silence
+# Every type also takes "poisson": true, which keeps its rate curve but
+# draws the arrivals as a (non-homogeneous) Poisson process.
+
+# Resolution (seconds) of the cumulative rate the arrival times are read from
+ARRIVAL_GRID = 0.001
+# Grid points at most; long runs get a coarser grid (e.g. 86.4 ms over a
+# day) so the grid never takes more than a few MB
+MAX_ARRIVAL_GRID_POINTS = 1000000
+
+def constant_rate(t, rate, duration):
+    return np.full(len(t), float(rate))
+
+def ramp_rate(t, rate, duration, start_rate=0, end_rate=None):
+    end_rate = rate if end_rate is None else end_rate
+    return start_rate + (end_rate - start_rate) * t / duration
+
+def step_rate(t, rate, duration, rates=None, step_time=None):
+    # rates[i] from i * step_time on; the last rate holds until the end
+    rates = np.asarray(rates if rates is not None else [rate], dtype=np.float64)
+    step_time = step_time if step_time is not None else duration / len(rates)
+    return rates[np.minimum((t // step_time).astype(np.int64), len(rates) - 1)]
+
+def sinusoid_rate(t, rate, duration, amplitude=None, period=None, phase=0):
+    amplitude = rate / 2 if amplitude is None else amplitude
+    period = duration if period is None else period
+    return np.maximum(rate + amplitude * np.sin(2 * np.pi * t / period + phase), 0)
+
+def on_off_rate(t, rate, duration, on_time=1, off_time=1):
+    return np.where(t % (on_time + off_time) < on_time, float(rate), 0.0)
+
+# Rate curve of each schedule type: rate(t, input_rate, duration, **parameters)
+ARRIVALS = {
+    'constant': constant_rate,
+    'poisson': constant_rate,
+    'ramp': ramp_rate,
+    'step': step_rate,
+    'sinusoid': sinusoid_rate,
+    'on_off': on_off_rate,
+}
+
+def rate_curve(schedule, rate, duration):
+    # Returns (t, rate at t) on the ARRIVAL_GRID, or on
+    # MAX_ARRIVAL_GRID_POINTS points for long durations
+    if schedule['type'] not in ARRIVALS:
+        raise ValueError(f"Unknown arrival type {schedule['type']}, choose from {sorted(ARRIVALS)}")
+    curve = ARRIVALS[schedule['type']]
+    parameters = {key: value for key, value in schedule.items() if key not in ('type', 'poisson', 'seed')}
+    rate = parameters.pop('rate', rate)
+    t = np.linspace(0, duration, min(int(round(duration / ARRIVAL_GRID)), MAX_ARRIVAL_GRID_POINTS) + 1)
+    return t, curve(t, rate, duration, **parameters)
+
+def arrival_times(schedule, rate, duration):
+    # Sorted send-time offsets (seconds) of the messages of one run. Arrival k
+    # is where the expected message count (the integral of the rate curve)
+    # reaches k, or, for Poisson arrivals, a sum of k + 1 unit exponentials.
+    t, rates = rate_curve(schedule, rate, duration)
+    expected = np.concatenate(([0.0], np.cumsum((rates[1:] + rates[:-1]) / 2 * np.diff(t))))
+    total = expected[-1]
+    if schedule['type'] == 'poisson' or schedule.get('poisson'):
+        rng = np.random.default_rng(schedule.get('seed'))
+        # Enough draws to pass the total with overwhelming probability
+        draws = int(total + 10 * np.sqrt(total) + 10)
+        targets = np.cumsum(rng.exponential(1.0, draws))
+        targets = targets[targets < total]
+    else:
+        # floor(total) arrivals, 0 .. floor(total) - 1; the tolerance keeps
+        # an integral total (e.g. 500 rec/s for 3 s) from gaining an arrival
+        # through rounding in the cumulative sum
+        targets = np.arange(int(np.floor(total + 1e-9 * max(total, 1.0))), dtype=np.float64)
+    # Invert the expected count by linear interpolation on the grid
+    upper = np.clip(np.searchsorted(expected, targets, side='left'), 1, len(t) - 1)
+    lower = upper - 1
+    span = expected[upper] - expected[lower]
+    fraction = np.divide(targets - expected[lower], span, out=np.zeros(len(targets)), where=span > 0)
+    return np.maximum(t[lower] + fraction * (t[upper] - t[lower]), 0)
+
+def describe_arrival(schedule):
+    # Tag stored with the results, e.g. "ramp(end_rate=1000, start_rate=0)"
+    if schedule is None:
+        return 'constant'
+    parameters = ', '.join(f"{key}={value}" for key, value in sorted(schedule.items()) if key != 'type')
+    return f"{schedule['type']}({parameters})"
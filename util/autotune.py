@@ -0,0 +1,190 @@
+from util.harness import run_cell, run_config, SPEC_DEFAULTS, _output_lock
+from util.results import save_run, load_index
+from util.search import check_probe
+
+import json
+import os
+
+import numpy as np
+
+# Concurrency autotuner: for a fixed workload (input rate, dataset, ...),
+# find the smallest reserved concurrency that meets a p99 target. A spec
+# with an 'autotune' block tunes every cell of its sweep:
+#   "autotune": {"slo_p99_ms": 2000, "max_concurrency": 200,
+#                "stages": ["wordcount_split_redis_kinesis", "wordcount_count_redis_kinesis"]},
+#   "sweep": {"input_rate": [300, 600]}
+# Without 'stages' one concurrency is shared by all functions; with it each
+# listed stage gets its own, tuned one stage at a time by binary search
+# with the others fixed. A setting passes when util.search.check_probe
+# accepts its run (all messages processed, bounded backlog, p99 within the
+# SLO).
+#
+# Latency is assumed not to rise when any stage gets more concurrency, so
+# a passing setting implies every setting above it passes and a failing one
+# implies every setting below it fails. Those settings are not run, and
+# neither are settings already measured for the same workload in the run
+# store index (earlier sweeps or tuning runs).
+AUTOTUNE_DEFAULTS = {
+    'slo_p99_ms': 1000,
+    # Function names tuned separately; None tunes one shared concurrency
+    'stages': None,
+    'min_concurrency': 1,
+    'max_concurrency': 200,
+    # Stop once the failing and passing concurrency are this close (relative)
+    'resolution': 0.05,
+    # Fraction of the input rate the harness may fall short of in a run
+    'rate_tolerance': 0.05,
+    'max_latency_growth': 0.05,
+    'max_probes': 20,
+    # Count matching runs already in the run store index as measurements
+    'reuse_results': True,
+}
+
+def _canonical(config):
+    return json.dumps(config, sort_keys=True, default=str)
+
+def _stage_value(replica, function_name):
+    return replica.get(function_name) if isinstance(replica, dict) else replica
+
+def autotune_cell(spec, cell, clients=None, lane=None, budget=None):
+    # Tunes one cell and returns its run store entry; the signature matches
+    # run_cell so util.matrix can run it on lanes
+    autotune = {**AUTOTUNE_DEFAULTS, **spec['autotune']}
+    settings = {**SPEC_DEFAULTS, **spec, **(lane or {}), **cell}
+    stages = autotune['stages']
+    base = settings['replica']
+    # Settings are points: one concurrency per tuned stage
+    width = 1 if stages is None else len(stages)
+
+    def to_replica(point):
+        if stages is None:
+            return point[0]
+        replica = {name: _stage_value(base, name) for name in settings['functions']}
+        replica.update(zip(stages, point))
+        return replica
+
+    def to_point(replica):
+        # None when replica is not a setting of this tuning (other values
+        # for the untuned functions, or a stage without a concurrency)
+        if stages is None:
+            point = (replica,)
+        else:
+            untuned = [name for name in settings['functions'] if name not in stages]
+            if any(_stage_value(replica, name) != _stage_value(base, name) for name in untuned):
+                return None
+            point = tuple(_stage_value(replica, name) for name in stages)
+        return point if all(isinstance(value, int) for value in point) else None
+
+    measurements = {}
+
+    def record(point, summary, source, run_id):
+        reasons = check_probe(summary, settings['input_rate'], autotune)
+        measurements[point] = {
+            'concurrency': to_replica(point),
+            'passed': not reasons,
+            'reasons': reasons,
+            'p99_end_to_end_ms': summary.get('p99_end_to_end_ms'),
+            'source': source,
+            'run_id': run_id,
+        }
+        return not reasons
+
+    if autotune['reuse_results']:
+        # Earlier runs of the same workload with any concurrency
+        workload = _canonical({**run_config(settings), 'replica': None})
+        for entry in load_index(settings['name'], settings['results_dir']):
+            config = entry['config']
+            if _canonical({**config, 'replica': None}) != workload:
+                continue
+            point = to_point(config.get('replica'))
+            if point is not None:
+                record(point, entry['summary'], 'results', entry['run_id'])
+        if measurements:
+            print(f"Reusing {len(measurements)} earlier measurements of this workload")
+
+    runs = []
+    pruned = []
+
+    def known(point):
+        for other, measurement in measurements.items():
+            if measurement['passed'] and all(a >= b for a, b in zip(point, other)):
+                return True
+            if not measurement['passed'] and all(a <= b for a, b in zip(point, other)):
+                return False
+        return None
+
+    def passes(point):
+        verdict = known(point)
+        if verdict is not None:
+            pruned.append(point)
+            print(f"Concurrency {to_replica(point)}: {'passes' if verdict else 'fails'} (implied by earlier measurements)")
+            return verdict
+        entry = run_cell(spec, {**cell, 'replica': to_replica(point)}, clients, lane, budget)
+        runs.append(point)
+        passed = record(point, entry['summary'], 'run', entry['run_id'])
+        reasons = measurements[point]['reasons']
+        print(f"Concurrency {to_replica(point)}: " + ("passes" if passed else "fails: " + '; '.join(reasons)))
+        return passed
+
+    current = (autotune['max_concurrency'],) * width
+    feasible = passes(current)
+    if feasible:
+        for index in range(width):
+            # Highest value known to fail and lowest known to pass for this stage
+            low = autotune['min_concurrency'] - 1
+            high = current[index]
+            while high - low > max(1, autotune['resolution'] * high) and len(runs) < autotune['max_probes']:
+                middle = (low + high) // 2
+                point = current[:index] + (middle,) + current[index + 1:]
+                if passes(point):
+                    high = middle
+                else:
+                    low = middle
+            current = current[:index] + (high,) + current[index + 1:]
+
+    return report_autotune(settings, cell, autotune, measurements, to_replica(current) if feasible else None,
+                           len(runs), len(pruned))
+
+def report_autotune(settings, cell, autotune, measurements, concurrency, runs, pruned):
+    name = settings['name']
+    reused = sum(1 for measurement in measurements.values() if measurement['source'] == 'results')
+    lines = [f"{key}: {value}" for key, value in cell.items()]
+    lines.append(f"input_rate: {settings['input_rate']}")
+    lines.append(f"slo_p99_ms: {autotune['slo_p99_ms']}")
+    if concurrency is None:
+        lines.append(f"concurrency: none meets the SLO up to {autotune['max_concurrency']}")
+    else:
+        lines.append(f"concurrency: {concurrency}")
+    lines.append(f"runs: {runs}, reused measurements: {reused}, settings implied without a run: {pruned}")
+    lines.append("concurrency / p99 ms / passed / source")
+    for point in sorted(measurements):
+        measurement = measurements[point]
+        p99 = measurement['p99_end_to_end_ms']
+        verdict = 'yes' if measurement['passed'] else 'no: ' + '; '.join(measurement['reasons'])
+        lines.append(f"{measurement['concurrency']} / {'-' if p99 is None else f'{p99:.2f}'} / {verdict} / {measurement['source']}")
+    for line in lines:
+        print(line)
+
+    os.makedirs(settings['results_dir'], exist_ok=True)
+
+    # One row per measured setting
+    points = sorted(measurements)
+    arrays = {
+        'concurrency': np.array(points, dtype=np.int64).reshape(len(points), -1),
+        'passed': np.array([measurements[point]['passed'] for point in points], dtype=bool),
+        'p99_end_to_end_ms': np.array([np.nan if measurements[point]['p99_end_to_end_ms'] is None
+                                       else measurements[point]['p99_end_to_end_ms'] for point in points]),
+    }
+    summary = {
+        'concurrency': concurrency,
+        'runs': runs,
+        'reused': reused,
+        'pruned': pruned,
+        'measurements': [measurements[point] for point in points],
+    }
+    # Cells tuned on parallel lanes share the report file and the run index
+    with _output_lock:
+        with open(os.path.join(settings['results_dir'], f"{name}_autotune.txt"), 'a') as out_file:
+            out_file.write('\n'.join(lines) + '\n\n')
+        return save_run(f"{name}_autotune", arrays, {**cell, 'input_rate': settings['input_rate'], 'autotune': autotune},
+                        summary, settings['results_dir'])
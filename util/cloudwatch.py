@@ -1,5 +1,35 @@
 import boto3
+import itertools
 import re
+import os
+import json
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from botocore.exceptions import ClientError
+
+from util.storage import grow_columns
+
+# Per-message metrics logged by the functions and the Lambda REPORT lines
+METRIC_DTYPE = np.dtype([
+    ('msg_id', 'i8'),
+    ('start', 'f8'),
+    ('end', 'f8'),
+    ('exec_time', 'f8'),
+    ('memory_size', 'i4'),
+])
+REPORT_DTYPE = np.dtype([
+    ('duration', 'f8'),
+    ('memory_size', 'i4'),
+])
+CUSTOM_METRICS_MARKER = b'custom metrics'
+REPORT_MARKER = b'REPORT RequestId'
+# One compiled pattern pulls every field out of both line kinds in a single
+# scan, whatever order the fields are logged in. "Billed Duration" and
+# "Init Duration" must not be read as the REPORT Duration.
+LOG_FIELD_PATTERN = re.compile(
+    rb'(Message ID|Start Time|End Time|Execution time|(?<!Billed )(?<!Init )Duration|Memory Size): ([\d.]+)'
+)
 
 def delete_log_group(log_client, log_group_name):
     try:
@@ -11,55 +41,406 @@ def delete_log_group(log_client, log_group_name):
         print(f"Unexpected error: {e}")
         raise e
 
-def parse_log_file(file_path):
-    msg_stats = {}
-
-    with open(file_path, 'r') as file:
-        max_start_time = None
-        min_start_time = None
-        max_end_time = None
-        for line in file:
-            if not "custom metrics" in line:
-                continue
-
-            # Extract Start Time, Execution time, Message ID
-            msg_id_match = re.search(r'Message ID: (\d+)', line)
-            start_time_match = re.search(r'Start Time: ([\d.]+)', line)
-            end_time_match = re.search(r'End Time: ([\d.]+)', line)
-            execution_time_match = re.search(r'Execution time: ([\d.]+) microseconds', line)
-
-            if not (msg_id_match and start_time_match and end_time_match and execution_time_match):
-                continue
-
-            msg_id = msg_id_match.group(1)
-            start_time = float(start_time_match.group(1))
-            end_time = float(end_time_match.group(1))
-            execution_time = float(execution_time_match.group(1))
-
-            if max_start_time is None or start_time > max_start_time:
-                max_start_time = start_time
-                msg_stats['max_start_time'] = max_start_time
-            if min_start_time is None or start_time < min_start_time:
-                min_start_time = start_time
-                msg_stats['min_start_time'] = min_start_time
-            if max_end_time is None or end_time > max_end_time:
-                max_end_time = end_time
-                msg_stats['max_end_time'] = max_end_time
-                
-            # Check if the replica number matches the expected value
-            if msg_id not in msg_stats:
-                msg_stats[msg_id] = {
-                    'start_time': start_time,
-                    'end_time': end_time,
-                    'execution_time': execution_time
-                }
-            else:
-                if msg_stats[msg_id]['start_time'] > start_time:
-                    msg_stats[msg_id]['start_time'] = start_time
-                if msg_stats[msg_id]['end_time'] < end_time:
-                    msg_stats[msg_id]['end_time'] = end_time
-                if msg_stats[msg_id]['execution_time'] > execution_time:
-                    msg_stats[msg_id]['execution_time'] = execution_time
+class LogFetcher:
+    # Incremental replacement for shelling out to `aws logs filter-log-events`.
+    # Each poll only asks CloudWatch for events from the cursor onwards and
+    # appends the new ones to a local segment file. CloudWatch can ingest an
+    # event after later ones are already visible, so the cursor trails the
+    # newest timestamp by overlap_ms and the event IDs seen in that window are
+    # used to drop repeats.
+    def __init__(self, log_client, log_group_name, start_time_ms, segment_path=None, filter_pattern=None, overlap_ms=30000):
+        self.log_client = log_client
+        self.log_group_name = log_group_name
+        self.start_time_ms = start_time_ms
+        self.filter_pattern = filter_pattern
+        self.overlap_ms = overlap_ms
+        self.cursor_ms = start_time_ms
+        self.max_timestamp = start_time_ms
+        # eventId -> timestamp for events at or after the cursor
+        self.seen_ids = {}
+        self.total_events = 0
+        self.segment_path = segment_path
+        if segment_path is not None:
+            directory = os.path.dirname(segment_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # A new fetcher starts a new segment
+            open(segment_path, 'w').close()
+
+    def poll(self):
+        kwargs = {
+            'logGroupName': self.log_group_name,
+            'startTime': self.cursor_ms,
+        }
+        if self.filter_pattern:
+            kwargs['filterPattern'] = self.filter_pattern
+
+        new_events = []
+        paginator = self.log_client.get_paginator('filter_log_events')
+        try:
+            for page in paginator.paginate(**kwargs):
+                for event in page['events']:
+                    event_id = event['eventId']
+                    if event_id in self.seen_ids:
+                        continue
+                    self.seen_ids[event_id] = event['timestamp']
+                    if event['timestamp'] > self.max_timestamp:
+                        self.max_timestamp = event['timestamp']
+                    new_events.append(event)
+        except self.log_client.exceptions.ResourceNotFoundException:
+            # The log group is recreated by the first invocation
+            return []
+
+        self.cursor_ms = max(self.start_time_ms, self.max_timestamp - self.overlap_ms)
+        self.seen_ids = {
+            event_id: timestamp for event_id, timestamp in self.seen_ids.items()
+            if timestamp >= self.cursor_ms
+        }
+        self.total_events += len(new_events)
+
+        if self.segment_path is not None and new_events:
+            with open(self.segment_path, 'a') as file:
+                for event in new_events:
+                    file.write(json.dumps({
+                        'timestamp': event['timestamp'],
+                        'eventId': event['eventId'],
+                        'message': event['message']
+                    }) + '\n')
+        return new_events
+
+# Fields of each line kind: (label, column, value when the field is missing;
+# None for a required field)
+METRIC_FIELDS = [
+    (b'Message ID', 'msg_id', None),
+    (b'Start Time', 'start', None),
+    (b'End Time', 'end', np.nan),
+    (b'Execution time', 'exec_time', None),
+    (b'Memory Size', 'memory_size', 0),
+]
+REPORT_FIELDS = [
+    (b'Duration', 'duration', None),
+    (b'Memory Size', 'memory_size', None),
+]
+# Lines parsed as one block, and bytes read from a log file at a time
+LOG_BLOCK_LINES = 1 << 16
+LOG_READ_BYTES = 1 << 24
+
+# Labels LOG_FIELD_PATTERN reads
+LOG_FIELD_LABELS = [b'Message ID', b'Start Time', b'End Time', b'Execution time', b'Duration', b'Memory Size']
+# Longest field value the block parser reads (longer ones go line by line)
+LOG_VALUE_WIDTH = 32
+# Powers of ten that are exact doubles
+POWERS_OF_TEN = np.array([float(f'1e{exponent}') for exponent in range(23)])
+
+def _bytes_before(data, positions, text):
+    # Whether data[position - len(text):position] == text, per position
+    found = positions >= len(text)
+    windows = sliding_window_view(data, len(text))[np.where(found, positions - len(text), 0)]
+    return found & (windows == np.frombuffer(text, dtype=np.uint8)).all(axis=1)
+
+def _field_at(data, is_value, separators, label):
+    # Whether LOG_FIELD_PATTERN reads label at each ": " separator: the label
+    # right before it (Duration not as Billed or Init Duration) and a value
+    # right after it
+    found = _bytes_before(data, separators, label) & is_value[separators + 2]
+    if label == b'Duration':
+        label_starts = separators - len(label)
+        found &= ~_bytes_before(data, label_starts, b'Billed ') & ~_bytes_before(data, label_starts, b'Init ')
+    return found
+
+def _layout_columns(lines, labels):
+    # Fast path for lines that share one layout (lines logged by the same
+    # statement): the fields are located in the first line, then the ": "
+    # separators of all lines are found in one NumPy pass over the joined
+    # lines and the values are read column-wise, after checking that every
+    # line has the first line's separators and fields at the same place.
+    # Returns {label: (value bytes, value lengths)} for the labels the first
+    # line has, or None if the lines have to be parsed one by one.
+    template = lines[0]
+    width = template.count(b': ')
+    # A newline after every line and padding, so values can be read as
+    # fixed-width windows up to the end
+    data = np.frombuffer(b'\n'.join(lines) + b'\n' + bytes(LOG_VALUE_WIDTH), dtype=np.uint8)
+    separators = np.flatnonzero((data[:-1] == ord(':')) & (data[1:] == ord(' ')))
+    newlines = np.flatnonzero(data == ord('\n'))
+    if not width or len(separators) != width * len(lines) or len(newlines) != len(lines):
+        return None
+    separators = separators.reshape(len(lines), width)
+    # Every line's separators lie between its own newlines
+    if (separators[1:, 0] < newlines[:-1]).any() or (separators[:, -1] > newlines).any():
+        return None
+    # Digits and dots, the bytes of a value, and where each run of them ends
+    is_value = ((data >= ord('0')) & (data <= ord('9'))) | (data == ord('.'))
+    value_ends = np.flatnonzero(is_value[:-1] & ~is_value[1:]) + 1
+    fields = {}
+    for match in LOG_FIELD_PATTERN.finditer(template):
+        # Later fields of the same label win, as in dict(findall())
+        fields[template.count(b': ', 0, match.end(1) + 2) - 1] = match.group(1)
+    columns = {}
+    for index in range(width):
+        label = fields.get(index)
+        if label is None:
+            # Not a field in the first line, so in no line either
+            if any(_field_at(data, is_value, separators[:, index], other).any() for other in LOG_FIELD_LABELS):
+                return None
+            continue
+        if not _field_at(data, is_value, separators[:, index], label).all():
+            return None
+        if label not in labels:
+            continue
+        starts = separators[:, index] + 2
+        lengths = value_ends[np.searchsorted(value_ends, starts, side='right')] - starts
+        value_width = int(lengths.max())
+        if value_width > LOG_VALUE_WIDTH:
+            return None
+        columns[label] = (sliding_window_view(data, value_width)[starts], lengths)
+    return columns
+
+def _decimal_values(chars, lengths, dtype):
+    # Values (rows of chars, the first lengths bytes digits and dots) as
+    # numbers, by Horner's rule over the columns. A float is then its digits
+    # over a power of ten, which is exact, so rounded as float() rounds, while
+    # the digits are below 2 ** 53 and there are at most 22 decimals; other
+    # values (and anything int() or float() would reject) go through
+    # astype, one by one
+    width = chars.shape[1]
+    is_dot = chars == ord('.')
+    mantissa = np.zeros(len(chars), dtype=np.int64)
+    decimals = np.zeros(len(chars), dtype=np.int64)
+    seen_dot = np.zeros(len(chars), dtype=bool)
+    for column in range(width):
+        digit = (column < lengths) & ~is_dot[:, column]
+        mantissa = np.where(digit, mantissa * 10 + (chars[:, column].astype(np.int64) - ord('0')), mantissa)
+        decimals += digit & seen_dot
+        seen_dot |= is_dot[:, column] & (column < lengths)
+    dots = (is_dot & (np.arange(width) < lengths[:, None])).sum(axis=1)
+    exact = (dots <= (dtype.kind == 'f')) & (lengths > dots) & (lengths - dots <= 18)
+    if dtype.kind == 'f':
+        exact &= (mantissa < 1 << 53) & (decimals < len(POWERS_OF_TEN))
+        values = mantissa / POWERS_OF_TEN[np.minimum(decimals, len(POWERS_OF_TEN) - 1)]
+    else:
+        values = mantissa
+    if not exact.all():
+        padded = np.where(np.arange(width) < lengths[:, None], chars, 0).astype(np.uint8)
+        values[~exact] = padded[~exact].view(f'S{width}').ravel().astype(dtype)
+    return values.astype(dtype)
+
+def _parse_each_line(lines, fields, dtype):
+    # Slow path, one regex scan per line. Returns the rows and the indices of
+    # the lines they come from.
+    rows = []
+    kept = []
+    for index, line in enumerate(lines):
+        found = dict(LOG_FIELD_PATTERN.findall(line))
+        if any(missing is None and label not in found for label, _, missing in fields):
+            continue
+        rows.append(tuple(
+            (int if dtype[name].kind == 'i' else float)(found[label]) if label in found else missing
+            for label, name, missing in fields
+        ))
+        kept.append(index)
+    return np.array(rows, dtype=dtype), np.array(kept, dtype=np.int64)
+
+def _parse_layout(lines, fields, dtype):
+    # Rows of lines sharing a layout, or None
+    columns = _layout_columns(lines, [label for label, _, _ in fields])
+    if columns is None or any(missing is None and label not in columns for label, _, missing in fields):
+        return None
+    rows = np.empty(len(lines), dtype=dtype)
+    for label, name, missing in fields:
+        rows[name] = _decimal_values(*columns[label], dtype[name]) if label in columns else missing
+    return rows
+
+def _parse_block(lines, fields, dtype):
+    # One structured array row per line that has every required field, in
+    # line order. Lines are grouped by their number of ": " separators when
+    # they do not all share one layout (e.g. REPORT lines with and without an
+    # Init Duration); a group that still mixes layouts is parsed line by line.
+    if not lines:
+        return np.empty(0, dtype=dtype)
+    rows = _parse_layout(lines, fields, dtype)
+    if rows is not None:
+        return rows
+    counts = np.fromiter((line.count(b': ') for line in lines), dtype=np.int64, count=len(lines))
+    groups = []
+    positions = []
+    for count in np.unique(counts).tolist():
+        group = np.flatnonzero(counts == count)
+        group_lines = [lines[index] for index in group.tolist()]
+        rows = _parse_layout(group_lines, fields, dtype) if len(group) < len(lines) else None
+        if rows is None:
+            rows, kept = _parse_each_line(group_lines, fields, dtype)
+            group = group[kept]
+        groups.append(rows)
+        positions.append(group)
+    return np.concatenate(groups)[np.argsort(np.concatenate(positions), kind='stable')]
 
+def _parse_lines(lines, marker):
+    # (metrics, reports) of one block of bytes lines
+    is_metric = [marker in line for line in lines]
+    metric_lines = list(itertools.compress(lines, is_metric))
+    # Only the other lines are searched for REPORT lines
+    other_lines = itertools.compress(lines, [not found for found in is_metric])
+    report_lines = [line for line in other_lines if REPORT_MARKER in line]
+    return _parse_block(metric_lines, METRIC_FIELDS, METRIC_DTYPE), _parse_block(report_lines, REPORT_FIELDS, REPORT_DTYPE)
+
+def _concat_blocks(blocks):
+    if not blocks:
+        return np.empty(0, dtype=METRIC_DTYPE), np.empty(0, dtype=REPORT_DTYPE)
+    return np.concatenate([metrics for metrics, _ in blocks]), np.concatenate([reports for _, reports in blocks])
+
+def parse_log_arrays(lines, marker=CUSTOM_METRICS_MARKER):
+    # Returns (metrics, reports) as structured arrays of METRIC_DTYPE and
+    # REPORT_DTYPE. Lines may be bytes (fastest, e.g. a file opened in binary
+    # mode) or str. Metric lines without an End Time or Memory Size get NaN / 0.
+    # Lines are parsed LOG_BLOCK_LINES at a time, column-wise where the lines
+    # share a layout.
+    blocks = []
+    lines = iter(lines)
+    while True:
+        block = [line.encode('utf-8') if isinstance(line, str) else line
+                 for line in itertools.islice(lines, LOG_BLOCK_LINES)]
+        if not block:
+            break
+        blocks.append(_parse_lines(block, marker))
+    return _concat_blocks(blocks)
+
+def parse_log_file_arrays(file_path, marker=CUSTOM_METRICS_MARKER):
+    # Reads the file in LOG_READ_BYTES blocks instead of line by line
+    blocks = []
+    rest = b''
+    with open(file_path, 'rb') as file:
+        while True:
+            data = file.read(LOG_READ_BYTES)
+            if not data:
+                break
+            lines = (rest + data).split(b'\n')
+            rest = lines.pop()
+            for start in range(0, len(lines), LOG_BLOCK_LINES):
+                blocks.append(_parse_lines(lines[start:start + LOG_BLOCK_LINES], marker))
+    if rest:
+        blocks.append(_parse_lines([rest], marker))
+    return _concat_blocks(blocks)
+
+def concat_log_arrays(totals, new):
+    # Appends a (metrics, reports) pair to an accumulated pair (or None)
+    if totals is None:
+        return new
+    return np.concatenate((totals[0], new[0])), np.concatenate((totals[1], new[1]))
+
+def summarize_memory_stats(metrics, reports, expected_memory_size):
+    # Summary used by the memory-size sweeps (stateful/stateless tests)
+    metrics = metrics[metrics['memory_size'] == expected_memory_size]
+    reports = reports[reports['memory_size'] == expected_memory_size]
+    return {
+        'average_duration': float(reports['duration'].mean()) if len(reports) else 0,
+        'min_start_time': float(metrics['start'].min()) if len(metrics) else None,
+        'max_start_time': float(metrics['start'].max()) if len(metrics) else None,
+        'unique_message_id_count': len(np.unique(metrics['msg_id'])),
+        'average_execution_time': float(metrics['exec_time'].mean()) if len(metrics) else 0
+    }
+
+class MessageStats:
+    # Per-message timings in arrays indexed by msg_id (msg_ids are the dense
+    # integers handed out by the producer): 24 bytes per message instead of a
+    # dict per message. Replicas can log the same msg_id more than once (and
+    # some functions log a line per output, e.g. one per word); the earliest
+    # start, latest end and shortest execution time are kept.
+    def __init__(self, capacity=1 << 16):
+        self.start = np.full(capacity, np.nan)
+        self.end = np.full(capacity, np.nan)
+        self.exec_time = np.full(capacity, np.nan)
+        self.count = 0
+        self.max_msg_id = -1
+        self.min_start_time = None
+        self.max_start_time = None
+        self.max_end_time = None
+
+    def _ensure_capacity(self, size):
+        grow_columns(self, ('start', 'end', 'exec_time'), size)
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, msg_id):
+        return 0 <= msg_id <= self.max_msg_id and not np.isnan(self.start[msg_id])
+
+    def update(self, metrics):
+        # Merges a METRIC_DTYPE array; returns (previous, merged), the rows of
+        # every msg_id whose stored timings changed before and after the merge
+        # (previous is NaN for msg_ids seen for the first time), so anything
+        # derived from the timings (histograms) can be revised to match
+        metrics = metrics[metrics['msg_id'] >= 0]
+        if len(metrics) == 0:
+            return metrics, metrics
+        # Fold duplicates within the batch first, then min/max-merge with the
+        # stored values in one fancy-indexed operation per column
+        if not (metrics['msg_id'][1:] > metrics['msg_id'][:-1]).all():
+            metrics = metrics[np.argsort(metrics['msg_id'], kind='stable')]
+        sorted_ids = metrics['msg_id']
+        first = np.flatnonzero(np.concatenate(([True], sorted_ids[1:] != sorted_ids[:-1])))
+        msg_ids = sorted_ids[first]
+        self._ensure_capacity(int(msg_ids[-1]) + 1)
+        self.max_msg_id = max(self.max_msg_id, int(msg_ids[-1]))
+
+        previous = np.empty(len(msg_ids), dtype=METRIC_DTYPE)
+        merged = np.empty(len(msg_ids), dtype=METRIC_DTYPE)
+        previous['msg_id'] = merged['msg_id'] = msg_ids
+        previous['memory_size'] = merged['memory_size'] = metrics['memory_size'][first]
+        previous['start'] = self.start[msg_ids]
+        previous['end'] = self.end[msg_ids]
+        previous['exec_time'] = self.exec_time[msg_ids]
+        merged['start'] = np.fmin(previous['start'], np.fmin.reduceat(metrics['start'], first))
+        merged['end'] = np.fmax(previous['end'], np.fmax.reduceat(metrics['end'], first))
+        merged['exec_time'] = np.fmin(previous['exec_time'], np.fmin.reduceat(metrics['exec_time'], first))
+        self.count += int(np.isnan(previous['start']).sum())
+        self.start[msg_ids] = merged['start']
+        self.end[msg_ids] = merged['end']
+        self.exec_time[msg_ids] = merged['exec_time']
+
+        changed = np.zeros(len(msg_ids), dtype=bool)
+        for name in ('start', 'end', 'exec_time'):
+            changed |= (previous[name] != merged[name]) & ~(np.isnan(previous[name]) & np.isnan(merged[name]))
+
+        min_start_time = float(metrics['start'].min())
+        max_start_time = float(metrics['start'].max())
+        if self.min_start_time is None or min_start_time < self.min_start_time:
+            self.min_start_time = min_start_time
+        if self.max_start_time is None or max_start_time > self.max_start_time:
+            self.max_start_time = max_start_time
+        if not np.isnan(metrics['end']).all():
+            max_end_time = float(np.nanmax(metrics['end']))
+            if self.max_end_time is None or max_end_time > self.max_end_time:
+                self.max_end_time = max_end_time
+        return previous[changed], merged[changed]
+
+    def to_arrays(self):
+        # Columns of the msg_ids seen, sorted by msg_id
+        msg_ids = np.flatnonzero(~np.isnan(self.start[:self.max_msg_id + 1]))
+        return {
+            'msg_id': msg_ids,
+            'start': self.start[msg_ids],
+            'end': self.end[msg_ids],
+            'exec_time': self.exec_time[msg_ids],
+        }
+
+def parse_log_lines(lines, msg_stats=None, histogram=None, marker=CUSTOM_METRICS_MARKER):
+    # Folds metrics lines into msg_stats (a MessageStats); call it again with
+    # more lines to update the same stats incrementally. histogram follows the
+    # merged execution time of every msg_id.
+    if msg_stats is None:
+        msg_stats = MessageStats()
+    metrics, _ = parse_log_arrays(lines, marker)
+    previous, merged = msg_stats.update(metrics)
+    if histogram is not None:
+        histogram.remove(previous['exec_time'])
+        histogram.record(merged['exec_time'])
     return msg_stats
 
+def parse_log_file(file_path, marker=CUSTOM_METRICS_MARKER):
+    with open(file_path, 'rb') as file:
+        return parse_log_lines(file, marker=marker)
+
+def stats_to_arrays(msg_stats):
+    # Per-message columns of a parse_log_lines result, sorted by msg_id
+    return msg_stats.to_arrays()
@@ -0,0 +1,127 @@
+import json
+import struct
+
+# Payload codecs for producer messages. Every codec turns a message dict into
+# the bytes sent as the Kinesis record Data and back again, so the analysis
+# (or the emulator) can validate what the functions received. decode_errors
+# are the exceptions decode raises for data that is not one of its messages.
+
+class JsonCodec:
+    name = 'json'
+    decode_errors = (ValueError,)
+
+    def encode(self, msg):
+        return json.dumps(msg).encode('utf-8')
+
+    def decode(self, data):
+        return json.loads(data)
+
+class OrjsonCodec:
+    name = 'orjson'
+
+    def __init__(self):
+        try:
+            import orjson
+        except ImportError:
+            raise ImportError("The orjson codec needs the orjson package (pip install orjson)")
+        self._orjson = orjson
+        self.decode_errors = (orjson.JSONDecodeError,)
+
+    def encode(self, msg):
+        return self._orjson.dumps(msg)
+
+    def decode(self, data):
+        return self._orjson.loads(data)
+
+class MsgpackCodec:
+    name = 'msgpack'
+
+    def __init__(self):
+        try:
+            import msgpack
+        except ImportError:
+            raise ImportError("The msgpack codec needs the msgpack package (pip install msgpack)")
+        self._msgpack = msgpack
+        self.decode_errors = (ValueError, msgpack.exceptions.UnpackException)
+
+    def encode(self, msg):
+        return self._msgpack.packb(msg)
+
+    def decode(self, data):
+        return self._msgpack.unpackb(data)
+
+# Default fixed layout: the fields every producer message carries
+DEFAULT_STRUCT_LAYOUT = [('msg_id', 'q'), ('intended_time', 'd'), ('send_time', 'd')]
+
+class StructCodec:
+    # Fixed binary layout given as [(key, format)], where format is a single
+    # struct code ('q', 'd', 'i', ...) or 's' for a UTF-8 string prefixed with
+    # its uint16 length. Numeric fields missing from a message encode as 0.
+    name = 'struct'
+    # Short data or a string that is not UTF-8
+    decode_errors = (struct.error, ValueError)
+
+    def __init__(self, layout=None):
+        self.layout = list(layout or DEFAULT_STRUCT_LAYOUT)
+        self.keys = {key for key, _ in self.layout}
+        # Consecutive numeric fields are packed with one precompiled Struct
+        self._segments = []
+        numeric = []
+        for key, fmt in self.layout:
+            if fmt == 's':
+                if numeric:
+                    self._segments.append(self._numeric_segment(numeric))
+                    numeric = []
+                self._segments.append(('s', key))
+            else:
+                numeric.append((key, fmt))
+        if numeric:
+            self._segments.append(self._numeric_segment(numeric))
+
+    def _numeric_segment(self, fields):
+        packer = struct.Struct('<' + ''.join(fmt for _, fmt in fields))
+        return ('n', ([key for key, _ in fields], packer))
+
+    def encode(self, msg):
+        if not self.keys.issuperset(msg):
+            raise ValueError(f"Fields {sorted(set(msg) - self.keys)} are not in the struct layout")
+        parts = []
+        for kind, segment in self._segments:
+            if kind == 's':
+                value = str(msg.get(segment, '')).encode('utf-8')
+                parts.append(struct.pack('<H', len(value)))
+                parts.append(value)
+            else:
+                keys, packer = segment
+                parts.append(packer.pack(*[msg.get(key, 0) for key in keys]))
+        return b''.join(parts)
+
+    def decode(self, data):
+        msg = {}
+        pos = 0
+        for kind, segment in self._segments:
+            if kind == 's':
+                (length,) = struct.unpack_from('<H', data, pos)
+                pos += 2
+                msg[segment] = bytes(data[pos:pos + length]).decode('utf-8')
+                pos += length
+            else:
+                keys, packer = segment
+                msg.update(zip(keys, packer.unpack_from(data, pos)))
+                pos += packer.size
+        return msg
+
+# Codecs whose output is JSON text, the format pre-encoded corpus payloads use
+JSON_CODECS = ('json', 'orjson')
+
+CODECS = {
+    'json': JsonCodec,
+    'orjson': OrjsonCodec,
+    'msgpack': MsgpackCodec,
+    'struct': StructCodec,
+}
+
+def get_codec(name='json', **kwargs):
+    if name not in CODECS:
+        raise ValueError(f"Unknown payload codec {name}, choose from {sorted(CODECS)}")
+    return CODECS[name](**kwargs)
@@ -0,0 +1,138 @@
+import time
+
+import numpy as np
+
+# Count at which a msg_id's delivery counter stops increasing
+MAX_DELIVERY_COUNT = np.iinfo(np.uint16).max
+
+def _grow(array, size):
+    if size <= len(array):
+        return array
+    grown = np.zeros(max(size, 2 * len(array)), dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+def _set_bits(bitmap, msg_ids):
+    np.bitwise_or.at(bitmap, msg_ids >> 3, (1 << (msg_ids & 7)).astype(np.uint8))
+
+class CompletionTracker:
+    # Which msg_ids were sent and which have been seen in the function logs.
+    # Both sets are bitmaps (one bit per msg_id); a uint16 count per msg_id
+    # tells duplicate deliveries (Kinesis or producer retries, replicas) apart
+    # from first sightings.
+    def __init__(self, expected_msg_ids=None, capacity=1 << 16):
+        self.expected = np.zeros((capacity + 7) // 8, dtype=np.uint8)
+        self.received = np.zeros((capacity + 7) // 8, dtype=np.uint8)
+        self.counts = np.zeros(capacity, dtype=np.uint16)
+        self.num_expected = 0
+        self.num_received = 0
+        self.num_unexpected = 0
+        self.max_msg_id = -1
+        if expected_msg_ids is not None:
+            self.expect(expected_msg_ids)
+
+    def _ensure_capacity(self, max_msg_id):
+        self.counts = _grow(self.counts, max_msg_id + 1)
+        self.expected = _grow(self.expected, (len(self.counts) + 7) // 8)
+        self.received = _grow(self.received, (len(self.counts) + 7) // 8)
+        self.max_msg_id = max(self.max_msg_id, max_msg_id)
+
+    def _bits(self, bitmap):
+        # Unpacked booleans for msg_ids 0..max_msg_id
+        return np.unpackbits(bitmap, bitorder='little')[:self.max_msg_id + 1].astype(bool)
+
+    def expect(self, msg_ids):
+        msg_ids = np.unique(np.asarray(msg_ids, dtype=np.int64))
+        if len(msg_ids) == 0:
+            return
+        self._ensure_capacity(int(msg_ids[-1]))
+        _set_bits(self.expected, msg_ids)
+        expected = self._bits(self.expected)
+        received = self._bits(self.received)
+        self.num_expected = int(expected.sum())
+        # Ids seen before they were expected now count as received
+        self.num_received = int((received & expected).sum())
+        self.num_unexpected = int((received & ~expected).sum())
+
+    def add(self, msg_ids):
+        # Returns how many msg_ids were seen for the first time
+        msg_ids = np.asarray(msg_ids, dtype=np.int64)
+        msg_ids = msg_ids[msg_ids >= 0]
+        if len(msg_ids) == 0:
+            return 0
+        self._ensure_capacity(int(msg_ids.max()))
+        unique_ids, deliveries = np.unique(msg_ids, return_counts=True)
+        first_seen = unique_ids[self.counts[unique_ids] == 0]
+        self.counts[unique_ids] = np.minimum(self.counts[unique_ids].astype(np.int64) + deliveries, MAX_DELIVERY_COUNT)
+        if len(first_seen):
+            _set_bits(self.received, first_seen)
+            expected = (self.expected[first_seen >> 3] >> (first_seen & 7)) & 1
+            self.num_received += int(expected.sum())
+            self.num_unexpected += int(len(first_seen) - expected.sum())
+        return len(first_seen)
+
+    def complete(self):
+        return self.num_received >= self.num_expected
+
+    def missing_ranges(self, limit=None):
+        # [(first, last)] inclusive runs of expected msg_ids not seen yet
+        missing = np.flatnonzero(self._bits(self.expected) & ~self._bits(self.received))
+        if len(missing) == 0:
+            return []
+        breaks = np.flatnonzero(np.diff(missing) != 1)
+        firsts = np.concatenate(([missing[0]], missing[breaks + 1]))
+        lasts = np.concatenate((missing[breaks], [missing[-1]]))
+        ranges = list(zip(firsts.tolist(), lasts.tolist()))
+        return ranges if limit is None else ranges[:limit]
+
+    def summary(self):
+        counts = self.counts[:self.max_msg_id + 1]
+        duplicated = counts > 1
+        return {
+            'expected': self.num_expected,
+            'received': self.num_received,
+            'missing': self.num_expected - self.num_received,
+            'unexpected': self.num_unexpected,
+            'duplicated_ids': int(duplicated.sum()),
+            'duplicate_deliveries': int((counts[duplicated].astype(np.int64) - 1).sum()),
+            'coverage': self.num_received / self.num_expected if self.num_expected else 0.0,
+        }
+
+    def report(self, max_ranges=10):
+        summary = self.summary()
+        print(f"Received {summary['received']} of {summary['expected']} messages "
+              f"({summary['coverage'] * 100:.2f}%), missing {summary['missing']}, "
+              f"duplicated {summary['duplicated_ids']} ({summary['duplicate_deliveries']} extra deliveries), "
+              f"unexpected {summary['unexpected']}")
+        ranges = self.missing_ranges(max_ranges + 1)
+        if ranges:
+            shown = ', '.join(f"{first}-{last}" if first != last else f"{first}" for first, last in ranges[:max_ranges])
+            more = " ..." if len(ranges) > max_ranges else ""
+            print(f"Missing msg_id ranges: {shown}{more}")
+        return summary
+
+class AdaptivePoller:
+    # Poll interval that halves (down to min_interval) after a poll with new
+    # messages and doubles (up to max_interval) after one without, and a stall
+    # check: no new message for stall_timeout seconds since the last progress
+    # (or since the start)
+    def __init__(self, min_interval=1.0, max_interval=10.0, stall_timeout=60.0):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.stall_timeout = stall_timeout
+        self.interval = min_interval
+        self.last_progress = time.monotonic()
+
+    def update(self, new_count):
+        if new_count:
+            self.interval = max(self.min_interval, self.interval / 2)
+            self.last_progress = time.monotonic()
+        else:
+            self.interval = min(self.max_interval, self.interval * 2)
+        return self.interval
+
+    def stalled(self):
+        return time.monotonic() - self.last_progress > self.stall_timeout
+
+    def wait(self):
+        time.sleep(self.interval)
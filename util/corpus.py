@@ -0,0 +1,133 @@
+import hashlib
+import json
+import os
+import struct
+from array import array
+
+import numpy as np
+
+from util.storage import MappedFile
+
+# Corpus file layout (little endian):
+#   magic (8 bytes) | count (uint64)
+#   payload offsets (count + 1 uint64) | partition key offsets (count + 1 uint64)
+#   payload blob | partition key blob
+# Entry i holds the JSON payload and partition key of msg_id i, exactly what
+# generate_input_data and batch_consumer would have produced for records[i].
+CORPUS_MAGIC = b'EXPCRP01'
+HEADER = struct.Struct('<8sQ')
+
+def build_corpus(records, input_map, file_path, partition_by=None):
+    count = len(records)
+    offsets_size = 2 * (count + 1) * 8
+    payload_offsets = array('Q', [0])
+    key_offsets = array('Q', [0])
+    keys = bytearray()
+
+    tmp_path = f"{file_path}.tmp"
+    with open(tmp_path, 'wb') as file:
+        file.write(HEADER.pack(CORPUS_MAGIC, count))
+        # Offsets are filled in once the blobs are written
+        file.write(b'\0' * offsets_size)
+        payload_size = 0
+        for msg_id, record in enumerate(records):
+            if input_map is None:
+                msg = {'msg_id': msg_id}
+            else:
+                msg = {'msg_id': msg_id, **{key: record[input_map[key]] for key in input_map}}
+            payload = json.dumps(msg).encode('utf-8')
+            file.write(payload)
+            payload_size += len(payload)
+            payload_offsets.append(payload_size)
+
+            partition_key = str(msg[partition_by]) if partition_by is not None else str(msg_id)
+            keys += partition_key.encode('utf-8')
+            key_offsets.append(len(keys))
+
+        file.write(keys)
+        file.seek(HEADER.size)
+        file.write(payload_offsets.tobytes())
+        file.write(key_offsets.tobytes())
+    os.replace(tmp_path, file_path)
+    print(f"Corpus {file_path} built with {count} records")
+
+def stamp_payload(payload, **fields):
+    # Append fields to a pre-encoded JSON object without decoding it; this is
+    # the only copy made of a corpus payload on its way to put_records
+    fields = {key: value for key, value in fields.items() if value is not None}
+    if not fields:
+        return bytes(payload)
+    extra = ''.join(f', "{key}": {json.dumps(value)}' for key, value in fields.items())
+    return b''.join((payload[:-1], extra.encode('utf-8'), b'}'))
+
+class Corpus(MappedFile):
+    def __init__(self, file_path):
+        self.file_path = file_path
+        super().__init__(file_path, CORPUS_MAGIC, HEADER, 'corpus file')
+        count = self.count
+        # Offsets stay in the mapping; nothing is read until it is used
+        self.payload_offsets = np.frombuffer(self._mmap, dtype='<u8', count=count + 1, offset=HEADER.size)
+        self.key_offsets = np.frombuffer(self._mmap, dtype='<u8', count=count + 1, offset=HEADER.size + (count + 1) * 8)
+        self.payload_base = HEADER.size + 2 * (count + 1) * 8
+        self.key_base = self.payload_base + int(self.payload_offsets[-1])
+        self._view = memoryview(self._mmap)
+
+    def _init_args(self):
+        return (self.file_path,)
+
+    def payload(self, index):
+        start, end = self.payload_offsets[index:index + 2].tolist()
+        return self._view[self.payload_base + start:self.payload_base + end]
+
+    def partition_key(self, index):
+        start, end = self.key_offsets[index:index + 2].tolist()
+        return str(self._mmap[self.key_base + start:self.key_base + end], 'utf-8')
+
+    def messages(self, start, size, intended_time=None):
+        # Returns (payload, partition_key, intended_time) tuples; payloads are
+        # memoryview slices of the mapping, so no bytes are copied here
+        end = min(start + size, self.count)
+        if start >= end:
+            return []
+        payload_offsets = self.payload_offsets[start:end + 1].tolist()
+        key_offsets = self.key_offsets[start:end + 1].tolist()
+        view = self._view
+        keys = self._mmap[self.key_base + key_offsets[0]:self.key_base + key_offsets[-1]]
+        key_start = key_offsets[0]
+        payload_base = self.payload_base
+        return [
+            (
+                view[payload_base + payload_offsets[i]:payload_base + payload_offsets[i + 1]],
+                str(keys[key_offsets[i] - key_start:key_offsets[i + 1] - key_start], 'utf-8'),
+                intended_time
+            )
+            for i in range(end - start)
+        ]
+
+    def close(self):
+        self.payload_offsets = None
+        self.key_offsets = None
+        if getattr(self, '_view', None) is not None:
+            self._view.release()
+        super().close()
+
+def corpus_path(file_path, input_map, partition_by=None, source=None):
+    # file_path with a key of everything the payloads depend on before its
+    # extension: the source records (e.g. the dataset and its file hash), the
+    # input map and the partition key
+    key = hashlib.sha256(json.dumps(
+        {'source': source, 'input_map': input_map, 'partition_by': partition_by}, sort_keys=True
+    ).encode('utf-8')).hexdigest()[:16]
+    root, extension = os.path.splitext(file_path)
+    return f"{root}.{key}{extension}"
+
+def open_or_build_corpus(file_path, load_records, input_map, partition_by=None, source=None):
+    # Opens the corpus built for these records, input map and partition key,
+    # building it first if it does not exist yet (load_records is only called
+    # then). A change to any of them builds a new file instead of reusing a
+    # stale one.
+    path = corpus_path(file_path, input_map, partition_by, source)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        build_corpus(load_records(), input_map, path, partition_by)
+    return Corpus(path)
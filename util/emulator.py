@@ -0,0 +1,455 @@
+from util.kinesis import (partition_key_hash, MAX_RECORDS_PER_REQUEST, MAX_BYTES_PER_REQUEST, MAX_RECORD_SIZE,
+                          SHARD_RECORDS_PER_SECOND, SHARD_BYTES_PER_SECOND, THROTTLED_ERROR_CODE)
+from util.kpl import is_aggregated, deaggregate_record
+from util.codec import get_codec
+from util.cloudwatch import CUSTOM_METRICS_MARKER
+
+import bisect
+import heapq
+import math
+import shlex
+import threading
+import time
+import uuid
+
+import numpy as np
+from botocore.exceptions import ClientError
+
+# In-process stand-in for the Kinesis, Lambda and CloudWatch Logs calls the
+# harness makes, for testing and benchmarking it without AWS:
+#
+#   emulator = Emulator()
+#   emulator.create_stream('wc', shard_count=2)
+#   emulator.create_function('wc', 'wc', execution_time=lognormal_time(0.002, 0.5))
+#   run_matrix(spec, emulator.clients())
+#
+# Shards admit records through per-shard records/s and bytes/s buckets and
+# reject the rest with the throttling error code, like PutRecords. Each
+# function consumes its stream like a Kinesis event source mapping: every
+# shard is read in order by up to parallelization_factor batches at a time,
+# and all batches share the function's concurrency. Batches are simulated
+# lazily, up to the current time, whenever the logs are read, and write the
+# same "custom metrics" and REPORT lines as the real functions.
+
+# Memory size at which Lambda allocates one full vCPU
+FULL_CPU_MEMORY_SIZE = 1769
+DEFAULT_MEMORY_SIZE = 128
+# Unreserved account concurrency
+DEFAULT_CONCURRENCY = 1000
+MAX_EVENTS_PER_PAGE = 10000
+
+def constant_time(seconds):
+    return lambda rng, size: np.full(size, seconds)
+
+def exponential_time(mean):
+    return lambda rng, size: rng.exponential(mean, size)
+
+def lognormal_time(median, sigma):
+    return lambda rng, size: rng.lognormal(math.log(median), sigma, size)
+
+def _client_error(code, message, operation_name):
+    return ClientError({'Error': {'Code': code, 'Message': message}}, operation_name)
+
+class ResourceNotFoundException(ClientError):
+    def __init__(self, message, operation_name):
+        super().__init__({'Error': {'Code': 'ResourceNotFoundException', 'Message': message}}, operation_name)
+
+class EmulatorExceptions:
+    # Mirrors client.exceptions.ResourceNotFoundException
+    ResourceNotFoundException = ResourceNotFoundException
+
+class ShardBucket:
+    # Non-blocking token bucket holding one second of the shard's write limit
+    def __init__(self, rate, now):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = now
+
+    def take(self, amount, now):
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if amount > self.tokens:
+            return False
+        self.tokens -= amount
+        return True
+
+class EmulatedStream:
+    def __init__(self, name, shard_count, records_per_second, bytes_per_second, now):
+        self.name = name
+        self.shard_ids = [f"shardId-{index:012d}" for index in range(shard_count)]
+        # Equal split of the 128-bit hash key space, as CreateStream does
+        step = (1 << 128) // shard_count
+        self.starts = [index * step for index in range(shard_count)]
+        self.ends = [start + step - 1 for start in self.starts]
+        self.ends[-1] = (1 << 128) - 1
+        self.buckets = [
+            (ShardBucket(records_per_second, now), ShardBucket(bytes_per_second, now))
+            for _ in range(shard_count)
+        ]
+        # Per shard: [(arrival_time, partition_key, data)]
+        self.records = [[] for _ in range(shard_count)]
+        self.sequence_number = 0
+
+    def shard_index(self, partition_key):
+        return bisect.bisect_right(self.starts, partition_key_hash(partition_key)) - 1
+
+class EmulatedFunction:
+    def __init__(self, name, stream, log_group, execution_time, batch_size, parallelization_factor,
+                 invocation_overhead, poll_delay, memory_size, metrics_marker, codec, seed):
+        self.name = name
+        self.stream = stream
+        self.log_group = log_group
+        self.execution_time = execution_time
+        self.batch_size = batch_size
+        self.parallelization_factor = parallelization_factor
+        self.invocation_overhead = invocation_overhead
+        self.poll_delay = poll_delay
+        self.memory_size = memory_size
+        self.metrics_marker = metrics_marker
+        self.codec = codec
+        self.rng = np.random.default_rng(seed)
+        self.reserved_concurrency = None
+        self.executors = [0.0] * DEFAULT_CONCURRENCY
+        # (shard index, lane) -> [records read, time the lane is free]
+        self.lanes = {}
+        self.invocations = 0
+
+    def set_concurrency(self, concurrency):
+        # Running batches keep their executors; new ones start when one frees up
+        busy = sorted(self.executors, reverse=True)[:concurrency]
+        self.executors = busy + [0.0] * (concurrency - len(busy))
+        heapq.heapify(self.executors)
+
+class Emulator:
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.streams = {}
+        self.functions = {}
+        # log group -> [(timestamp_ms, event_id, message)], appended in time order per batch
+        self.log_groups = {}
+        # Lines of batches that have not ended yet: heap of (timestamp_ms, seq, log group, message)
+        self.pending_logs = []
+        self.event_count = 0
+        self._lock = threading.RLock()
+
+    def create_stream(self, name, shard_count=1, records_per_second=SHARD_RECORDS_PER_SECOND,
+                      bytes_per_second=SHARD_BYTES_PER_SECOND):
+        with self._lock:
+            self.streams[name] = EmulatedStream(name, shard_count, records_per_second, bytes_per_second, self.clock())
+            return self.streams[name]
+
+    def create_function(self, name, stream=None, log_group=None, execution_time=None, batch_size=100,
+                        parallelization_factor=1, invocation_overhead=0.001, poll_delay=0.2,
+                        memory_size=DEFAULT_MEMORY_SIZE, metrics_marker=CUSTOM_METRICS_MARKER.decode(),
+                        codec='json', codec_options=None, seed=None):
+        # execution_time(rng, size) returns per-message execution times in
+        # seconds at FULL_CPU_MEMORY_SIZE; smaller functions run proportionally slower
+        with self._lock:
+            # A function without a stream only takes configuration calls
+            if stream is not None and stream not in self.streams:
+                raise ValueError(f"Create stream {stream} before its function")
+            self.functions[name] = EmulatedFunction(
+                name,
+                stream,
+                log_group or f"/aws/lambda/{name}",
+                execution_time or constant_time(0.001),
+                batch_size,
+                parallelization_factor,
+                invocation_overhead,
+                poll_delay,
+                memory_size,
+                metrics_marker,
+                get_codec(codec, **(codec_options or {})),
+                seed,
+            )
+            return self.functions[name]
+
+    def clients(self):
+        # The client dict util.harness.run_cell expects
+        return {
+            'kinesis': EmulatedKinesisClient(self),
+            'lambda': EmulatedLambdaClient(self),
+            'logs': EmulatedLogsClient(self),
+        }
+
+    # Kinesis
+
+    def _stream(self, name, operation_name):
+        if name not in self.streams:
+            raise ResourceNotFoundException(f"Stream {name} not found", operation_name)
+        return self.streams[name]
+
+    def put_records(self, stream_name, records):
+        if len(records) > MAX_RECORDS_PER_REQUEST:
+            raise _client_error('ValidationException', f"At most {MAX_RECORDS_PER_REQUEST} records per request", 'PutRecords')
+        # The whole request is validated before any shard takes a record, so a
+        # rejected request changes nothing, as with PutRecords
+        entries = []
+        for record in records:
+            data = record['Data']
+            if isinstance(data, str):
+                data = data.encode('utf-8')
+            entries.append((record['PartitionKey'], bytes(data)))
+        sizes = [len(data) + len(key.encode('utf-8')) for key, data in entries]
+        if any(size > MAX_RECORD_SIZE for size in sizes):
+            raise _client_error('InvalidArgumentException', f"Record exceeds {MAX_RECORD_SIZE} bytes", 'PutRecords')
+        if sum(sizes) > MAX_BYTES_PER_REQUEST:
+            raise _client_error('InvalidArgumentException', f"Request exceeds {MAX_BYTES_PER_REQUEST} bytes", 'PutRecords')
+
+        with self._lock:
+            stream = self._stream(stream_name, 'PutRecords')
+            now = self.clock()
+            results = []
+            failed = 0
+            for (partition_key, data), size in zip(entries, sizes):
+                index = stream.shard_index(partition_key)
+                record_bucket, byte_bucket = stream.buckets[index]
+                if not (record_bucket.take(1, now) and byte_bucket.take(size, now)):
+                    failed += 1
+                    results.append({
+                        'ErrorCode': THROTTLED_ERROR_CODE,
+                        'ErrorMessage': f"Rate exceeded for shard {stream.shard_ids[index]}",
+                    })
+                    continue
+                stream.records[index].append((now, partition_key, data))
+                stream.sequence_number += 1
+                results.append({
+                    'SequenceNumber': str(stream.sequence_number),
+                    'ShardId': stream.shard_ids[index],
+                })
+        return {'FailedRecordCount': failed, 'Records': results}
+
+    def list_shards(self, stream_name):
+        with self._lock:
+            stream = self._stream(stream_name, 'ListShards')
+            return {'Shards': [
+                {
+                    'ShardId': shard_id,
+                    'HashKeyRange': {'StartingHashKey': str(start), 'EndingHashKey': str(end)},
+                    'SequenceNumberRange': {'StartingSequenceNumber': '0'},
+                }
+                for shard_id, start, end in zip(stream.shard_ids, stream.starts, stream.ends)
+            ]}
+
+    # Lambda
+
+    def _function(self, name, operation_name):
+        if name not in self.functions:
+            raise ResourceNotFoundException(f"Function not found: {name}", operation_name)
+        return self.functions[name]
+
+    def put_function_concurrency(self, function_name, concurrency):
+        with self._lock:
+            self._simulate(self.clock())
+            function = self._function(function_name, 'PutFunctionConcurrency')
+            function.reserved_concurrency = concurrency
+            function.set_concurrency(concurrency)
+        return {'ReservedConcurrentExecutions': concurrency}
+
+    def update_function_configuration(self, function_name, memory_size=None):
+        with self._lock:
+            self._simulate(self.clock())
+            function = self._function(function_name, 'UpdateFunctionConfiguration')
+            if memory_size is not None:
+                function.memory_size = memory_size
+        return {'FunctionName': function_name, 'MemorySize': function.memory_size}
+
+    # Event source mapping simulation
+
+    def _decode_messages(self, function, partition_key, data):
+        if is_aggregated(data):
+            payloads = [payload for _, payload in deaggregate_record(data, partition_key)]
+        else:
+            payloads = [data]
+        messages = []
+        for payload in payloads:
+            try:
+                message = function.codec.decode(payload)
+            except function.codec.decode_errors:
+                message = None
+            # Anything but a decoded message dict is not a harness message;
+            # it is processed but not logged
+            messages.append(message if isinstance(message, dict) else {})
+        return messages
+
+    def _next_batch(self, function, stream):
+        # Earliest batch any lane of any shard could start: (start, (shard index, lane))
+        if not function.executors:
+            # Reserved concurrency 0 throttles every invocation
+            return None
+        executor_free = function.executors[0]
+        best = None
+        for index, shard_records in enumerate(stream.records):
+            for lane in range(function.parallelization_factor):
+                position, lane_free = function.lanes.setdefault((index, lane), [0, 0.0])
+                # Skip records of the shard's other lanes
+                while position < len(shard_records) and self._lane_of(function, shard_records[position]) != lane:
+                    position += 1
+                function.lanes[(index, lane)][0] = position
+                if position == len(shard_records):
+                    continue
+                start = max(lane_free, executor_free, shard_records[position][0] + function.poll_delay)
+                if best is None or start < best[0]:
+                    best = (start, (index, lane))
+        return best
+
+    def _lane_of(self, function, record):
+        # Records with the same partition key stay in order on one lane
+        if function.parallelization_factor == 1:
+            return 0
+        return partition_key_hash(record[1]) % function.parallelization_factor
+
+    def _run_batch(self, function, stream, start, key):
+        index, lane = key
+        shard_records = stream.records[index]
+        position = function.lanes[key][0]
+        batch = []
+        while (position < len(shard_records) and len(batch) < function.batch_size
+               and shard_records[position][0] + function.poll_delay <= start):
+            if self._lane_of(function, shard_records[position]) == lane:
+                batch.append(shard_records[position])
+            position += 1
+
+        messages = []
+        for _, partition_key, data in batch:
+            messages.extend(self._decode_messages(function, partition_key, data))
+        cpu_share = min(1.0, function.memory_size / FULL_CPU_MEMORY_SIZE)
+        execution_times = np.asarray(function.execution_time(function.rng, len(messages)), dtype=np.float64) / cpu_share
+
+        # Messages of a batch run one after the other inside the invocation
+        lines = []
+        now = start + function.invocation_overhead
+        for message, execution_time in zip(messages, execution_times.tolist()):
+            end = now + execution_time
+            if 'msg_id' in message:
+                lines.append((end, (
+                    f"{function.metrics_marker} Message ID: {message['msg_id']} "
+                    f"Start Time: {now:.6f} End Time: {end:.6f} "
+                    f"Execution time: {execution_time * 1e6:.2f} microseconds Memory Size: {function.memory_size}"
+                )))
+            now = end
+        duration_ms = (now - start) * 1000
+        lines.append((now, (
+            f"REPORT RequestId: {uuid.uuid4()}\tDuration: {duration_ms:.2f} ms\t"
+            f"Billed Duration: {math.ceil(duration_ms)} ms\tMemory Size: {function.memory_size} MB\t"
+            f"Max Memory Used: {min(function.memory_size, 64)} MB"
+        )))
+        for timestamp, message in lines:
+            self.event_count += 1
+            heapq.heappush(self.pending_logs, (int(timestamp * 1000), self.event_count, function.log_group, message))
+
+        function.lanes[key] = [position, now]
+        heapq.heapreplace(function.executors, now)
+        function.invocations += 1
+
+    def _simulate(self, until):
+        # Runs every batch that starts by `until` and publishes the log lines
+        # written by then
+        for function in self.functions.values():
+            if function.stream is None:
+                continue
+            stream = self.streams[function.stream]
+            while True:
+                best = self._next_batch(function, stream)
+                if best is None or best[0] > until:
+                    break
+                self._run_batch(function, stream, *best)
+        until_ms = int(until * 1000)
+        while self.pending_logs and self.pending_logs[0][0] <= until_ms:
+            timestamp, event_id, log_group, message = heapq.heappop(self.pending_logs)
+            self.log_groups.setdefault(log_group, []).append((timestamp, str(event_id), message))
+
+    # CloudWatch Logs
+
+    def delete_log_group(self, log_group_name):
+        with self._lock:
+            self._simulate(self.clock())
+            if log_group_name not in self.log_groups:
+                raise ResourceNotFoundException("The specified log group does not exist.", 'DeleteLogGroup')
+            del self.log_groups[log_group_name]
+            # Lines of running batches recreate the group, as on AWS
+
+    def filter_log_events(self, log_group_name, start_time=None, end_time=None, filter_pattern=None,
+                          next_token=None, limit=MAX_EVENTS_PER_PAGE):
+        with self._lock:
+            self._simulate(self.clock())
+            if log_group_name not in self.log_groups:
+                raise ResourceNotFoundException("The specified log group does not exist.", 'FilterLogEvents')
+            events = self.log_groups[log_group_name]
+            terms = shlex.split(filter_pattern) if filter_pattern else []
+            position = int(next_token) if next_token else 0
+            page = []
+            while position < len(events) and len(page) < limit:
+                timestamp, event_id, message = events[position]
+                position += 1
+                if start_time is not None and timestamp < start_time:
+                    continue
+                if end_time is not None and timestamp > end_time:
+                    continue
+                if all(term in message for term in terms):
+                    page.append({
+                        'logStreamName': log_group_name.rsplit('/', 1)[-1],
+                        'timestamp': timestamp,
+                        'message': message,
+                        'ingestionTime': timestamp,
+                        'eventId': event_id,
+                    })
+        response = {'events': page, 'searchedLogStreams': []}
+        if position < len(events):
+            response['nextToken'] = str(position)
+        return response
+
+class EmulatedKinesisClient:
+    exceptions = EmulatorExceptions
+
+    def __init__(self, emulator):
+        self.emulator = emulator
+
+    def put_records(self, StreamName, Records, **kwargs):
+        return self.emulator.put_records(StreamName, Records)
+
+    def list_shards(self, StreamName=None, NextToken=None, **kwargs):
+        # Everything fits on one page, so NextToken is never returned
+        return self.emulator.list_shards(StreamName)
+
+class EmulatedLambdaClient:
+    exceptions = EmulatorExceptions
+
+    def __init__(self, emulator):
+        self.emulator = emulator
+
+    def put_function_concurrency(self, FunctionName, ReservedConcurrentExecutions):
+        return self.emulator.put_function_concurrency(FunctionName, ReservedConcurrentExecutions)
+
+    def update_function_configuration(self, FunctionName, MemorySize=None, **kwargs):
+        return self.emulator.update_function_configuration(FunctionName, MemorySize)
+
+class EmulatedPaginator:
+    def __init__(self, method):
+        self.method = method
+
+    def paginate(self, **kwargs):
+        while True:
+            page = self.method(**kwargs)
+            yield page
+            if 'nextToken' not in page:
+                return
+            kwargs['nextToken'] = page['nextToken']
+
+class EmulatedLogsClient:
+    exceptions = EmulatorExceptions
+
+    def __init__(self, emulator):
+        self.emulator = emulator
+
+    def delete_log_group(self, logGroupName):
+        return self.emulator.delete_log_group(logGroupName)
+
+    def filter_log_events(self, logGroupName, startTime=None, endTime=None, filterPattern=None,
+                          nextToken=None, limit=MAX_EVENTS_PER_PAGE, **kwargs):
+        return self.emulator.filter_log_events(logGroupName, startTime, endTime, filterPattern, nextToken, limit)
+
+    def get_paginator(self, operation_name):
+        if operation_name != 'filter_log_events':
+            raise ValueError(f"The emulator only paginates filter_log_events, not {operation_name}")
+        return EmulatedPaginator(self.filter_log_events)
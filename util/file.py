@@ -0,0 +1,217 @@
+import hashlib
+import json
+import mmap
+import os
+import re
+import struct
+from array import array
+
+import numpy as np
+
+from util.storage import MappedFile
+
+# Sentence cache layout (little endian):
+#   magic (8 bytes) | sentence count (uint64) | word count (uint64)
+#   sentence offsets (count + 1 uint64) | sentence text (ASCII, no separators)
+# One file per source file content and sentence length, so later runs map the
+# index instead of tokenizing the text again.
+SENTENCE_CACHE_MAGIC = b'EXPSNT01'
+SENTENCE_HEADER = struct.Struct('<8sQQ')
+# Part of the cache file name; bumped whenever the tokenizer changes
+SENTENCE_CACHE_VERSION = 2
+DEFAULT_CACHE_DIR = 'cache'
+HASH_MEMO_FILE = 'hashes.json'
+# Bytes tokenized at a time; memory use does not depend on the file size
+CHUNK_SIZE = 64 * 1024 * 1024
+# The original cleaning, on str: drop everything but ASCII letters and
+# (Unicode) whitespace
+NON_ALPHA_PATTERN = re.compile(r'[^a-zA-Z\s]')
+# The same on pure ASCII bytes, where \x1c-\x1f are whitespace to str but
+# not to bytes
+ASCII_NON_ALPHA_PATTERN = re.compile(rb'[^a-zA-Z\s\x1c-\x1f]')
+ASCII_SEPARATORS = bytes.maketrans(b'\x1c\x1d\x1e\x1f', b'    ')
+WHITESPACE_PATTERN = re.compile(rb'\s')
+WHITESPACE = b' \t\n\r\x0b\x0c'
+
+def clean_words(data):
+    # The cleaned, lowercase words (bytes) of a chunk of UTF-8 text, split as
+    # the original str tokenizer splits them. Pure ASCII chunks stay bytes;
+    # others are decoded, so non-ASCII whitespace (e.g. NBSP) separates words.
+    if data.isascii():
+        return ASCII_NON_ALPHA_PATTERN.sub(b'', data).translate(ASCII_SEPARATORS).lower().split()
+    text = NON_ALPHA_PATTERN.sub('', data.decode('utf-8')).lower()
+    return ' '.join(text.split()).encode('ascii').split()
+
+def iter_word_chunks(file_path, chunk_size=CHUNK_SIZE):
+    # Yields lists of cleaned, lowercase words (bytes), one list per chunk of
+    # the memory-mapped file. Chunks end at whitespace so no word is split.
+    with open(file_path, 'rb') as file:
+        size = os.fstat(file.fileno()).st_size
+        if size == 0:
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            pos = 0
+            while pos < size:
+                end = min(pos + chunk_size, size)
+                if end < size:
+                    cut = max(data.rfind(bytes([char]), pos, end) for char in WHITESPACE)
+                    if cut > pos:
+                        end = cut + 1
+                    else:
+                        # One word longer than a chunk
+                        match = WHITESPACE_PATTERN.search(data, end)
+                        end = match.end() if match else size
+                yield clean_words(data[pos:end])
+                pos = end
+
+def file_hash(file_path, cache_dir=DEFAULT_CACHE_DIR):
+    # SHA-256 of the file content. Hashes are remembered per (path, size,
+    # mtime), so an unchanged file is only read once.
+    stat = os.stat(file_path)
+    key = os.path.abspath(file_path)
+    memo_path = os.path.join(cache_dir, HASH_MEMO_FILE)
+    memo = {}
+    if os.path.exists(memo_path):
+        with open(memo_path, 'r') as memo_file:
+            memo = json.load(memo_file)
+    entry = memo.get(key)
+    if entry is not None and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+        return entry['sha256']
+
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(CHUNK_SIZE), b''):
+            digest.update(block)
+    memo[key] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': digest.hexdigest()}
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f"{memo_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as memo_file:
+        json.dump(memo, memo_file)
+    os.replace(tmp_path, memo_path)
+    return memo[key]['sha256']
+
+def build_sentence_cache(file_path, words_per_sentence, cache_path, chunk_size=CHUNK_SIZE):
+    offsets = array('Q', [0])
+    text_size = 0
+    word_count = 0
+    # Words of an unfinished sentence carried into the next chunk
+    pending = []
+
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(tmp_path + '.text', 'wb') as text_file:
+        for words in iter_word_chunks(file_path, chunk_size):
+            word_count += len(words)
+            if pending:
+                words = pending + words
+            full = len(words) - len(words) % words_per_sentence
+            for i in range(0, full, words_per_sentence):
+                sentence = b' '.join(words[i:i + words_per_sentence])
+                text_file.write(sentence)
+                text_size += len(sentence)
+                offsets.append(text_size)
+            pending = words[full:]
+        if pending:
+            # The last sentence may be shorter
+            sentence = b' '.join(pending)
+            text_file.write(sentence)
+            text_size += len(sentence)
+            offsets.append(text_size)
+
+    count = len(offsets) - 1
+    with open(tmp_path, 'wb') as file:
+        file.write(SENTENCE_HEADER.pack(SENTENCE_CACHE_MAGIC, count, word_count))
+        file.write(offsets.tobytes())
+        with open(tmp_path + '.text', 'rb') as text_file:
+            for block in iter(lambda: text_file.read(CHUNK_SIZE), b''):
+                file.write(block)
+    os.remove(tmp_path + '.text')
+    os.replace(tmp_path, cache_path)
+
+def read_word_ids(file_path, chunk_size=CHUNK_SIZE):
+    # Returns (word_ids, vocabulary): the cleaned words of the file as one
+    # int32 array of ids into the vocabulary list, in text order
+    if not os.path.exists(file_path):
+        print(f"File {file_path} not found.")
+        return np.empty(0, dtype=np.int32), []
+    vocabulary = {}
+    chunks = []
+    for words in iter_word_chunks(file_path, chunk_size):
+        # Python-level work is per distinct word; the per-word lookup runs in C
+        chunk_vocabulary = dict.fromkeys(words)
+        for word in chunk_vocabulary:
+            chunk_vocabulary[word] = vocabulary.setdefault(word, len(vocabulary))
+        chunks.append(np.fromiter(map(chunk_vocabulary.__getitem__, words), dtype=np.int32, count=len(words)))
+    word_ids = np.concatenate(chunks) if chunks else np.empty(0, dtype=np.int32)
+    return word_ids, [word.decode('ascii') for word in vocabulary]
+
+class SentenceIndex(MappedFile):
+    # Read-only view of a sentence cache. Indexing returns records in the
+    # shape generate_input_data expects ([sentence] per record, so an input
+    # map of {"sentence": 0}); sentence() and sentences() return plain strings.
+    def __init__(self, cache_path):
+        self.cache_path = cache_path
+        super().__init__(cache_path, SENTENCE_CACHE_MAGIC, SENTENCE_HEADER, 'sentence cache')
+        self.word_count = self.header[2]
+        self.offsets = np.frombuffer(self._mmap, dtype='<u8', count=self.count + 1, offset=SENTENCE_HEADER.size)
+        self.text_base = SENTENCE_HEADER.size + (self.count + 1) * 8
+
+    def _init_args(self):
+        return (self.cache_path,)
+
+    def sentences(self, start=0, stop=None):
+        start, stop, _ = slice(start, stop).indices(self.count)
+        if start >= stop:
+            return []
+        offsets = self.offsets[start:stop + 1].tolist()
+        base = self.text_base + offsets[0]
+        text = self._mmap[base:self.text_base + offsets[-1]].decode('ascii')
+        first = offsets[0]
+        return [text[offsets[i] - first:offsets[i + 1] - first] for i in range(stop - start)]
+
+    def sentence(self, index):
+        return self.sentences(index, index + 1)[0]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            if index.step not in (None, 1):
+                raise ValueError("SentenceIndex slices must be contiguous")
+            return [[sentence] for sentence in self.sentences(index.start, index.stop)]
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError("sentence index out of range")
+        return [self.sentence(index)]
+
+    def __iter__(self):
+        batch = 65536
+        for start in range(0, self.count, batch):
+            for sentence in self.sentences(start, start + batch):
+                yield [sentence]
+
+    def close(self):
+        self.offsets = None
+        super().close()
+
+def load_sentences(file_path, words_per_sentence=10, cache_dir=DEFAULT_CACHE_DIR):
+    # Returns a SentenceIndex over the cleaned words of file_path grouped into
+    # sentences of words_per_sentence words, tokenizing the file only if no
+    # cache exists for its content and this sentence length
+    if not os.path.exists(file_path):
+        print(f"File {file_path} not found.")
+        return []
+    cache_path = os.path.join(
+        cache_dir,
+        f"{os.path.basename(file_path)}.{file_hash(file_path, cache_dir)[:16]}.{words_per_sentence}"
+        f".v{SENTENCE_CACHE_VERSION}.sentences"
+    )
+    if not os.path.exists(cache_path):
+        os.makedirs(cache_dir, exist_ok=True)
+        build_sentence_cache(file_path, words_per_sentence, cache_path)
+    sentences = SentenceIndex(cache_path)
+    print(f"Total words extracted: {sentences.word_count}")
+    print(f"Total sentences created: {len(sentences)}")
+    return sentences
+
+def read_sentences_from_file(file_path, words_per_sentence=10):
+    # Records of one sentence each: [[sentence], ...] (a SentenceIndex)
+    return load_sentences(file_path, words_per_sentence)
@@ -0,0 +1,460 @@
+from util.thread import AtomicInteger, batch_producer, guarded_consumer, arrival_producer, replay_producer, check_schedule
+from util.cloudwatch import delete_log_group, LogFetcher, parse_log_arrays, MessageStats, CUSTOM_METRICS_MARKER
+from util.results import save_run
+from util.sketch import LatencyHistogram
+from util.latency import SendLog, latency_breakdown
+from util.kinesis import list_shard_ranges, ShardRateLimiter, PutStats
+from util.codec import get_codec, JSON_CODECS
+from util.process import run_producer_processes
+from util.corpus import open_or_build_corpus, Corpus
+from util.file import load_sentences, file_hash, DEFAULT_CACHE_DIR
+from util.trace import load_trace, replay_order, TraceRecords
+from util.completion import CompletionTracker, AdaptivePoller
+from util.arrival import describe_arrival
+
+import boto3
+import os
+import struct
+import time
+import threading
+from queue import Queue
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# Shared steps of every experiment: configure the functions, produce at a
+# target rate, poll the function logs until all messages are accounted for,
+# and summarise / store the run. An experiment is described by a spec dict
+# (see util.matrix) and one sweep cell, e.g. {'input_rate': 300, 'replica': 50}.
+
+SPEC_DEFAULTS = {
+    'region': 'ap-southeast-2',
+    'functions': [],
+    'dataset': None,
+    'corpus': None,
+    'input_map': None,
+    'message_fields': [],
+    'partition_by': None,
+    'metrics_marker': CUSTOM_METRICS_MARKER.decode(),
+    # CloudWatch filter pattern; None also fetches the REPORT lines
+    'filter_pattern': None,
+    'input_rate': 300,
+    'replica': None,
+    'memory_size': None,
+    'batch_size': 300,
+    'duration': 10,
+    'num_threads': 10,
+    'num_processes': 1,
+    'aggregate': False,
+    # Arrival schedule (see util.arrival) instead of evenly spaced batches,
+    # e.g. {"type": "step", "rates": [300, 900], "step_time": 30}
+    'arrival': None,
+    # Replay a trace dataset at its event-time gaps, this many times faster,
+    # instead of at input_rate
+    'replay_speedup': None,
+    'payload_codec': 'json',
+    'codec_options': {},
+    'settle_time': 2,
+    # Log polling backs off from min_poll_interval to poll_interval seconds
+    'min_poll_interval': 1,
+    'poll_interval': 10,
+    'idle_timeout': 60,
+    'logs_dir': 'logs',
+    'results_dir': 'results',
+}
+
+# Dataset loaders by spec 'type'; each returns a sequence of records
+DATASETS = {
+    # Tokenized once into a cache keyed by file content and sentence length
+    'sentences': lambda dataset: load_sentences(dataset['path'], dataset.get('words_per_sentence', 10),
+                                                dataset.get('cache_dir', DEFAULT_CACHE_DIR)),
+    # Columns of the sensor / machine usage traces, parsed once into a
+    # memory-mapped cache; see util.trace.TRACES for the column order. Fields
+    # are sent as the trace's strings unless the dataset sets "numeric": true
+    'sensor': lambda dataset: load_trace(dataset['path'], 'sensor', dataset.get('cache_dir', DEFAULT_CACHE_DIR),
+                                       dataset.get('numeric', False)),
+    'machine': lambda dataset: load_trace(dataset['path'], 'machine', dataset.get('cache_dir', DEFAULT_CACHE_DIR),
+                                         dataset.get('numeric', False)),
+}
+
+def make_clients(region_name):
+    return {
+        'kinesis': boto3.client('kinesis', region_name=region_name),
+        'logs': boto3.client('logs', region_name=region_name),
+        'lambda': boto3.client('lambda', region_name=region_name),
+    }
+
+def load_dataset(spec):
+    dataset = spec['dataset']
+    if dataset is None:
+        return None
+    if dataset['type'] not in DATASETS:
+        raise ValueError(f"Unknown dataset type {dataset['type']}, choose from {sorted(DATASETS)}")
+    load_records = lambda: DATASETS[dataset['type']](dataset)
+    if spec['corpus'] is not None:
+        # Pre-encoded payloads, built on first use for this dataset content,
+        # input map and partition key
+        cache_dir = dataset.get('cache_dir', DEFAULT_CACHE_DIR)
+        source = {
+            **{key: value for key, value in dataset.items() if key != 'cache_dir'},
+            'file_hash': file_hash(dataset['path'], cache_dir) if os.path.exists(dataset['path']) else None,
+        }
+        return open_or_build_corpus(spec['corpus'], load_records, spec['input_map'], spec['partition_by'], source)
+    return load_records()
+
+def configure_functions(lambda_client, function_names, replica=None, memory_size=None):
+    # replica is one reserved concurrency for every function, or a dict of
+    # them by function name (functions it leaves out are not changed)
+    for function_name in function_names:
+        function_replica = replica.get(function_name) if isinstance(replica, dict) else replica
+        if function_replica is not None:
+            response = lambda_client.put_function_concurrency(
+                FunctionName=function_name,
+                ReservedConcurrentExecutions=function_replica
+            )
+            print(f"Reserved concurrency of {function_name} set:", response, "\n")
+        if memory_size is not None:
+            lambda_client.update_function_configuration(
+                FunctionName=function_name,
+                MemorySize=memory_size
+            )
+            print(f"Memory size of {function_name} set to {memory_size} MB")
+
+def check_codec(codec, records, input_map, extra_fields=None):
+    # Encodes one message shaped like the producers' before any thread starts,
+    # so a codec that cannot carry the cell's message fields (e.g. a struct
+    # layout without them) fails the cell instead of every consumer thread
+    if isinstance(records, Corpus):
+        return
+    fields = {}
+    if input_map and len(records):
+        record = records[0]
+        fields = {key: record[index] for key, index in input_map.items()}
+    message = {'msg_id': 1, **fields, 'intended_time': 0.0, **(extra_fields or {}), 'send_time': 0.0}
+    try:
+        codec.encode(message)
+    except (ValueError, TypeError, struct.error) as e:
+        raise ValueError(f"payload_codec {codec.name} cannot encode the messages of this cell "
+                         f"(fields {sorted(message)}): {e}") from e
+
+def produce(clients, settings, records, shard_ranges, extra_fields=None):
+    # Returns (total_records, producer_stats, put_summary, send_log)
+    stream_name = settings['stream']
+    replay = settings['replay_speedup'] is not None
+    if replay and not isinstance(records, TraceRecords):
+        raise ValueError("Replay needs a trace dataset ('sensor' or 'machine') without a corpus")
+    if settings['corpus'] is not None and settings['payload_codec'] not in JSON_CODECS:
+        # Corpus payloads are pre-encoded JSON and are sent as they are
+        raise ValueError(f"A corpus is pre-encoded as JSON; use payload_codec {' or '.join(JSON_CODECS)}, "
+                         f"not {settings['payload_codec']}")
+    codec = get_codec(settings['payload_codec'], **settings['codec_options'])
+    check_codec(codec, records, settings['input_map'], extra_fields)
+    scheduled = replay or settings['arrival'] is not None
+    if replay and settings['arrival'] is not None:
+        raise ValueError("Set either replay_speedup or arrival, not both")
+    if scheduled and settings['num_processes'] > 1:
+        raise ValueError("Replay and arrival schedules run in one producer process; use num_threads to add consumers")
+    if settings['num_processes'] > 1:
+        return run_producer_processes(
+            records,
+            settings['batch_size'],
+            settings['input_map'],
+            stream_name,
+            settings['duration'],
+            settings['input_rate'],
+            settings['num_processes'],
+            settings['num_threads'],
+            {
+                'region_name': settings['region'],
+                'shard_ranges': shard_ranges,
+                'partition_by': settings['partition_by'],
+                'aggregate': settings['aggregate'],
+                'codec': settings['payload_codec'],
+                'codec_options': settings['codec_options'],
+                'extra_fields': extra_fields,
+            },
+        )
+
+    # Per-shard token buckets shared by all consumer threads
+    rate_limiter = ShardRateLimiter()
+    put_stats = PutStats()
+    # Intended and actual send time of every msg_id, for end-to-end latency
+    send_log = SendLog()
+    atomic_count = AtomicInteger(1)
+    batch_queue = Queue()
+    end_time = time.time() + settings['duration']
+    producer_stats = {}
+    consumer_errors = []
+
+    input_threads = []
+    with ThreadPoolExecutor() as executor:
+        if replay:
+            # msg_id i is the i-th record in event-time order
+            replay_records, event_times = replay_order(records)
+            future = executor.submit(
+                replay_producer,
+                replay_records,
+                event_times,
+                settings['replay_speedup'],
+                settings['batch_size'],
+                settings['input_map'],
+                batch_queue,
+                settings['duration'],
+                settings['num_threads'],
+                producer_stats,
+            )
+        elif settings['arrival'] is not None:
+            future = executor.submit(
+                arrival_producer,
+                records,
+                settings['arrival'],
+                settings['input_rate'],
+                settings['batch_size'],
+                settings['input_map'],
+                batch_queue,
+                settings['duration'],
+                settings['num_threads'],
+                producer_stats,
+            )
+        else:
+            future = executor.submit(
+                batch_producer,
+                records,
+                atomic_count,
+                settings['batch_size'],
+                settings['input_map'],
+                batch_queue,
+                end_time,
+                settings['input_rate'],
+                settings['num_threads'],
+                producer_stats,
+            )
+
+        for _ in range(settings['num_threads']):
+            thread = threading.Thread(
+                target=guarded_consumer,
+                args=(
+                    consumer_errors,
+                    clients['kinesis'],
+                    batch_queue,
+                    stream_name,
+                    settings['partition_by'],
+                    shard_ranges,
+                    settings['aggregate'],
+                    rate_limiter,
+                    put_stats,
+                    codec,
+                    send_log,
+                    extra_fields,
+                )
+            )
+            input_threads.append(thread)
+            thread.start()
+
+    total_records = future.result()
+    for thread in input_threads:
+        thread.join()
+    producer_stats['consumer_errors'] = consumer_errors
+    if scheduled:
+        check_schedule(producer_stats, send_log.to_arrays())
+    return total_records, producer_stats, put_stats.report(), send_log
+
+def select_memory_size(metrics, memory_size):
+    # Drops metrics logged under another memory size (lines without a
+    # Memory Size field are kept)
+    if memory_size is None:
+        return metrics
+    return metrics[(metrics['memory_size'] == 0) | (metrics['memory_size'] == memory_size)]
+
+def collect_logs(fetcher, tracker, msg_stats, send_log, marker, memory_size=None, min_poll_interval=1, poll_interval=10,
+                 idle_timeout=60):
+    # Polls the log group until every sent message has been seen, or until no
+    # new message has shown up for idle_timeout seconds. The poll interval
+    # shrinks while messages are arriving and backs off while they are not.
+    # Message timings are merged into msg_stats (a MessageStats) and the
+    # histograms follow the merged latencies as lines arrive; returns (REPORT
+    # lines as an array, histograms).
+    histograms = {
+        'exec_time': LatencyHistogram(),
+        'end_to_end': LatencyHistogram(),
+        'queueing': LatencyHistogram(),
+        'report_duration': LatencyHistogram(),
+    }
+    report_chunks = []
+    poller = AdaptivePoller(min_poll_interval, poll_interval, idle_timeout)
+    while True:
+        poller.wait()
+        events = fetcher.poll()
+        metrics, reports = parse_log_arrays((event['message'] for event in events), marker)
+        metrics = select_memory_size(metrics, memory_size)
+        if memory_size is not None:
+            reports = reports[reports['memory_size'] == memory_size]
+        # Take back the latencies of msg_ids whose merged timings changed and
+        # record the new ones, so the histograms match msg_stats
+        previous, merged = msg_stats.update(metrics)
+        for rows, apply in ((previous, LatencyHistogram.remove), (merged, LatencyHistogram.record)):
+            latencies = latency_breakdown(rows['msg_id'], rows['start'], rows['end'], send_log)
+            apply(histograms['exec_time'], rows['exec_time'])
+            apply(histograms['end_to_end'], latencies['end_to_end'] * 1000)
+            apply(histograms['queueing'], latencies['queueing'] * 1000)
+        histograms['report_duration'].record(reports['duration'])
+        report_chunks.append(reports)
+        poller.update(tracker.add(metrics['msg_id']))
+
+        print(f"{tracker.num_received} of {tracker.num_expected} messages seen, next poll in {poller.interval:.1f} s")
+
+        if tracker.complete():
+            break
+        if poller.stalled():
+            print(f"No new messages for {idle_timeout} seconds.")
+            break
+    tracker.report()
+    return np.concatenate(report_chunks), histograms
+
+def analyze(msg_stats, reports, send_log, histograms):
+    # Returns (arrays, summary) for one run from the collect_logs results
+    msg_arrays = msg_stats.to_arrays()
+    latencies = latency_breakdown(msg_arrays['msg_id'], msg_arrays['start'], msg_arrays['end'], send_log)
+    if histograms['exec_time'].count == 0:
+        print("No execution times found.")
+
+    summary = {'unique_message_id_count': len(msg_arrays['msg_id'])}
+    if len(msg_arrays['msg_id']):
+        summary['min_start_time'] = float(msg_arrays['start'].min())
+        summary['max_start_time'] = float(msg_arrays['start'].max())
+        if not np.isnan(msg_arrays['end']).all():
+            summary['duration'] = float(np.nanmax(msg_arrays['end'])) - summary['min_start_time']
+    # Slope of end-to-end latency over intended send time (seconds per
+    # second): near 0 while the backlog stays bounded, about
+    # 1 - capacity / input rate while it grows
+    timed = ~np.isnan(latencies['end_to_end']) & ~np.isnan(latencies['intended_time'])
+    if timed.sum() >= 2 and np.ptp(latencies['intended_time'][timed]) > 0:
+        run_time = latencies['intended_time'][timed] - np.min(latencies['intended_time'][timed])
+        summary['latency_growth'] = float(np.polyfit(run_time, latencies['end_to_end'][timed], 1)[0])
+    for name, unit in [('exec_time', 'execution_time'), ('end_to_end', 'end_to_end_ms'),
+                       ('queueing', 'queueing_ms'), ('report_duration', 'report_duration_ms')]:
+        if histograms[name].count:
+            for key, value in histograms[name].summary().items():
+                if key != 'count':
+                    summary[f'{key}_{unit}'] = value
+
+    arrays = {
+        **msg_arrays,
+        'intended_time': latencies['intended_time'],
+        'send_time': latencies['send_time'],
+        'admitted_time': latencies['admitted_time'],
+        'report_duration': reports['duration'],
+    }
+    for name, histogram in histograms.items():
+        arrays.update(histogram.to_arrays(f'{name}_hist'))
+    return arrays, summary
+
+def write_report(output_file, config, summary):
+    lines = [f"{key}: {value}" for key, value in config.items()]
+    for key in ['total_records', 'achieved_rate', 'max_schedule_lag_ms', 'achieved_speedup', 'kept_up', 'lost_records', 'retried_records', 'consumer_errors',
+                'unique_message_id_count', 'missing_records', 'duplicate_deliveries', 'missing_ranges', 'duration', 'latency_growth']:
+        if key in summary:
+            lines.append(f"{key}: {summary[key]}")
+    for label, unit, scale in [('Execution Time', 'execution_time', 'microseconds'),
+                               ('End-to-end Latency', 'end_to_end_ms', 'ms'),
+                               ('Queueing Latency', 'queueing_ms', 'ms'),
+                               ('Report Duration', 'report_duration_ms', 'ms')]:
+        if f'p50_{unit}' not in summary:
+            continue
+        line = ' / '.join(f"{summary[f'{name}_{unit}']:.2f}" for name in ['mean', 'p50', 'p90', 'p99', 'p999', 'max'])
+        lines.append(f"{label} mean/p50/p90/p99/p99.9/max: {line} {scale}")
+
+    for line in lines:
+        print(line)
+    os.makedirs(os.path.dirname(output_file) or '.', exist_ok=True)
+    with open(output_file, "a") as out_file:
+        out_file.write('\n'.join(lines) + '\n\n')
+
+# Cells running in parallel lanes share the output file and run index
+_output_lock = threading.Lock()
+
+def run_config(settings):
+    # The config a run is stored under in the run store index
+    return {
+        'function_name': settings['stream'],
+        'functions': settings['functions'],
+        'input_rate': settings['input_rate'],
+        'replica': settings['replica'],
+        'memory_size': settings['memory_size'],
+        'batch_size': settings['batch_size'],
+        'duration': settings['duration'],
+        'num_threads': settings['num_threads'],
+        'num_processes': settings['num_processes'],
+        'payload_codec': settings['payload_codec'],
+        'aggregate': settings['aggregate'],
+        'arrival': describe_arrival(settings['arrival']),
+        'replay_speedup': settings['replay_speedup'],
+    }
+
+def run_cell(spec, cell, clients=None, lane=None, budget=None):
+    # Runs one sweep cell and returns its run store index entry. lane is the
+    # spec lane (stream, functions, log group) the cell runs on, and budget a
+    # util.matrix.HarnessBudget shared with the cells running alongside it.
+    settings = {**SPEC_DEFAULTS, **spec, **(lane or {}), **cell}
+    name = settings['name']
+    if clients is None:
+        clients = make_clients(settings['region'])
+
+    # Convert start time to milliseconds to match cloudwatch log
+    log_start_time_ms = int(time.time() * 1000)
+    delete_log_group(clients['logs'], settings['log_group'])
+    configure_functions(clients['lambda'], settings['functions'], settings['replica'], settings['memory_size'])
+    time.sleep(settings['settle_time'])
+
+    # Shard map used to split each producer batch into per-shard requests
+    shard_ranges = list_shard_ranges(clients['kinesis'], settings['stream'])
+    records = load_dataset(settings)
+    extra_fields = {field: settings[field] for field in settings['message_fields']}
+    if budget is not None:
+        with budget.reserve(settings['input_rate']):
+            total_records, producer_stats, put_summary, send_log = produce(clients, settings, records, shard_ranges, extra_fields)
+    else:
+        total_records, producer_stats, put_summary, send_log = produce(clients, settings, records, shard_ranges, extra_fields)
+
+    print(f"start fecthing logs")
+    marker = settings['metrics_marker'].encode()
+    # Only new events are fetched and parsed on each poll
+    fetcher = LogFetcher(
+        clients['logs'],
+        settings['log_group'],
+        log_start_time_ms,
+        # One segment per log group, so parallel lanes do not share a file
+        os.path.join(settings['logs_dir'], f"{name}_{os.path.basename(settings['log_group'])}_log.txt"),
+        settings['filter_pattern'],
+    )
+    # Every msg_id the producers handed to the consumers is expected in the
+    # logs, including those a failed consumer never sent
+    tracker = CompletionTracker(np.concatenate(
+        [np.arange(first, stop) for first, stop in producer_stats['msg_id_ranges']] or [np.empty(0, dtype=np.int64)]
+    ))
+    msg_stats = MessageStats(send_log.max_msg_id + 1)
+    reports, histograms = collect_logs(fetcher, tracker, msg_stats, send_log, marker, settings['memory_size'],
+                                       settings['min_poll_interval'], settings['poll_interval'],
+                                       settings['idle_timeout'])
+    arrays, summary = analyze(msg_stats, reports, send_log, histograms)
+
+    summary.update({
+        'total_records': total_records,
+        'achieved_rate': producer_stats.get('achieved_rate'),
+        'max_schedule_lag_ms': producer_stats.get('max_lag', 0) * 1000,
+        'lost_records': put_summary['lost'],
+        'retried_records': put_summary['retried'],
+        'missing_records': tracker.summary()['missing'],
+        'duplicate_deliveries': tracker.summary()['duplicate_deliveries'],
+        'missing_ranges': tracker.missing_ranges(20),
+        'consumer_errors': producer_stats['consumer_errors'],
+    })
+    if 'kept_up' in producer_stats:
+        summary['kept_up'] = producer_stats['kept_up']
+    if settings['replay_speedup'] is not None:
+        summary['achieved_speedup'] = producer_stats['achieved_speedup']
+    config = run_config(settings)
+    with _output_lock:
+        write_report(os.path.join(settings['results_dir'], f"{name}_output.txt"), config, summary)
+        # Keep the per-message timings so the run can be re-analysed without AWS
+        return save_run(name, arrays, config, summary, settings['results_dir'])
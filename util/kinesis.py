@@ -1,33 +1,253 @@
 import boto3
 import time
+import hashlib
+import bisect
+import random
+import threading
 
-def put_to_stream_batch(kinesis_client, stream_name, records, max_retries=5):
+# PutRecords service limits
+MAX_RECORDS_PER_REQUEST = 500
+MAX_BYTES_PER_REQUEST = 5 * 1024 * 1024
+# Data blob plus partition key
+MAX_RECORD_SIZE = 1024 * 1024
+# Per-shard write limits
+SHARD_RECORDS_PER_SECOND = 1000
+SHARD_BYTES_PER_SECOND = 1024 * 1024
+THROTTLED_ERROR_CODE = 'ProvisionedThroughputExceededException'
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount):
+        # Take the tokens now and sleep off any debt, so requests larger than
+        # the bucket capacity are still admitted at the sustained rate
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+class ShardRateLimiter:
+    def __init__(self, records_per_second=SHARD_RECORDS_PER_SECOND, bytes_per_second=SHARD_BYTES_PER_SECOND):
+        self.records_per_second = records_per_second
+        self.bytes_per_second = bytes_per_second
+        self.buckets = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, shard_id, num_records, num_bytes):
+        with self._lock:
+            if shard_id not in self.buckets:
+                self.buckets[shard_id] = (
+                    TokenBucket(self.records_per_second),
+                    TokenBucket(self.bytes_per_second)
+                )
+            record_bucket, byte_bucket = self.buckets[shard_id]
+        return record_bucket.acquire(num_records) + byte_bucket.acquire(num_bytes)
+
+class PutStats:
+    def __init__(self):
+        self.sent = 0
+        self.retried = 0
+        self.throttled = 0
+        self.errors = 0
+        self.lost = 0
+        self.lost_by_shard = {}
+        self._lock = threading.Lock()
+
+    def record(self, shard_id=None, sent=0, retried=0, throttled=0, errors=0, lost=0):
+        with self._lock:
+            self.sent += sent
+            self.retried += retried
+            self.throttled += throttled
+            self.errors += errors
+            self.lost += lost
+            if lost:
+                self.lost_by_shard[shard_id] = self.lost_by_shard.get(shard_id, 0) + lost
+
+    def summary(self):
+        with self._lock:
+            return {
+                'sent': self.sent,
+                'retried': self.retried,
+                'throttled': self.throttled,
+                'errors': self.errors,
+                'lost': self.lost,
+                'lost_by_shard': dict(self.lost_by_shard)
+            }
+
+    def report(self):
+        summary = self.summary()
+        print(f"Records sent: {summary['sent']}, retried: {summary['retried']}, "
+              f"throttled: {summary['throttled']}, lost: {summary['lost']}")
+        for shard_id, lost in summary['lost_by_shard'].items():
+            print(f"Lost {lost} records on shard {shard_id}")
+        return summary
+
+def record_size(record):
+    data = record['Data']
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    return len(data) + len(record['PartitionKey'].encode('utf-8'))
+
+def partition_key_hash(partition_key):
+    # Kinesis maps a partition key to a shard with the 128-bit MD5 of the key
+    return int(hashlib.md5(partition_key.encode('utf-8')).hexdigest(), 16)
+
+def list_shard_ranges(kinesis_client, stream_name):
+    # Returns the hash key ranges of the open shards, sorted by starting hash key
+    shard_ranges = []
+    kwargs = {'StreamName': stream_name}
+    while True:
+        response = kinesis_client.list_shards(**kwargs)
+        for shard in response['Shards']:
+            # Closed shards (after a resharding) have an ending sequence number
+            if 'EndingSequenceNumber' in shard['SequenceNumberRange']:
+                continue
+            hash_range = shard['HashKeyRange']
+            shard_ranges.append((
+                int(hash_range['StartingHashKey']),
+                int(hash_range['EndingHashKey']),
+                shard['ShardId']
+            ))
+        next_token = response.get('NextToken')
+        if not next_token:
+            break
+        kwargs = {'NextToken': next_token}
+
+    shard_ranges.sort()
+    print(f"Stream {stream_name} has {len(shard_ranges)} open shards")
+    return shard_ranges
+
+def group_by_shard(records, shard_ranges=None):
+    # Returns {shard_id: [records]}; everything lands under None without a shard map
+    groups = {}
+    starts = [shard_range[0] for shard_range in shard_ranges] if shard_ranges else None
+    for record in records:
+        if starts is None:
+            shard_id = None
+        else:
+            index = bisect.bisect_right(starts, partition_key_hash(record['PartitionKey'])) - 1
+            shard_id = shard_ranges[max(index, 0)][2]
+        groups.setdefault(shard_id, []).append(record)
+    return groups
+
+def build_batches(records, shard_ranges=None, max_records=MAX_RECORDS_PER_REQUEST, max_bytes=MAX_BYTES_PER_REQUEST):
+    # Group records by shard (when the shard map is known), then pack each group
+    # into PutRecords requests bounded by record count and total bytes.
+    # Returns a list of (shard_id, records) and the list of oversized records.
+    batches = []
+    oversized = []
+    for shard_id, group in group_by_shard(records, shard_ranges).items():
+        batch = []
+        batch_bytes = 0
+        for record in group:
+            size = record_size(record)
+            if size > MAX_RECORD_SIZE:
+                oversized.append(record)
+                continue
+            if batch and (len(batch) >= max_records or batch_bytes + size > max_bytes):
+                batches.append((shard_id, batch))
+                batch = []
+                batch_bytes = 0
+            batch.append(record)
+            batch_bytes += size
+        if batch:
+            batches.append((shard_id, batch))
+
+    if oversized:
+        print(f"Skipping {len(oversized)} records larger than {MAX_RECORD_SIZE} bytes")
+    return batches, oversized
+
+def backoff_delay(attempt, base_delay=0.05, max_delay=2.0):
+    # Exponential backoff with full jitter
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+def put_to_stream_batch(kinesis_client, stream_name, records, max_retries=5, shard_id=None, rate_limiter=None, stats=None,
+                        admitted=False, verbose=True):
+    # Retries resend the same record objects, so the payloads (and any send
+    # timestamps embedded in them) are never rebuilt. With admitted=True the
+    # rate limiter already let the first attempt through (admit_batches).
+    # verbose=False drops the per-request line (e.g. for benchmarks)
     attempt = 0
-    
-    print(f"Putting {len(records)} records to stream {stream_name}")
+
+    if verbose:
+        print(f"Putting {len(records)} records to stream {stream_name}")
     while attempt < max_retries:
+        if rate_limiter is not None and shard_id is not None and not (admitted and attempt == 0):
+            rate_limiter.acquire(shard_id, len(records), sum(record_size(record) for record in records))
         try:
             response = kinesis_client.put_records(
                 StreamName=stream_name,
                 Records=records
-            )            
+            )
             # Check if there are any failed records
             if response['FailedRecordCount'] > 0:
-                print(f"Attempt {attempt + 1}: {response['FailedRecordCount']} records failed.")
-                time.sleep(1)  # Exponential backoff
-                attempt += 1
+                failed_count = response['FailedRecordCount']
+                throttled_count = sum(
+                    1 for result in response['Records']
+                    if result.get('ErrorCode') == THROTTLED_ERROR_CODE
+                )
+                print(f"Attempt {attempt + 1}: {failed_count} records failed ({throttled_count} throttled) on shard {shard_id}.")
+                if stats is not None:
+                    stats.record(shard_id, sent=len(records) - failed_count, retried=failed_count, throttled=throttled_count)
                 # Retry only the failed records
-                failed_records = [
+                records = [
                     records[i] for i in range(len(records))
                     if 'ErrorCode' in response['Records'][i]
                 ]
-                records = failed_records  # Retry only the failed records
+                time.sleep(backoff_delay(attempt))
+                attempt += 1
             else:
+                if stats is not None:
+                    stats.record(shard_id, sent=len(records))
                 return response  # Success
 
         except Exception as e:
             print(f"Error putting records to stream: {e}")
-            time.sleep(1)  # Exponential backoff
+            if stats is not None:
+                stats.record(shard_id, errors=1)
+            time.sleep(backoff_delay(attempt))
             attempt += 1
-    
-    return None
\ No newline at end of file
+
+    print(f"Giving up on {len(records)} records for shard {shard_id} after {max_retries} attempts.")
+    if stats is not None:
+        stats.record(shard_id, lost=len(records))
+    return None
+
+def admit_batches(records, shard_ranges=None, rate_limiter=None, stats=None):
+    # Split an arbitrarily large list of records into valid per-shard
+    # PutRecords requests and wait until the rate limiter admits all of them;
+    # returns the requests for send_batches
+    batches, oversized = build_batches(records, shard_ranges)
+    if oversized and stats is not None:
+        stats.record(lost=len(oversized))
+    if rate_limiter is not None:
+        for shard_id, batch in batches:
+            if shard_id is not None:
+                rate_limiter.acquire(shard_id, len(batch), sum(record_size(record) for record in batch))
+    return batches
+
+def send_batches(kinesis_client, stream_name, batches, rate_limiter=None, stats=None, verbose=True):
+    # Send admitted requests one after another; only retries wait for the
+    # rate limiter again
+    responses = []
+    for shard_id, batch in batches:
+        responses.append(put_to_stream_batch(
+            kinesis_client, stream_name, batch,
+            shard_id=shard_id, rate_limiter=rate_limiter, stats=stats, admitted=True, verbose=verbose
+        ))
+    return responses
+
+def put_to_stream(kinesis_client, stream_name, records, shard_ranges=None, rate_limiter=None, stats=None, verbose=True):
+    # admit_batches and send_batches in one call
+    batches = admit_batches(records, shard_ranges, rate_limiter, stats)
+    return send_batches(kinesis_client, stream_name, batches, rate_limiter, stats, verbose)
@@ -0,0 +1,168 @@
+from util.kinesis import group_by_shard, MAX_RECORD_SIZE
+
+import hashlib
+
+# KPL aggregated record format:
+#   magic (4 bytes) | protobuf AggregatedRecord | MD5 of the protobuf bytes
+#
+#   message AggregatedRecord {
+#     repeated string partition_key_table = 1;
+#     repeated string explicit_hash_key_table = 2;
+#     repeated Record records = 3;
+#   }
+#   message Record {
+#     required uint64 partition_key_index = 1;
+#     optional uint64 explicit_hash_key_index = 2;
+#     required bytes data = 3;
+#     repeated Tag tags = 4;
+#   }
+KPL_MAGIC = b'\xf3\x89\x9a\xc2'
+DIGEST_SIZE = 16
+# Same default as the KPL AggregationMaxSize setting
+AGGREGATION_MAX_SIZE = 51200
+
+def _encode_varint(value):
+    out = bytearray()
+    while True:
+        bits = value & 0x7f
+        value >>= 7
+        if value:
+            out.append(bits | 0x80)
+        else:
+            out.append(bits)
+            return bytes(out)
+
+def _decode_varint(buffer, pos):
+    result = 0
+    shift = 0
+    while True:
+        byte = buffer[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+def _length_delimited(field_number, payload):
+    # Wire type 2
+    return _encode_varint(field_number << 3 | 2) + _encode_varint(len(payload)) + payload
+
+def _encode_user_record(key_index, data):
+    # partition_key_index (field 1, varint) and data (field 3, bytes)
+    return _encode_varint(1 << 3) + _encode_varint(key_index) + _length_delimited(3, data)
+
+def _to_bytes(data):
+    if isinstance(data, str):
+        return data.encode('utf-8')
+    return bytes(data)
+
+def _finish(partition_keys, entries):
+    body = b''.join(entries)
+    return {
+        'Data': KPL_MAGIC + body + hashlib.md5(body).digest(),
+        # The aggregated record is routed with the first user record's key
+        'PartitionKey': partition_keys[0]
+    }
+
+def aggregate_records(records, shard_ranges=None, max_size=AGGREGATION_MAX_SIZE):
+    # Pack Kinesis records ({'Data', 'PartitionKey'}) into KPL aggregated records.
+    # Records are grouped by shard first so that every user record inside an
+    # aggregate hashes to the shard the aggregate is routed to.
+    max_size = min(max_size, MAX_RECORD_SIZE)
+    aggregated = []
+    for group in group_by_shard(records, shard_ranges).values():
+        partition_keys = []
+        key_indexes = {}
+        entries = []
+        size = len(KPL_MAGIC) + DIGEST_SIZE
+        for record in group:
+            partition_key = record['PartitionKey']
+            data = _to_bytes(record['Data'])
+
+            key_entry = b''
+            key_index = key_indexes.get(partition_key)
+            if key_index is None:
+                key_entry = _length_delimited(1, partition_key.encode('utf-8'))
+                key_index = len(partition_keys)
+            record_entry = _length_delimited(3, _encode_user_record(key_index, data))
+            added = len(key_entry) + len(record_entry)
+
+            if entries and size + added > max_size:
+                aggregated.append(_finish(partition_keys, entries))
+                partition_keys = []
+                key_indexes = {}
+                entries = []
+                size = len(KPL_MAGIC) + DIGEST_SIZE
+                key_entry = _length_delimited(1, partition_key.encode('utf-8'))
+                key_index = 0
+                record_entry = _length_delimited(3, _encode_user_record(key_index, data))
+                added = len(key_entry) + len(record_entry)
+
+            if not entries:
+                # The routing key counts toward the Kinesis record size limit
+                size += len(partition_key.encode('utf-8'))
+            if key_entry:
+                key_indexes[partition_key] = key_index
+                partition_keys.append(partition_key)
+                entries.append(key_entry)
+            entries.append(record_entry)
+            size += added
+
+        if entries:
+            aggregated.append(_finish(partition_keys, entries))
+    return aggregated
+
+def is_aggregated(data):
+    data = _to_bytes(data)
+    return (len(data) > len(KPL_MAGIC) + DIGEST_SIZE
+            and data[:len(KPL_MAGIC)] == KPL_MAGIC
+            and hashlib.md5(data[len(KPL_MAGIC):-DIGEST_SIZE]).digest() == data[-DIGEST_SIZE:])
+
+def deaggregate_record(data, partition_key=None):
+    # Returns [(partition_key, data)] for every user record in a Kinesis record.
+    # Records that are not KPL aggregates are passed through unchanged.
+    data = _to_bytes(data)
+    if not is_aggregated(data):
+        return [(partition_key, data)]
+
+    body = data[len(KPL_MAGIC):-DIGEST_SIZE]
+    partition_keys = []
+    user_records = []
+    pos = 0
+    while pos < len(body):
+        tag, pos = _decode_varint(body, pos)
+        field_number, wire_type = tag >> 3, tag & 0x7
+        if wire_type == 0:
+            _, pos = _decode_varint(body, pos)
+            continue
+        if wire_type != 2:
+            raise ValueError(f"Unexpected wire type {wire_type} in aggregated record")
+        length, pos = _decode_varint(body, pos)
+        payload = body[pos:pos + length]
+        pos += length
+        if field_number == 1:
+            partition_keys.append(payload.decode('utf-8'))
+        elif field_number == 3:
+            user_records.append(payload)
+
+    results = []
+    for payload in user_records:
+        key_index = 0
+        record_data = b''
+        pos = 0
+        while pos < len(payload):
+            tag, pos = _decode_varint(payload, pos)
+            field_number, wire_type = tag >> 3, tag & 0x7
+            if wire_type == 0:
+                value, pos = _decode_varint(payload, pos)
+                if field_number == 1:
+                    key_index = value
+            elif wire_type == 2:
+                length, pos = _decode_varint(payload, pos)
+                if field_number == 3:
+                    record_data = payload[pos:pos + length]
+                pos += length
+            else:
+                raise ValueError(f"Unexpected wire type {wire_type} in user record")
+        results.append((partition_keys[key_index], record_data))
+    return results
@@ -0,0 +1,83 @@
+import threading
+
+import numpy as np
+
+from util.storage import grow_columns
+
+class SendLog:
+    # Intended, send and admitted time (epoch seconds) of every msg_id, kept in
+    # arrays indexed by msg_id. The send time is the one stamped into the
+    # payload; the admitted time is taken once the rate limiter lets the batch
+    # go, right before put_records. Producer batches are consecutive msg_ids,
+    # so a batch is recorded with one slice assignment.
+    def __init__(self, capacity=1 << 16):
+        self.intended = np.full(capacity, np.nan)
+        self.sent = np.full(capacity, np.nan)
+        self.admitted = np.full(capacity, np.nan)
+        self.max_msg_id = -1
+        self._lock = threading.Lock()
+
+    def _ensure_capacity(self, size):
+        grow_columns(self, ('intended', 'sent', 'admitted'), size)
+
+    def record(self, first_msg_id, count, intended_time, send_time, admitted_time=None):
+        # admitted_time defaults to send_time (no rate limiter wait in between)
+        with self._lock:
+            end = first_msg_id + count
+            self._ensure_capacity(end)
+            self.intended[first_msg_id:end] = np.nan if intended_time is None else intended_time
+            self.sent[first_msg_id:end] = send_time
+            self.admitted[first_msg_id:end] = send_time if admitted_time is None else admitted_time
+            self.max_msg_id = max(self.max_msg_id, end - 1)
+
+    def to_arrays(self):
+        msg_ids = np.nonzero(~np.isnan(self.sent[:self.max_msg_id + 1]))[0]
+        return {
+            'msg_id': msg_ids,
+            'intended_time': self.intended[msg_ids],
+            'send_time': self.sent[msg_ids],
+            'admitted_time': self.admitted[msg_ids],
+        }
+
+    def merge_arrays(self, arrays):
+        # Folds in the to_arrays() of another SendLog (e.g. a worker process)
+        msg_ids = arrays['msg_id']
+        if len(msg_ids) == 0:
+            return self
+        with self._lock:
+            self._ensure_capacity(int(msg_ids.max()) + 1)
+            self.intended[msg_ids] = arrays['intended_time']
+            self.sent[msg_ids] = arrays['send_time']
+            self.admitted[msg_ids] = arrays['admitted_time']
+            self.max_msg_id = max(self.max_msg_id, int(msg_ids.max()))
+        return self
+
+    def lookup(self, msg_ids):
+        msg_ids = np.asarray(msg_ids, dtype=np.int64)
+        intended = np.full(len(msg_ids), np.nan)
+        sent = np.full(len(msg_ids), np.nan)
+        admitted = np.full(len(msg_ids), np.nan)
+        known = (msg_ids >= 0) & (msg_ids < len(self.sent))
+        intended[known] = self.intended[msg_ids[known]]
+        sent[known] = self.sent[msg_ids[known]]
+        admitted[known] = self.admitted[msg_ids[known]]
+        return intended, sent, admitted
+
+def latency_breakdown(msg_ids, start_times, end_times, send_log):
+    # Joins the function-side timings with the producer's send log by msg_id.
+    # All results are in seconds; messages without a send record are NaN.
+    #   end_to_end: intended send time -> function completion (the SLO metric)
+    #   queueing:   admitted time -> function start (Kinesis + event source mapping)
+    #   harness:    intended -> admitted time (delay inside the load generator,
+    #               rate limiter waits included)
+    # send_time is the time stamped into the payloads, taken before encoding.
+    intended, sent, admitted = send_log.lookup(msg_ids)
+    end_to_end = np.asarray(end_times) - np.where(np.isnan(intended), sent, intended)
+    return {
+        'end_to_end': end_to_end,
+        'queueing': np.asarray(start_times) - admitted,
+        'harness': admitted - intended,
+        'intended_time': intended,
+        'send_time': sent,
+        'admitted_time': admitted,
+    }
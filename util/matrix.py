@@ -0,0 +1,167 @@
+from util.harness import run_cell, make_clients, SPEC_DEFAULTS
+from util.arrival import ARRIVALS
+from util.search import search_cell, SEARCH_DEFAULTS
+from util.autotune import autotune_cell, AUTOTUNE_DEFAULTS
+
+import itertools
+import json
+import threading
+from contextlib import contextmanager
+from queue import Queue, Empty
+from concurrent.futures import ThreadPoolExecutor
+
+# Experiment specs are JSON files (see experiments/). Every key of
+# util.harness.SPEC_DEFAULTS can be set; 'sweep' maps axes to the values to
+# try, and the runner executes the Cartesian product of all axes:
+#   {"name": "wc", "stream": "...", "log_group": "...",
+#    "sweep": {"input_rate": [300, 600], "replica": [25, 50]}}
+# Arrival schedules are swept like any other axis:
+#    "sweep": {"arrival": [{"type": "poisson"}, {"type": "ramp", "end_rate": 1200}]}
+#
+# Cells can run in parallel when the spec lists 'lanes', each with its own
+# stream, functions and log group. Every lane runs one cell at a time and
+# takes the next pending cell when it finishes, so the log polling and idle
+# waits of one cell overlap with the others. 'max_producers' and
+# 'max_total_rate' cap the producers running at once across all lanes:
+#   "lanes": [{"stream": "s1", "functions": ["f1"], "log_group": "/aws/lambda/f1"},
+#             {"stream": "s2", "functions": ["f2"], "log_group": "/aws/lambda/f2"}],
+#   "max_producers": 2, "max_total_rate": 2000
+#
+# A spec with a 'search' block searches the sustainable input rate of every
+# cell instead of running it once (see util.search), and one with an
+# 'autotune' block the smallest reserved concurrency (see util.autotune).
+SWEEP_AXES = ['input_rate', 'arrival', 'replay_speedup', 'replica', 'memory_size', 'batch_size']
+REQUIRED_KEYS = ['name', 'stream', 'log_group']
+LANE_KEYS = ['stream', 'functions', 'log_group']
+MATRIX_KEYS = ['sweep', 'lanes', 'max_producers', 'max_total_rate', 'search', 'autotune']
+
+class HarnessBudget:
+    # Global cap on the producers of concurrently running cells: at most
+    # max_producers cells produce at once (harness CPU) and their input rates
+    # add up to at most max_total_rate records/s (harness network). A cell
+    # whose rate alone exceeds max_total_rate runs on its own.
+    def __init__(self, max_producers=None, max_total_rate=None):
+        self.max_producers = max_producers
+        self.max_total_rate = max_total_rate
+        self.producers = 0
+        self.total_rate = 0
+        self._condition = threading.Condition()
+
+    def _fits(self, rate):
+        if self.max_producers is not None and self.producers >= self.max_producers:
+            return False
+        if self.max_total_rate is not None and self.producers and self.total_rate + rate > self.max_total_rate:
+            return False
+        return True
+
+    @contextmanager
+    def reserve(self, rate):
+        with self._condition:
+            self._condition.wait_for(lambda: self._fits(rate))
+            self.producers += 1
+            self.total_rate += rate
+        try:
+            yield
+        finally:
+            with self._condition:
+                self.producers -= 1
+                self.total_rate -= rate
+                self._condition.notify_all()
+
+def check_lanes(spec, lanes):
+    # Parallel cells must not share anything that would mix their traffic or
+    # logs; a lane inherits every key it does not set from the spec
+    if len(lanes) < 2:
+        return
+    for key in LANE_KEYS:
+        seen = set()
+        for lane in lanes:
+            values = lane.get(key, spec.get(key, []))
+            values = set(values) if isinstance(values, list) else {values}
+            if seen & values:
+                raise ValueError(f"Lanes share {key} {sorted(seen & values)}; each lane needs its own")
+            seen |= values
+
+def load_spec(file_path):
+    with open(file_path, 'r') as file:
+        spec = json.load(file)
+    missing = [key for key in REQUIRED_KEYS if key not in spec]
+    if missing:
+        raise ValueError(f"Experiment spec {file_path} is missing {missing}")
+    unknown = set(spec) - set(SPEC_DEFAULTS) - set(REQUIRED_KEYS) - set(MATRIX_KEYS)
+    if unknown:
+        raise ValueError(f"Experiment spec {file_path} has unknown keys {sorted(unknown)}")
+    unknown_axes = set(spec.get('sweep', {})) - set(SWEEP_AXES)
+    if unknown_axes:
+        raise ValueError(f"Unknown sweep axes {sorted(unknown_axes)}, choose from {SWEEP_AXES}")
+    if 'search' in spec:
+        unknown_search = set(spec['search']) - set(SEARCH_DEFAULTS)
+        if unknown_search:
+            raise ValueError(f"Unknown search keys {sorted(unknown_search)}, choose from {sorted(SEARCH_DEFAULTS)}")
+        if 'input_rate' in spec.get('sweep', {}):
+            raise ValueError("A search spec finds the input_rate itself; remove it from the sweep")
+    if 'autotune' in spec:
+        if 'search' in spec:
+            raise ValueError("A spec can either search the input rate or autotune the concurrency, not both")
+        unknown_autotune = set(spec['autotune']) - set(AUTOTUNE_DEFAULTS)
+        if unknown_autotune:
+            raise ValueError(f"Unknown autotune keys {sorted(unknown_autotune)}, choose from {sorted(AUTOTUNE_DEFAULTS)}")
+        if 'replica' in spec.get('sweep', {}):
+            raise ValueError("An autotune spec finds the replica itself; remove it from the sweep")
+        unknown_stages = set(spec['autotune'].get('stages') or []) - set(spec.get('functions', []))
+        if unknown_stages:
+            raise ValueError(f"Autotune stages {sorted(unknown_stages)} are not in the spec's functions")
+    arrivals = spec.get('sweep', {}).get('arrival', []) + ([spec['arrival']] if spec.get('arrival') else [])
+    for arrival in arrivals:
+        if arrival.get('type') not in ARRIVALS:
+            raise ValueError(f"Unknown arrival type {arrival.get('type')}, choose from {sorted(ARRIVALS)}")
+    for lane in spec.get('lanes', []):
+        if set(lane) - set(LANE_KEYS):
+            raise ValueError(f"Lanes may only set {LANE_KEYS}, not {sorted(set(lane) - set(LANE_KEYS))}")
+    check_lanes(spec, spec.get('lanes', []))
+    return spec
+
+def expand_matrix(spec):
+    # [{axis: value}] in sweep order, the last axis varying fastest
+    sweep = spec.get('sweep', {})
+    axes = [axis for axis in SWEEP_AXES if axis in sweep]
+    return [dict(zip(axes, values)) for values in itertools.product(*(sweep[axis] for axis in axes))]
+
+def run_lane(spec, lane, cell_queue, entries, clients, budget, run):
+    while True:
+        try:
+            index, cell = cell_queue.get_nowait()
+        except Empty:
+            return
+        print(f"Running {spec['name']} cell {index + 1}/{len(entries)} on {lane.get('stream', spec['stream'])}: {cell}")
+        entries[index] = run(spec, cell, clients, lane, budget)
+
+def run_matrix(spec, clients=None):
+    # Returns the run store entries in cell order (search or autotune
+    # entries for those specs)
+    cells = expand_matrix(spec)
+    if 'search' in spec:
+        run = search_cell
+    elif 'autotune' in spec:
+        run = autotune_cell
+    else:
+        run = run_cell
+    if clients is None:
+        clients = make_clients(spec.get('region', SPEC_DEFAULTS['region']))
+    lanes = spec.get('lanes') or [{}]
+    check_lanes(spec, lanes)
+    budget = HarnessBudget(spec.get('max_producers'), spec.get('max_total_rate'))
+
+    cell_queue = Queue()
+    for index, cell in enumerate(cells):
+        cell_queue.put((index, cell))
+    entries = [None] * len(cells)
+    with ThreadPoolExecutor(max_workers=len(lanes)) as executor:
+        futures = [
+            executor.submit(run_lane, spec, lane, cell_queue, entries, clients, budget, run)
+            for lane in lanes
+        ]
+    # Re-raise the first failure of any lane
+    for future in futures:
+        future.result()
+    return entries
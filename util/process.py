@@ -0,0 +1,186 @@
+from util.thread import batch_producer, guarded_consumer
+from util.kinesis import ShardRateLimiter, PutStats, SHARD_RECORDS_PER_SECOND, SHARD_BYTES_PER_SECOND
+from util.codec import get_codec
+from util.latency import SendLog
+
+import boto3
+import multiprocessing
+import threading
+import time
+from queue import Queue, Empty
+
+class StridedAllocator:
+    # Lock-free replacement for AtomicInteger across processes: worker k of n
+    # owns batches k, k + n, k + 2n, ... of a dense msg_id sequence, so the
+    # workers' ranges are disjoint and together cover start, start + 1, ...
+    # without any shared state.
+    def __init__(self, start, worker_index, num_workers, batch_size):
+        self.start = start
+        self.worker_index = worker_index
+        self.num_workers = num_workers
+        self.batch_size = batch_size
+        self.batch_number = 0
+
+    def get_and_increment(self, increment_value=None):
+        if increment_value is not None and increment_value != self.batch_size:
+            raise ValueError(f"StridedAllocator hands out batches of {self.batch_size}, not {increment_value}")
+        block = self.batch_number * self.num_workers + self.worker_index
+        self.batch_number += 1
+        return self.start + block * self.batch_size
+
+def producer_process(worker_index, num_workers, records, input_batchsize, input_map, stream_name, start_time, end_time, rate, num_threads, options, result_queue):
+    # Each worker has its own client (botocore clients must not cross a fork),
+    # its own consumer threads and its share of the rate and shard limits
+    client_factory = options.get('client_factory')
+    if client_factory is not None:
+        kinesis_client = client_factory()
+    else:
+        kinesis_client = boto3.client('kinesis', region_name=options.get('region_name', 'ap-southeast-2'))
+    codec = get_codec(options.get('codec', 'json'), **options.get('codec_options', {}))
+    rate_limiter = ShardRateLimiter(
+        SHARD_RECORDS_PER_SECOND / num_workers,
+        SHARD_BYTES_PER_SECOND / num_workers
+    )
+    put_stats = PutStats()
+    send_log = SendLog()
+    allocator = StridedAllocator(options.get('first_msg_id', 1), worker_index, num_workers, input_batchsize)
+    batch_queue = Queue()
+    producer_stats = {}
+    consumer_errors = []
+
+    input_threads = []
+    for _ in range(num_threads):
+        thread = threading.Thread(
+            target=guarded_consumer,
+            args=(
+                consumer_errors,
+                kinesis_client,
+                batch_queue,
+                stream_name,
+                options.get('partition_by'),
+                options.get('shard_ranges'),
+                options.get('aggregate', False),
+                rate_limiter,
+                put_stats,
+                codec,
+                send_log,
+                options.get('extra_fields'),
+            )
+        )
+        input_threads.append(thread)
+        thread.start()
+
+    # Workers are phase-shifted so that their batches interleave evenly
+    worker_start = start_time + worker_index * input_batchsize / rate
+    total_records = batch_producer(
+        records,
+        allocator,
+        input_batchsize,
+        input_map,
+        batch_queue,
+        end_time,
+        rate / num_workers,
+        num_threads,
+        producer_stats,
+        worker_start,
+    )
+    for thread in input_threads:
+        thread.join()
+    producer_stats['consumer_errors'] = [f"worker {worker_index}: {error}" for error in consumer_errors]
+
+    result_queue.put({
+        'worker_index': worker_index,
+        'total_records': total_records,
+        'producer_stats': producer_stats,
+        'put_stats': put_stats.summary(),
+        'send_log': send_log.to_arrays(),
+    })
+
+def merge_msg_id_ranges(range_lists):
+    # One sorted list of [first, stop) ranges from the workers' strided ones
+    merged = []
+    for first, stop in sorted(tuple(r) for ranges in range_lists for r in ranges):
+        if merged and merged[-1][1] >= first:
+            merged[-1][1] = max(merged[-1][1], stop)
+        else:
+            merged.append([first, stop])
+    return merged
+
+def merge_results(results):
+    total_records = sum(result['total_records'] for result in results)
+    batches = sum(result['producer_stats'].get('batches', 0) for result in results)
+    producer_stats = {
+        'target_rate': sum(result['producer_stats'].get('target_rate', 0) for result in results),
+        'achieved_rate': sum(result['producer_stats'].get('achieved_rate', 0) for result in results),
+        'max_lag': max((result['producer_stats'].get('max_lag', 0) for result in results), default=0),
+        'mean_lag': sum(
+            result['producer_stats'].get('mean_lag', 0) * result['producer_stats'].get('batches', 0)
+            for result in results
+        ) / batches if batches else 0,
+        'batches': batches,
+        'start_time': min((result['producer_stats'].get('start_time', 0) for result in results), default=0),
+        'msg_id_ranges': merge_msg_id_ranges(result['producer_stats'].get('msg_id_ranges', []) for result in results),
+        'consumer_errors': [error for result in results for error in result['producer_stats'].get('consumer_errors', [])],
+    }
+    put_summary = {'sent': 0, 'retried': 0, 'throttled': 0, 'errors': 0, 'lost': 0, 'lost_by_shard': {}}
+    for result in results:
+        for key, value in result['put_stats'].items():
+            if key == 'lost_by_shard':
+                for shard_id, lost in value.items():
+                    put_summary[key][shard_id] = put_summary[key].get(shard_id, 0) + lost
+            else:
+                put_summary[key] += value
+    send_log = SendLog()
+    for result in results:
+        send_log.merge_arrays(result['send_log'])
+    return total_records, producer_stats, put_summary, send_log
+
+def run_producer_processes(records, input_batchsize, input_map, stream_name, duration, rate, num_processes, num_threads, options=None, start_delay=1.0):
+    # Runs num_processes producer processes against one shared schedule and
+    # returns (total_records, producer_stats, put_summary, send_log) merged over workers.
+    # records may be a list or a Corpus; with the default fork start method the
+    # children share the parent's pages instead of receiving a pickled copy.
+    options = options or {}
+    result_queue = multiprocessing.Queue()
+    # Give every worker time to start before the first batch is due
+    start_time = time.time() + start_delay
+    end_time = start_time + duration
+
+    processes = []
+    for worker_index in range(num_processes):
+        process = multiprocessing.Process(
+            target=producer_process,
+            args=(
+                worker_index,
+                num_processes,
+                records,
+                input_batchsize,
+                input_map,
+                stream_name,
+                start_time,
+                end_time,
+                rate,
+                num_threads,
+                options,
+                result_queue,
+            )
+        )
+        processes.append(process)
+        process.start()
+
+    # Drain results before joining so large payloads cannot block the children
+    results = []
+    while len(results) < len(processes):
+        try:
+            results.append(result_queue.get(timeout=1))
+        except Empty:
+            failed = [process.exitcode for process in processes if process.exitcode not in (None, 0)]
+            if failed:
+                raise RuntimeError(f"Producer process exited with code {failed[0]}")
+    for process in processes:
+        process.join()
+
+    total_records, producer_stats, put_summary, send_log = merge_results(results)
+    print(f"{num_processes} producer processes finished. Total items produced: {total_records}")
+    print(f"Target rate: {producer_stats['target_rate']} records/s, achieved rate: {producer_stats['achieved_rate']:.1f} records/s")
+    return total_records, producer_stats, put_summary, send_log
@@ -0,0 +1,69 @@
+import json
+import os
+import time
+import uuid
+
+import numpy as np
+
+# Columnar result store: every run keeps its per-message arrays in a
+# compressed .npz file under results/<name>/, and one JSON line per run in
+# results/<name>/index.jsonl records its config, summary and file. Queries
+# across runs only read the index; the arrays are loaded on demand.
+RESULTS_DIR = 'results'
+INDEX_FILE = 'index.jsonl'
+
+def _json_default(value):
+    # NumPy scalars and arrays in configs and summaries
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+def save_run(name, arrays, config, summary=None, results_dir=RESULTS_DIR):
+    directory = os.path.join(results_dir, name)
+    os.makedirs(directory, exist_ok=True)
+    run_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+    array_file = f"{run_id}.npz"
+    np.savez_compressed(os.path.join(directory, array_file), **arrays)
+
+    entry = {
+        'run_id': run_id,
+        'name': name,
+        'created': time.time(),
+        'file': array_file,
+        'config': config,
+        'summary': summary or {},
+    }
+    with open(os.path.join(directory, INDEX_FILE), 'a') as index_file:
+        index_file.write(json.dumps(entry, default=_json_default) + '\n')
+    print(f"Saved run {run_id} to {directory}")
+    return entry
+
+def load_index(name, results_dir=RESULTS_DIR):
+    index_path = os.path.join(results_dir, name, INDEX_FILE)
+    if not os.path.exists(index_path):
+        return []
+    with open(index_path, 'r') as index_file:
+        return [json.loads(line) for line in index_file if line.strip()]
+
+def query_runs(name, results_dir=RESULTS_DIR, **config_filters):
+    # e.g. query_runs('wc', input_rate=300) -> index entries, oldest first
+    return [
+        entry for entry in load_index(name, results_dir)
+        if all(entry['config'].get(key) == value for key, value in config_filters.items())
+    ]
+
+def load_run_arrays(entry, results_dir=RESULTS_DIR):
+    with np.load(os.path.join(results_dir, entry['name'], entry['file'])) as data:
+        return {key: data[key] for key in data.files}
+
+def summary_table(name, x, y, results_dir=RESULTS_DIR, **config_filters):
+    # [(config[x], summary[y])] sorted by x, e.g.
+    # summary_table('wc', 'replica', 'p99_execution_time')
+    rows = [
+        (entry['config'].get(x), entry['summary'].get(y))
+        for entry in query_runs(name, results_dir, **config_filters)
+        if y in entry['summary']
+    ]
+    return sorted(rows, key=lambda row: (row[0] is None, row[0]))
@@ -0,0 +1,132 @@
+from util.harness import run_cell, SPEC_DEFAULTS, _output_lock
+from util.results import save_run
+
+import os
+
+import numpy as np
+
+# Saturation search: instead of sweeping a fixed list of input rates, find
+# the highest rate a cell (function, concurrency, ...) sustains. A spec with
+# a 'search' block runs one search per cell of its sweep:
+#   "search": {"slo_p99_ms": 2000, "start_rate": 300, "max_rate": 4800},
+#   "sweep": {"replica": [25, 50, 100]}
+# The rate doubles from start_rate until a probe fails, then a binary search
+# narrows the gap between the last sustainable and the first failed rate.
+# A probe (one run_cell) is sustainable when every message was processed,
+# the backlog stayed bounded (end-to-end latency did not keep growing over
+# the run) and the p99 end-to-end latency met the SLO.
+SEARCH_DEFAULTS = {
+    'slo_p99_ms': 1000,
+    'start_rate': 100,
+    'max_rate': 10000,
+    # Ramp factor between probes until the first failure
+    'growth': 2,
+    # Stop once the failed rate is within this fraction of the sustained one
+    'resolution': 0.05,
+    # Fraction of the probed rate the harness may fall short of before the
+    # probe fails as not produced
+    'rate_tolerance': 0.05,
+    # Largest latency_growth (seconds of latency per second of run) that
+    # still counts as a bounded backlog
+    'max_latency_growth': 0.05,
+    'max_probes': 12,
+}
+# Probe metrics kept for the latency curve
+CURVE_KEYS = ['achieved_rate', 'p50_end_to_end_ms', 'p99_end_to_end_ms', 'p999_end_to_end_ms', 'latency_growth', 'missing_records']
+
+def check_probe(summary, rate, search):
+    # Returns the reasons a probe at rate is not sustainable ([] if it is)
+    reasons = []
+    if summary.get('missing_records'):
+        reasons.append(f"{summary['missing_records']} messages never processed")
+    if summary.get('achieved_rate') is not None and summary['achieved_rate'] < rate * (1 - search['rate_tolerance']):
+        reasons.append(f"the harness only produced {summary['achieved_rate']:.0f} records/s")
+    if summary.get('latency_growth', 0) > search['max_latency_growth']:
+        reasons.append(f"backlog grew (latency +{summary['latency_growth']:.3f} s per s)")
+    p99 = summary.get('p99_end_to_end_ms')
+    if p99 is None:
+        reasons.append("no end-to-end latencies")
+    elif p99 > search['slo_p99_ms']:
+        reasons.append(f"p99 {p99:.0f} ms over the {search['slo_p99_ms']} ms SLO")
+    return reasons
+
+def search_cell(spec, cell, clients=None, lane=None, budget=None):
+    # Runs the saturation search for one cell and returns its run store entry;
+    # the signature matches run_cell so util.matrix can run it on lanes
+    search = {**SEARCH_DEFAULTS, **spec['search']}
+    probes = {}
+
+    def probe(rate):
+        entry = run_cell(spec, {**cell, 'input_rate': rate}, clients, lane, budget)
+        reasons = check_probe(entry['summary'], rate, search)
+        probes[rate] = {
+            'input_rate': rate,
+            'sustainable': not reasons,
+            'reasons': reasons,
+            'run_id': entry['run_id'],
+            **{key: entry['summary'].get(key) for key in CURVE_KEYS},
+        }
+        print(f"Probe {len(probes)} at {rate} records/s: " + ("sustainable" if not reasons else '; '.join(reasons)))
+        return not reasons
+
+    # Ramp until the first failure (or max_rate)
+    sustained = 0
+    failed = None
+    rate = search['start_rate']
+    while len(probes) < search['max_probes']:
+        if probe(rate):
+            sustained = rate
+            if rate >= search['max_rate']:
+                break
+            rate = min(int(round(rate * search['growth'])), search['max_rate'])
+        else:
+            failed = rate
+            break
+    # Binary search between the last sustained and the first failed rate
+    while failed is not None and len(probes) < search['max_probes'] and failed - sustained > search['resolution'] * failed:
+        rate = int(round((sustained + failed) / 2))
+        if rate in probes or rate <= 0:
+            break
+        if probe(rate):
+            sustained = rate
+        else:
+            failed = rate
+
+    return report_search(spec, cell, search, probes, sustained, failed)
+
+def report_search(spec, cell, search, probes, sustained, failed):
+    curve = [probes[rate] for rate in sorted(probes)]
+    name = spec['name']
+    lines = [f"{key}: {value}" for key, value in cell.items()]
+    lines.append(f"slo_p99_ms: {search['slo_p99_ms']}")
+    if failed is None:
+        lines.append(f"sustainable_throughput: >= {sustained} records/s (no failure up to max_rate {search['max_rate']})")
+    else:
+        lines.append(f"sustainable_throughput: {sustained} records/s (fails at {failed} records/s)")
+    lines.append("input_rate / achieved_rate / p50 / p99 / p99.9 ms / latency_growth / sustainable")
+    for point in curve:
+        values = [point['achieved_rate'], point['p50_end_to_end_ms'], point['p99_end_to_end_ms'],
+                  point['p999_end_to_end_ms'], point['latency_growth']]
+        shown = ' / '.join('-' if value is None else f"{value:.2f}" for value in values)
+        lines.append(f"{point['input_rate']} / {shown} / {'yes' if point['sustainable'] else 'no: ' + '; '.join(point['reasons'])}")
+    for line in lines:
+        print(line)
+
+    results_dir = spec.get('results_dir', SPEC_DEFAULTS['results_dir'])
+    os.makedirs(results_dir, exist_ok=True)
+
+    # The latency curve as arrays, one element per probe in rate order
+    arrays = {'input_rate': np.array([point['input_rate'] for point in curve], dtype=np.float64),
+              'sustainable': np.array([point['sustainable'] for point in curve], dtype=bool)}
+    for key in CURVE_KEYS:
+        arrays[key] = np.array([np.nan if point[key] is None else point[key] for point in curve], dtype=np.float64)
+    summary = {
+        'sustainable_throughput': sustained,
+        'first_failed_rate': failed,
+        'probes': curve,
+    }
+    # Searches on parallel lanes share the report file and the run index
+    with _output_lock:
+        with open(os.path.join(results_dir, f"{name}_search.txt"), 'a') as out_file:
+            out_file.write('\n'.join(lines) + '\n\n')
+        return save_run(f"{name}_search", arrays, {**cell, 'search': search}, summary, results_dir)
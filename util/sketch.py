@@ -0,0 +1,134 @@
+import math
+
+import numpy as np
+
+# Quantiles reported for every latency distribution
+REPORT_QUANTILES = [('p50', 0.5), ('p90', 0.9), ('p95', 0.95), ('p99', 0.99), ('p999', 0.999)]
+
+class LatencyHistogram:
+    # Log-bucketed histogram in the HDR histogram family: bucket i covers
+    # (gamma^(i-1), gamma^i] with gamma = (1 + accuracy) / (1 - accuracy), so
+    # every quantile is reported within `accuracy` relative error. The bucket
+    # array has a fixed size for the configured value range, so memory does not
+    # grow with the number of samples, and two histograms with the same
+    # settings merge by adding their counts (runs, workers, replicas...).
+    def __init__(self, accuracy=0.01, min_value=1e-3, max_value=1e12):
+        self.accuracy = accuracy
+        self.min_value = min_value
+        self.max_value = max_value
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.offset = math.ceil(math.log(min_value) / self.log_gamma)
+        self.num_buckets = math.ceil(math.log(max_value) / self.log_gamma) - self.offset + 1
+        self.counts = np.zeros(self.num_buckets, dtype=np.int64)
+        # Values at or below zero cannot be log-bucketed
+        self.zero_count = 0
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def record(self, values):
+        values = np.asarray(values, dtype=np.float64).ravel()
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return
+        self.count += len(values)
+        self.total += float(values.sum())
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+
+        positive = values[values > 0]
+        self.zero_count += len(values) - len(positive)
+        if len(positive):
+            indexes = np.ceil(np.log(positive) / self.log_gamma).astype(np.int64) - self.offset
+            np.clip(indexes, 0, self.num_buckets - 1, out=indexes)
+            self.counts += np.bincount(indexes, minlength=self.num_buckets)
+
+    def remove(self, values):
+        # Takes back values recorded earlier (e.g. a message latency revised by
+        # a later log line). min and max shrink to the bounds of the remaining
+        # buckets, i.e. within the histogram's accuracy
+        values = np.asarray(values, dtype=np.float64).ravel()
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return
+        self.count -= len(values)
+        self.total -= float(values.sum())
+        positive = values[values > 0]
+        self.zero_count -= len(values) - len(positive)
+        if len(positive):
+            indexes = np.ceil(np.log(positive) / self.log_gamma).astype(np.int64) - self.offset
+            np.clip(indexes, 0, self.num_buckets - 1, out=indexes)
+            self.counts -= np.bincount(indexes, minlength=self.num_buckets)
+        if self.count == 0:
+            self.total = 0.0
+            self.min = math.inf
+            self.max = -math.inf
+            return
+        nonzero = np.flatnonzero(self.counts)
+        if values.max() >= self.max:
+            self.max = min(self.max, self.gamma ** (nonzero[-1] + self.offset) if len(nonzero) else 0.0)
+        if values.min() <= self.min and self.zero_count == 0:
+            self.min = max(self.min, self.gamma ** (nonzero[0] + self.offset - 1))
+
+    def _check_compatible(self, other):
+        if (self.accuracy, self.min_value, self.max_value) != (other.accuracy, other.min_value, other.max_value):
+            raise ValueError("Only histograms with the same accuracy and range can be merged")
+
+    def merge(self, other):
+        self._check_compatible(other)
+        self.counts += other.counts
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def quantile(self, q):
+        if self.count == 0:
+            return math.nan
+        rank = q * (self.count - 1)
+        if rank < self.zero_count:
+            return min(self.min, 0.0)
+        cumulative = np.cumsum(self.counts)
+        index = int(np.searchsorted(cumulative, rank - self.zero_count, side='right'))
+        index = min(index, self.num_buckets - 1)
+        # Midpoint of the bucket in relative terms
+        value = 2 * self.gamma ** (index + self.offset) / (self.gamma + 1)
+        return min(max(value, self.min), self.max)
+
+    def mean(self):
+        return self.total / self.count if self.count else math.nan
+
+    def summary(self):
+        summary = {name: self.quantile(q) for name, q in REPORT_QUANTILES}
+        summary['max'] = self.max if self.count else math.nan
+        summary['mean'] = self.mean()
+        summary['count'] = self.count
+        return summary
+
+    def to_arrays(self, prefix):
+        # Sparse form for the run store (see util.results)
+        nonzero = np.nonzero(self.counts)[0]
+        return {
+            f'{prefix}_index': nonzero,
+            f'{prefix}_count': self.counts[nonzero],
+            f'{prefix}_meta': np.array([
+                self.accuracy, self.min_value, self.max_value,
+                self.zero_count, self.count, self.total, self.min, self.max
+            ]),
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays, prefix):
+        accuracy, min_value, max_value, zero_count, count, total, minimum, maximum = arrays[f'{prefix}_meta'].tolist()
+        histogram = cls(accuracy, min_value, max_value)
+        histogram.counts[arrays[f'{prefix}_index']] = arrays[f'{prefix}_count']
+        histogram.zero_count = int(zero_count)
+        histogram.count = int(count)
+        histogram.total = total
+        histogram.min = minimum
+        histogram.max = maximum
+        return histogram
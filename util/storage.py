@@ -0,0 +1,48 @@
+import mmap
+
+import numpy as np
+
+class MappedFile:
+    # Base of the read-only caches (corpus, sentence and trace files): a file
+    # mapped once, starting with a header whose first two fields are the magic
+    # and the entry count. Subclasses return their constructor arguments from
+    # _init_args(), so pickling (spawned processes) re-maps the file instead
+    # of copying its contents, and drop their views of the mapping in close()
+    # before calling this one.
+    def __init__(self, path, magic, header, description):
+        self._file = open(path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.header = header.unpack_from(self._mmap, 0)
+        if self.header[0] != magic:
+            self.close()
+            raise ValueError(f"{path} is not a {description}")
+        self.count = self.header[1]
+        # Offset of the data after the header
+        self.data_offset = header.size
+
+    def _init_args(self):
+        raise NotImplementedError
+
+    def __len__(self):
+        return self.count
+
+    def __reduce__(self):
+        return (type(self), self._init_args())
+
+    def close(self):
+        self._mmap.close()
+        self._file.close()
+
+def grow_columns(owner, names, size):
+    # Grows the NaN-filled per-msg_id arrays of owner (the attributes in
+    # names, all of one length) to hold at least size entries; the capacity
+    # at least doubles, so growing one batch at a time stays cheap
+    current = len(getattr(owner, names[0]))
+    if size <= current:
+        return
+    capacity = max(size, 2 * current)
+    for name in names:
+        old = getattr(owner, name)
+        new = np.full(capacity, np.nan)
+        new[:len(old)] = old
+        setattr(owner, name, new)
@@ -1,9 +1,15 @@
-from util.kinesis import put_to_stream_batch
+from util.kinesis import admit_batches, send_batches
+from util.kpl import aggregate_records
+from util.corpus import Corpus, stamp_payload
+from util.codec import JsonCodec
+from util.arrival import arrival_times, describe_arrival
 
 import threading
 import time
 from queue import Queue, Empty
-import json
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 
 class AtomicInteger:
     def __init__(self, initial=1):
@@ -16,51 +22,278 @@ class AtomicInteger:
             self.value += increment_value
             return current_value
 
-def generate_input_data(records, start, size, input_map):
+# Below this many seconds before a deadline the scheduler spins instead of sleeping
+SPIN_THRESHOLD = 0.002
+
+def sleep_until(deadline):
+    # deadline is a time.perf_counter() value
+    while True:
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            return
+        if remaining > SPIN_THRESHOLD:
+            time.sleep(remaining - SPIN_THRESHOLD)
+
+def add_msg_id_range(ranges, start, size):
+    # Adds msg_ids start .. start + size - 1 to a list of [first, stop)
+    # ranges, extending the last range when the ids follow on from it
+    if size <= 0:
+        return
+    if ranges and ranges[-1][1] == start:
+        ranges[-1][1] = start + size
+    else:
+        ranges.append([start, start + size])
+
+def generate_input_data(records, start, size, input_map, intended_time=None):
+    if isinstance(records, Corpus):
+        # Pre-encoded payloads; batch_consumer stamps and sends them as they are
+        return records.messages(start, size, intended_time)
     # Use input_map to access the specific indices for each attribute
     if records is None or input_map is None: 
         return_msg = [{'msg_id': msg_id} for msg_id in range(start, start + size)]  
     else:  
         return_msg = [{'msg_id': msg_id, **{key: record[input_map[key]] for key in input_map}}  
                       for msg_id, record in enumerate(records[start:start + size], start)]  
+    if intended_time is not None:
+        # Latency is measured from when the message should have been sent
+        for msg in return_msg:
+            msg['intended_time'] = intended_time
     return return_msg
 
-def batch_producer(records, atomic_count, input_batchsize, input_map, batch_queue, end_time, rate, num_consumers):
+def batch_producer(records, atomic_count, input_batchsize, input_map, batch_queue, end_time, rate, num_consumers, producer_stats=None, start_time=None):
+    # Open-loop schedule: batch k is due at start + k * batch_interval no matter
+    # how far behind the consumers are. A late batch is sent as soon as possible
+    # but keeps its intended send time, so queueing in the harness shows up in
+    # the measured latency instead of silently stretching the schedule.
     batch_interval = input_batchsize / rate  # Interval between batches in seconds
-    next_batch_time = time.time()
+    # Anchor the high-resolution clock to wall-clock time once; start_time lets
+    # several producers share (or deliberately offset) one schedule
+    now_wall = time.time()
+    now_perf = time.perf_counter()
+    start_wall = start_time if start_time is not None else now_wall
+    start_perf = now_perf + (start_wall - now_wall)
     total_items_produced = 0  # Initialize a counter for total items produced
+    batch_index = 0
+    max_lag = 0
+    total_lag = 0
+    last_emit_perf = start_perf
+    # msg_ids handed to the consumers, which the logs are checked against
+    msg_id_ranges = []
 
     print(f"Batch producer started. Producing {input_batchsize} items every {batch_interval} seconds.")
-    while time.time() < end_time:
-        now = time.time()
-        sleep_time = next_batch_time - now
-        if sleep_time > 0:
-            time.sleep(sleep_time)
-            now = time.time()  # Update now after sleeping
-
-        # Produce batches until we're back on schedule
-        while now >= next_batch_time:
-            input_index = atomic_count.get_and_increment(input_batchsize)
-            if records is not None and input_index + input_batchsize >= len(records):
-                break
-            input_data_list = generate_input_data(records, input_index, input_batchsize, input_map)
-            # print(f"Produced batch : {input_data_list}")
-            # Put batch data into queue
-            batch_queue.put((input_index, input_data_list))
-            total_items_produced += input_batchsize
-            # Update next_batch_time for the next batch
-            next_batch_time += batch_interval
-            # Update now to reflect the current time after processing
-            now = time.time()
+    while True:
+        offset = batch_index * batch_interval
+        intended_time = start_wall + offset
+        if intended_time >= end_time:
+            break
+        sleep_until(start_perf + offset)
+
+        input_index = atomic_count.get_and_increment(input_batchsize)
+        if records is not None and input_index + input_batchsize >= len(records):
+            print("Input records exhausted.")
+            break
+        input_data_list = generate_input_data(records, input_index, input_batchsize, input_map, intended_time)
+        # Put batch data into queue
+        batch_queue.put((input_index, input_data_list))
+        add_msg_id_range(msg_id_ranges, input_index, input_batchsize)
+
+        last_emit_perf = time.perf_counter()
+        lag = last_emit_perf - start_perf - offset
+        max_lag = max(max_lag, lag)
+        total_lag += lag
+        total_items_produced += input_batchsize
+        batch_index += 1
 
     # After production is done, signal consumers to exit
     for _ in range(num_consumers):
         batch_queue.put(None)
+
+    elapsed = max(last_emit_perf - start_perf, batch_interval * batch_index)
+    achieved_rate = total_items_produced / elapsed if elapsed > 0 else 0
+    mean_lag = total_lag / batch_index if batch_index else 0
     print(f"Batch producer finished. Total items produced: {total_items_produced}")
+    print(f"Target rate: {rate} records/s, achieved rate: {achieved_rate:.1f} records/s, "
+          f"max schedule lag: {max_lag * 1000:.2f} ms, mean schedule lag: {mean_lag * 1000:.2f} ms")
+    if producer_stats is not None:
+        producer_stats.update({
+            'target_rate': rate,
+            'achieved_rate': achieved_rate,
+            'max_lag': max_lag,
+            'mean_lag': mean_lag,
+            'batches': batch_index,
+            'start_time': start_wall,
+            'msg_id_ranges': msg_id_ranges,
+        })
     return total_items_produced
 
+# Messages due within one window of this many seconds share a batch
+SCHEDULE_BATCH_WINDOW = 0.005
+# Batches prepared ahead of their due time
+SCHEDULE_LOOKAHEAD = 64
+# Time given to the preparer to fill the lookahead buffer before the first batch
+SCHEDULE_START_DELAY = 0.5
+# Schedule or send lag (seconds) above which a run did not keep up
+SCHEDULE_MAX_LAG = 0.1
+
+# msg_id of the first message a scheduled producer sends; msg_ids start at 1
+# as with the batch producer (AtomicInteger(1)), so record 0 is never sent
+FIRST_MSG_ID = 1
+
+def plan_batches(send_times, input_batchsize, batch_window=SCHEDULE_BATCH_WINDOW):
+    # First msg_id of every batch: messages due in the same batch_window slot,
+    # at most input_batchsize of them, share a batch (vectorized, no per
+    # message work)
+    if len(send_times) == 0:
+        return np.empty(0, dtype=np.int64)
+    slots = np.floor(np.asarray(send_times) / batch_window).astype(np.int64)
+    positions = np.arange(len(slots))
+    slot_starts = np.maximum.accumulate(np.where(np.concatenate(([True], slots[1:] != slots[:-1])), positions, 0))
+    return np.flatnonzero((positions - slot_starts) % input_batchsize == 0)
+
+def scheduled_producer(records, send_times, input_batchsize, input_map, batch_queue, num_consumers, producer_stats=None):
+    # Open-loop producer for a precomputed schedule: msg_id FIRST_MSG_ID + i
+    # is due send_times[i] seconds (sorted) after the start and records[msg_id]
+    # is its record. A preparer thread builds the planned batches into a bounded
+    # lookahead buffer, so generating messages stays off the timing path;
+    # the scheduler only sleeps until each due time and hands the batch to
+    # the consumers.
+    batch_starts = plan_batches(send_times, input_batchsize)
+    batch_ends = np.append(batch_starts[1:], len(send_times))
+    # Send-time offsets of the batches as plain floats
+    batch_offsets = np.asarray(send_times)[batch_starts].tolist()
+    batch_starts += FIRST_MSG_ID
+    batch_ends += FIRST_MSG_ID
+    start_wall = time.time() + SCHEDULE_START_DELAY
+    start_perf = time.perf_counter() + (start_wall - time.time())
+    lookahead = Queue(maxsize=SCHEDULE_LOOKAHEAD)
+
+    def prepare():
+        try:
+            for offset, start, end in zip(batch_offsets, batch_starts.tolist(), batch_ends.tolist()):
+                lookahead.put((offset, start, generate_input_data(records, start, end - start, input_map, start_wall + offset)))
+        finally:
+            lookahead.put(None)
+
+    total_items_produced = 0
+    batch_index = 0
+    max_lag = 0
+    total_lag = 0
+    last_emit_perf = start_perf
+    msg_id_ranges = []
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        preparer = executor.submit(prepare)
+        while True:
+            item = lookahead.get()
+            if item is None:
+                break
+            offset, input_index, input_data_list = item
+            sleep_until(start_perf + offset)
+            batch_queue.put((input_index, input_data_list))
+            add_msg_id_range(msg_id_ranges, input_index, len(input_data_list))
 
-def batch_consumer(kinesis_client, batch_queue, stream_name, partition_by = None):
+            last_emit_perf = time.perf_counter()
+            lag = last_emit_perf - start_perf - offset
+            max_lag = max(max_lag, lag)
+            total_lag += lag
+            total_items_produced += len(input_data_list)
+            batch_index += 1
+
+    for _ in range(num_consumers):
+        batch_queue.put(None)
+    # Re-raise a failure of the preparer
+    preparer.result()
+
+    elapsed = last_emit_perf - start_perf
+    mean_lag = total_lag / batch_index if batch_index else 0
+    schedule_span = batch_offsets[-1] if batch_offsets else 0
+    print(f"Scheduled producer finished. Total items produced: {total_items_produced} in {batch_index} batches")
+    print(f"Achieved rate: {total_items_produced / elapsed if elapsed > 0 else 0:.1f} records/s, "
+          f"max schedule lag: {max_lag * 1000:.2f} ms, mean schedule lag: {mean_lag * 1000:.2f} ms")
+    if producer_stats is not None:
+        producer_stats.update({
+            'achieved_rate': total_items_produced / elapsed if elapsed > 0 else 0,
+            'max_lag': max_lag,
+            'mean_lag': mean_lag,
+            'batches': batch_index,
+            'start_time': start_wall,
+            'schedule_span': schedule_span,
+            'elapsed': elapsed,
+            'msg_id_ranges': msg_id_ranges,
+        })
+    return total_items_produced
+
+def arrival_producer(records, schedule, rate, input_batchsize, input_map, batch_queue, duration, num_consumers, producer_stats=None):
+    # Sends on an arrival schedule (util.arrival): Poisson, ramp, step,
+    # sinusoid or on/off instead of evenly spaced batches
+    send_times = arrival_times(schedule, rate, duration)
+    if records is not None:
+        send_times = send_times[:max(len(records) - FIRST_MSG_ID, 0)]
+    print(f"Arrival producer started. Sending {len(send_times)} records on {describe_arrival(schedule)} "
+          f"over {duration} s.")
+    total_items_produced = scheduled_producer(records, send_times, input_batchsize, input_map, batch_queue,
+                                              num_consumers, producer_stats)
+    if producer_stats is not None:
+        producer_stats.update({'target_rate': len(send_times) / duration, 'arrival': describe_arrival(schedule)})
+    return total_items_produced
+
+def replay_producer(records, event_times, speedup, input_batchsize, input_map, batch_queue, duration, num_consumers, producer_stats=None):
+    # Event-time replay: msg_id i is due (event_times[i] -
+    # event_times[FIRST_MSG_ID]) / speedup seconds after the start, so the
+    # trace's gaps and bursts are kept, only compressed. event_times must be
+    # sorted and records[i] is the record of msg_id i.
+    event_times = event_times[FIRST_MSG_ID:]
+    count = len(event_times)
+    first_time = float(event_times[0]) if count else 0.0
+    # Records due within the duration
+    stop = int(np.searchsorted(event_times, first_time + duration * speedup, side='left')) if count else 0
+    send_times = (np.asarray(event_times[:stop], dtype=np.float64) - first_time) / speedup
+    print(f"Replay producer started. Replaying {stop} of {count} records at {speedup}x "
+          f"({stop and send_times[-1] * speedup:.1f} s of trace time).")
+    stats = {}
+    total_items_produced = scheduled_producer(records, send_times, input_batchsize, input_map, batch_queue,
+                                              num_consumers, stats)
+    achieved_speedup = speedup * stats['schedule_span'] / stats['elapsed'] if stats['elapsed'] > 0 else speedup
+    print(f"Target speed-up: {speedup}x, achieved: {achieved_speedup:.2f}x")
+    if producer_stats is not None:
+        producer_stats.update(stats)
+        producer_stats.update({'target_speedup': speedup, 'achieved_speedup': achieved_speedup})
+    return total_items_produced
+
+def check_schedule(producer_stats, send_arrays):
+    # Whether a scheduled run (replay or arrival schedule) kept up: the
+    # scheduler met every due time (the lookahead buffer never ran dry) and
+    # the consumer threads sent each batch soon after it was due (admitted
+    # time, rate limiter waits included). Adds the verdict to producer_stats.
+    send_lag = send_arrays['admitted_time'] - send_arrays['intended_time']
+    send_lag = send_lag[~np.isnan(send_lag)]
+    p99_send_lag = float(np.percentile(send_lag, 99)) if len(send_lag) else 0.0
+    if len(send_lag) and 'target_speedup' in producer_stats:
+        # Trace time covered over the wall time until the last send
+        intended_span = np.nanmax(send_arrays['intended_time']) - producer_stats['start_time']
+        sent_span = np.nanmax(send_arrays['admitted_time']) - producer_stats['start_time']
+        if sent_span > intended_span > 0:
+            producer_stats['achieved_speedup'] = producer_stats['target_speedup'] * intended_span / sent_span
+    problems = []
+    if producer_stats['max_lag'] > SCHEDULE_MAX_LAG:
+        problems.append(f"batches were prepared up to {producer_stats['max_lag'] * 1000:.0f} ms late")
+    if p99_send_lag > SCHEDULE_MAX_LAG:
+        problems.append(f"p99 wait for a consumer thread was {p99_send_lag * 1000:.0f} ms (more num_threads may help)")
+    producer_stats.update({'p99_send_lag': p99_send_lag, 'kept_up': not problems})
+    if problems:
+        if 'target_speedup' in producer_stats:
+            target = f"{producer_stats['target_speedup']}x replay (achieved {producer_stats['achieved_speedup']:.2f}x)"
+        else:
+            target = f"the {producer_stats['arrival']} schedule"
+        print(f"WARNING: the harness could not keep up with {target}: {'; '.join(problems)}")
+    return not problems
+
+
+def batch_consumer(kinesis_client, batch_queue, stream_name, partition_by = None, shard_ranges = None, aggregate = False, rate_limiter = None, put_stats = None, codec = None, send_log = None, extra_fields = None, verbose = True):
+    # extra_fields are constant fields added to every message (e.g. the memory
+    # size a sweep cell runs with); verbose=False drops the per-request line
+    extra_fields = extra_fields or {}
+    if codec is None:
+        codec = JsonCodec()
     while True:
         batch_data = batch_queue.get()  # Blocking call, waits indefinitely
         if batch_data is None:
@@ -69,6 +302,10 @@ def batch_consumer(kinesis_client, batch_queue, stream_name, partition_by = None
             break  # Use break instead of return for clarity
         # In here, chained id equals to msg id
         input_index, input_data_list = batch_data
+        # Stamped into the payloads once per batch, right before encoding;
+        # retries keep it
+        send_time = time.time()
+        intended_time = None
 
         inputs = [] 
         for i in range(len(input_data_list)):
@@ -76,6 +313,20 @@ def batch_consumer(kinesis_client, batch_queue, stream_name, partition_by = None
 
             # print(f"Consumed batch : {input_msg}")
 
+            if isinstance(input_msg, tuple):
+                # Pre-encoded corpus message, sent as JSON whatever the codec
+                # (produce() rejects a corpus with a non-JSON codec)
+                payload, partition_key, intended_time = input_msg
+                inputs.append({
+                    'Data': stamp_payload(payload, **extra_fields, intended_time=intended_time, send_time=send_time),
+                    'PartitionKey': partition_key
+                })
+                continue
+
+            input_msg.update(extra_fields)
+            input_msg['send_time'] = send_time
+            intended_time = input_msg.get('intended_time')
+
             # Use msg_id as partition key
             if partition_by is not None:
                 partition_key = str(input_msg[partition_by])
@@ -84,12 +335,35 @@ def batch_consumer(kinesis_client, batch_queue, stream_name, partition_by = None
 
             # Prepare record
             input = { 
-                'Data': json.dumps(input_msg),
+                'Data': codec.encode(input_msg),
                 'PartitionKey': partition_key
             }
             inputs.append(input)
 
-        if inputs:
-            put_to_stream_batch(kinesis_client, stream_name, inputs)
+        if inputs and aggregate:
+            # Pack many small messages into each Kinesis record (KPL format)
+            inputs = aggregate_records(inputs, shard_ranges)
+
+        # Split into per-shard requests within the PutRecords limits and wait
+        # for the rate limiter before taking the admitted time, so limiter
+        # waits count as harness delay, not as queueing latency. The send log
+        # keeps it next to the send_time the payloads carry.
+        batches = admit_batches(inputs, shard_ranges, rate_limiter, put_stats) if inputs else []
+        if send_log is not None and input_data_list:
+            # Batches are consecutive msg_ids starting at input_index
+            send_log.record(input_index, len(input_data_list), intended_time, send_time, time.time())
+
+        if batches:
+            send_batches(kinesis_client, stream_name, batches, rate_limiter, put_stats, verbose)
 
         batch_queue.task_done()
+
+def guarded_consumer(errors, *args, **kwargs):
+    # batch_consumer for a thread of its own: an exception that stops the
+    # consumer is kept in errors (a list) for the run summary instead of
+    # only being printed by the thread
+    try:
+        batch_consumer(*args, **kwargs)
+    except Exception as e:
+        print(f"Consumer thread failed: {type(e).__name__}: {e}")
+        errors.append(f"{type(e).__name__}: {e}")
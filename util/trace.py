@@ -0,0 +1,324 @@
+import itertools
+import os
+import struct
+from datetime import datetime, timezone
+
+import numpy as np
+
+from util.file import file_hash, DEFAULT_CACHE_DIR
+from util.storage import MappedFile
+
+# Numeric trace cache layout (little endian):
+#   magic (8 bytes) | row count (uint64) | rows (packed, the trace's columns,
+#   then how each text column was written; see field_decimals)
+# Only the columns the sources send are kept. The cache is built by one
+# streaming pass over the trace and memory-mapped afterwards, so neither
+# startup nor memory use depends on the trace size.
+TRACE_CACHE_MAGIC = b'EXPTRC01'
+TRACE_HEADER = struct.Struct('<8sQ')
+# Part of the cache file name; bumped whenever the columns of a kind change
+TRACE_CACHE_VERSION = 3
+# Rows parsed and written (or sorted) at a time while building a cache
+ROWS_PER_CHUNK = 1 << 20
+# Replay order file rows: event time (seconds) and row index in the cache
+REPLAY_DTYPE = np.dtype([('time', '<f8'), ('index', '<i8')])
+# Time bins counted to split a trace into buckets that are sorted one by one
+REPLAY_SORT_BINS = 1 << 16
+
+# Decimal places of a float field written without a decimal point, and of
+# one its value cannot be formatted back to (sent as repr(value))
+NO_POINT = -1
+UNFORMATTED = -2
+
+def format_field(value, decimals):
+    # A float field as written in the trace, given its decimal places; NaN
+    # (an empty field) as ""
+    if value != value:
+        return ''
+    if decimals == NO_POINT:
+        return str(int(value))
+    if decimals == UNFORMATTED:
+        return repr(value)
+    return f"{value:.{decimals}f}"
+
+def field_decimals(text, value):
+    # How a float field is written: the decimal places that format it back to
+    # exactly text (e.g. "20" and "20.0" stay apart), or UNFORMATTED
+    point = text.find('.')
+    decimals = NO_POINT if point < 0 else len(text) - point - 1
+    if decimals > np.iinfo(np.int8).max:
+        return UNFORMATTED
+    return decimals if format_field(value, decimals) == text or text == '' else UNFORMATTED
+
+def parse_sensor_line(line):
+    # data_sensor.txt: date time epoch moteid temperature humidity light voltage
+    fields = line.split()
+    if len(fields) < 5:
+        return None
+    try:
+        reading_time = datetime.fromisoformat(f"{fields[0]} {fields[1]}").replace(tzinfo=timezone.utc)
+        temperature = float(fields[4])
+        return int(fields[3]), temperature, reading_time.timestamp(), field_decimals(fields[4], temperature)
+    except ValueError:
+        return None
+
+def parse_machine_line(line):
+    # machine_usage.csv: machine_id (m_<n>), time_stamp, cpu_util_percent,
+    # mem_util_percent, ...; an empty utilisation is stored as NaN and sent
+    # as "" (or null with numeric payloads)
+    fields = line.rstrip('\r\n').split(',', 4)
+    if len(fields) < 4:
+        return None
+    try:
+        cpu = float(fields[2]) if fields[2] else float('nan')
+        mem = float(fields[3]) if fields[3] else float('nan')
+        return (
+            int(fields[0].split('_')[1]),
+            int(fields[1]),
+            cpu,
+            mem,
+            field_decimals(fields[2], cpu),
+            field_decimals(fields[3], mem),
+        )
+    except (ValueError, IndexError):
+        return None
+
+# Trace kinds: the row parser, the columns it returns in record order (an
+# input map refers to columns by this position), the float columns read from
+# the trace's text (the parser returns their decimal places after the
+# columns, in this order) and the event-time column (seconds) replay follows
+TRACES = {
+    'sensor': {
+        'parse': parse_sensor_line,
+        'columns': [('sensor_id', '<i4'), ('temperature', '<f8'), ('time', '<f8')],
+        'text_columns': ['temperature'],
+        'time_column': 'time',
+    },
+    'machine': {
+        'parse': parse_machine_line,
+        'columns': [('machine_id', '<i4'), ('timestamp', '<i8'), ('cpu', '<f8'), ('mem', '<f8')],
+        'text_columns': ['cpu', 'mem'],
+        'time_column': 'timestamp',
+    },
+}
+
+def trace_dtype(kind):
+    if kind not in TRACES:
+        raise ValueError(f"Unknown trace kind {kind}, choose from {sorted(TRACES)}")
+    return np.dtype(TRACES[kind]['columns'] + [(f"{name}_decimals", 'i1') for name in TRACES[kind]['text_columns']])
+
+def iter_trace_rows(file_path, kind):
+    # Lazily yields one tuple per well-formed line; malformed lines (short
+    # rows, missing or non-numeric ids) are skipped
+    parse = TRACES[kind]['parse']
+    with open(file_path, 'r') as file:
+        for line in file:
+            row = parse(line)
+            if row is not None:
+                yield row
+
+def build_trace_cache(file_path, kind, cache_path):
+    dtype = trace_dtype(kind)
+    rows = iter_trace_rows(file_path, kind)
+    count = 0
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as file:
+        # The count is filled in once every row is written
+        file.write(TRACE_HEADER.pack(TRACE_CACHE_MAGIC, 0))
+        while True:
+            chunk = np.fromiter(itertools.islice(rows, ROWS_PER_CHUNK), dtype=dtype)
+            if len(chunk) == 0:
+                break
+            file.write(chunk.tobytes())
+            count += len(chunk)
+        file.seek(0)
+        file.write(TRACE_HEADER.pack(TRACE_CACHE_MAGIC, count))
+    os.replace(tmp_path, cache_path)
+    print(f"Trace cache {cache_path} built with {count} rows")
+
+def text_values(values, decimals=None):
+    # A cache column as the strings the trace files hold: float fields as
+    # written (decimals, see field_decimals), NaN (an empty field) as "".
+    # Float columns not read from text (e.g. a parsed date) are sent as repr.
+    if values.dtype.kind in 'iu':
+        return [str(value) for value in values.tolist()]
+    if decimals is None:
+        return ['' if value != value else repr(value) for value in values.tolist()]
+    return [format_field(value, places) for value, places in zip(values.tolist(), decimals.tolist())]
+
+def numeric_values(values):
+    # A cache column as plain Python numbers, NaN as None (JSON null)
+    if values.dtype.kind == 'f' and np.isnan(values).any():
+        return [None if value != value else value for value in values.tolist()]
+    return values.tolist()
+
+class TraceRecords(MappedFile):
+    # Read-only records over a trace cache. Indexing returns tuples in column
+    # order, converted one column at a time: strings as in the trace file (the
+    # payload types the sources always sent) or, with numeric=True, plain
+    # Python numbers. column() returns a whole column as a mapped array.
+    def __init__(self, cache_path, kind, numeric=False):
+        self.cache_path = cache_path
+        self.kind = kind
+        self.numeric = numeric
+        super().__init__(cache_path, TRACE_CACHE_MAGIC, TRACE_HEADER, 'trace cache')
+        self.rows = np.frombuffer(self._mmap, dtype=trace_dtype(kind), count=self.count, offset=TRACE_HEADER.size)
+        self.columns = [name for name, _ in TRACES[kind]['columns']]
+        self.text_columns = TRACES[kind]['text_columns']
+
+    def _init_args(self):
+        return (self.cache_path, self.kind, self.numeric)
+
+    def column(self, name):
+        return self.rows[name]
+
+    def _tuples(self, rows):
+        if self.numeric:
+            return list(zip(*(numeric_values(rows[name]) for name in self.columns)))
+        return list(zip(*(text_values(rows[name], rows[f"{name}_decimals"] if name in self.text_columns else None)
+                          for name in self.columns)))
+
+    def records(self, start=0, stop=None):
+        start, stop, _ = slice(start, stop).indices(self.count)
+        if start >= stop:
+            return []
+        return self._tuples(self.rows[start:stop])
+
+    def take(self, indices):
+        # Records at arbitrary row indices, in the given order
+        return self._tuples(self.rows[np.asarray(indices)])
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            if index.step not in (None, 1):
+                raise ValueError("TraceRecords slices must be contiguous")
+            return self.records(index.start, index.stop)
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError("trace index out of range")
+        return self.records(index, index + 1)[0]
+
+    def __iter__(self):
+        batch = 65536
+        for start in range(0, self.count, batch):
+            yield from self.records(start, start + batch)
+
+    def close(self):
+        self.rows = None
+        super().close()
+
+def load_trace(file_path, kind, cache_dir=DEFAULT_CACHE_DIR, numeric=False):
+    # Returns TraceRecords over the numeric columns of a trace, parsing the
+    # file only if no cache exists for its content
+    trace_dtype(kind)
+    if not os.path.exists(file_path):
+        print(f"File {file_path} not found.")
+        return []
+    cache_path = os.path.join(
+        cache_dir,
+        f"{os.path.basename(file_path)}.{file_hash(file_path, cache_dir)[:16]}.{kind}.v{TRACE_CACHE_VERSION}.trace"
+    )
+    if not os.path.exists(cache_path):
+        os.makedirs(cache_dir, exist_ok=True)
+        build_trace_cache(file_path, kind, cache_path)
+    records = TraceRecords(cache_path, kind, numeric)
+    print(f"Total {kind} records: {len(records)}")
+    return records
+
+class ReplayRecords:
+    # A trace in event-time order: item i is records[order[i]], so msg_ids
+    # stay consecutive while the rows come from anywhere in the trace
+    def __init__(self, records, order):
+        self.records = records
+        self.order = order
+
+    def __len__(self):
+        return len(self.order)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            if index.step not in (None, 1):
+                raise ValueError("ReplayRecords slices must be contiguous")
+            return self.records.take(self.order[index])
+        return self.records.take(self.order[index:index + 1])[0]
+
+def is_sorted(values):
+    # Checked one chunk at a time, so a mapped column is never loaded whole
+    previous = None
+    for start in range(0, len(values), ROWS_PER_CHUNK):
+        chunk = values[start:start + ROWS_PER_CHUNK]
+        if (previous is not None and chunk[0] < previous) or (chunk[1:] < chunk[:-1]).any():
+            return False
+        previous = chunk[-1]
+    return True
+
+def write_replay_order(times, order_path):
+    # Stable sort of a mapped time column into an .npy file of (time, index)
+    # rows, holding about ROWS_PER_CHUNK rows in memory at a time:
+    # 1. count the rows in REPLAY_SORT_BINS equal-width time bins
+    # 2. group consecutive bins into buckets of at most ROWS_PER_CHUNK rows (a
+    #    single fuller bin, e.g. many equal times, is a bucket of its own)
+    # 3. scatter each chunk of rows to its bucket's region of the output, in
+    #    row order
+    # 4. sort each bucket in memory, stable, so equal times keep row order
+    chunks = range(0, len(times), ROWS_PER_CHUNK)
+    low = min(float(times[start:start + ROWS_PER_CHUNK].min()) for start in chunks)
+    high = max(float(times[start:start + ROWS_PER_CHUNK].max()) for start in chunks)
+    scale = REPLAY_SORT_BINS / (high - low) if high > low else 0.0
+
+    def time_bins(chunk):
+        return np.minimum(((chunk - low) * scale).astype(np.int64), REPLAY_SORT_BINS - 1)
+
+    bin_counts = np.zeros(REPLAY_SORT_BINS, dtype=np.int64)
+    for start in chunks:
+        chunk = np.asarray(times[start:start + ROWS_PER_CHUNK], dtype=np.float64)
+        bin_counts += np.bincount(time_bins(chunk), minlength=REPLAY_SORT_BINS)
+
+    bucket_of_bin = np.empty(REPLAY_SORT_BINS, dtype=np.int64)
+    sizes = []
+    for index, count in enumerate(bin_counts.tolist()):
+        if not sizes or (sizes[-1] and sizes[-1] + count > ROWS_PER_CHUNK):
+            sizes.append(0)
+        bucket_of_bin[index] = len(sizes) - 1
+        sizes[-1] += count
+    sizes = np.array(sizes, dtype=np.int64)
+    starts = np.cumsum(sizes) - sizes
+
+    tmp_path = f"{order_path}.{os.getpid()}.tmp"
+    replay = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=REPLAY_DTYPE, shape=(len(times),))
+    filled = np.zeros(len(sizes), dtype=np.int64)
+    for start in chunks:
+        chunk = np.asarray(times[start:start + ROWS_PER_CHUNK], dtype=np.float64)
+        buckets = bucket_of_bin[time_bins(chunk)]
+        order = np.argsort(buckets, kind='stable')
+        sorted_buckets = buckets[order]
+        counts = np.bincount(buckets, minlength=len(sizes))
+        # Position in the output: the bucket's region, after the rows earlier
+        # chunks put there, then the row's rank among this chunk's rows
+        rank = np.arange(len(chunk)) - (np.cumsum(counts) - counts)[sorted_buckets]
+        positions = starts[sorted_buckets] + filled[sorted_buckets] + rank
+        replay['time'][positions] = chunk[order]
+        replay['index'][positions] = start + order
+        filled += counts
+    for start, size in zip(starts.tolist(), sizes.tolist()):
+        bucket = replay[start:start + size]
+        replay[start:start + size] = bucket[np.argsort(bucket['time'], kind='stable')]
+    replay.flush()
+    del replay
+    os.replace(tmp_path, order_path)
+
+def replay_order(records):
+    # Returns (records in event-time order, event_times): the trace sorted by
+    # event time (stable, so rows with equal times keep their file order) and
+    # the sorted times in seconds. A trace already in time order is returned
+    # as it is; otherwise the order is computed once, out of core, and
+    # memory-mapped from a file beside the trace cache.
+    times = records.column(TRACES[records.kind]['time_column'])
+    if is_sorted(times):
+        return records, times
+    order_path = f"{records.cache_path}.order.npy"
+    if not os.path.exists(order_path):
+        write_replay_order(times, order_path)
+    replay = np.load(order_path, mmap_mode='r')
+    return ReplayRecords(records, replay['index']), replay['time']